@@ -1,47 +1,270 @@
+import hashlib
+import json
+import os
 import pickle
-import pandas as pd
+import threading
+import time
+from contextlib import nullcontext
+from types import MappingProxyType
 import numpy as np
-from ml_model.data_preprocessing import preprocess_features
+from ml_model.data_preprocessing import (
+    build_model_input, category_code_tables, model_input_for, CATEGORICAL_FEATURES, NUMERICAL_FEATURES
+)
+
+_NO_STAGE = nullcontext()
+
+# Batch sizes scored with synthetic rows after every load, before the model is
+# published; empty disables warmup
+MODEL_WARMUP_BATCH_SIZES = [
+    int(size) for size in os.environ.get('MODEL_WARMUP_BATCH_SIZES', '1,10,100,1000').split(',') if size.strip()
+]
+MODEL_WARMUP_ROUNDS = int(os.environ.get('MODEL_WARMUP_ROUNDS', 2))
+# Rows preprocessed and scored between deadline checks in predict_batch
+DEADLINE_CHUNK_SIZE = int(os.environ.get('DEADLINE_CHUNK_SIZE', 25))
+# Concurrent single predictions of identical features share one computation
+PREDICTION_COALESCING_ENABLED = os.environ.get('PREDICTION_COALESCING_ENABLED', 'true').lower() == 'true'
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes; `results` holds any rows already scored"""
+    
+    def __init__(self, phase, results=None):
+        super().__init__(f"Deadline exceeded during {phase}")
+        self.phase = phase
+        self.results = results or []
+
+class Deadline:
+    """Point in time after which a request's remaining work is abandoned"""
+    __slots__ = ('expires_at',)
+    
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+    
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+    
+    def check(self, phase):
+        """Raise DeadlineExceeded if the deadline has passed"""
+        if time.monotonic() >= self.expires_at:
+            raise DeadlineExceeded(phase)
+
+def feature_fingerprint(record):
+    """Hash of the model's features in canonical form; None when a value cannot be normalised.
+    
+    Numbers are compared as floats and fields the model ignores are left out,
+    so `{"age": 45}` and `{"age": 45.0, "note": "x"}` share a fingerprint.
+    """
+    try:
+        canonical = [float(record[feature]) for feature in NUMERICAL_FEATURES]
+        canonical += [str(record[feature]) for feature in CATEGORICAL_FEATURES]
+    except (KeyError, TypeError, ValueError):
+        return None
+    return hashlib.blake2b(json.dumps(canonical).encode(), digest_size=16).hexdigest()
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+    
+    The first caller of a key runs the function; callers arriving while it
+    runs wait for it and receive the same result (or exception). Nothing is
+    kept once the call finishes, so this never serves a stale result.
+    """
+    
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+    
+    def do(self, key, fn, timeout=None):
+        """Run fn() once per key at a time; returns (result, shared).
+        
+        Raises TimeoutError when a waiter gives up after `timeout` seconds.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+                leader = True
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+                leader = False
+        
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise TimeoutError("Timed out waiting for a coalesced call")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        
+        try:
+            flight.result = fn()
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+    
+    def get_stats(self):
+        with self._lock:
+            in_flight = len(self._flights)
+        calls = self.leaders + self.coalesced
+        return {
+            'computed': self.leaders,
+            'coalesced': self.coalesced,
+            'in_flight': in_flight,
+            'coalesced_ratio': round(self.coalesced / calls, 4) if calls else 0.0
+        }
+
+def _stage(timer, name):
+    """Time a block as stage `name` when a stage timer is supplied"""
+    return timer.stage(name) if timer is not None else _NO_STAGE
 
 class ChurnPredictor:
-    def __init__(self, model_path='models/churn_model.pkl'):
-        """Initialize the churn predictor with trained model"""
+    """Churn model wrapper that is safe to share between threads.
+    
+    The loaded artifacts are an immutable snapshot: every prediction reads
+    `model_artifacts` once and uses that snapshot throughout, and `load_model`
+    builds a complete new snapshot before swapping the reference. Requests
+    therefore never take a lock and never see a half-reloaded model.
+    
+    A new snapshot is warmed up with synthetic predictions before it is
+    published, so the predictor only becomes ready (and a reload only takes
+    effect) once the model is at steady-state speed.
+    
+    Concurrent `predict_single` calls with the same feature fingerprint on the
+    same snapshot are coalesced: one thread scores, the others wait for it.
+    """
+    
+    def __init__(self, model_path='models/churn_model.pkl', autoload=True, warmup_on_load=True):
+        """Initialize the churn predictor, loading the trained model unless autoload is False.
+        
+        warmup_on_load=False publishes models without scoring the warmup batches,
+        e.g. to measure a cold first call.
+        """
         self.model_path = model_path
         self.model_artifacts = None
-        self.load_model()
+        self.warmup_on_load = warmup_on_load
+        self.warmup_stats = None
+        self.flights = SingleFlight()
+        self._reload_lock = threading.Lock()
+        if autoload:
+            self.load_model()
     
     def load_model(self):
         """Load the trained model and preprocessors"""
-        try:
-            with open(self.model_path, 'rb') as f:
-                self.model_artifacts = pickle.load(f)
-            print(f"Model loaded successfully. Accuracy: {self.model_artifacts['accuracy']:.4f}")
-        except FileNotFoundError:
-            print(f"Model file not found at {self.model_path}. Please train the model first.")
-            self.model_artifacts = None
-    
-    def predict_single(self, customer_data):
+        with self._reload_lock:
+            try:
+                with open(self.model_path, 'rb') as f:
+                    artifacts = pickle.load(f)
+                # Lookup tables for build_model_input, built once per model
+                artifacts['category_codes'] = category_code_tables(artifacts['encoders'])
+                artifacts = MappingProxyType(artifacts)
+                self.warmup_stats = self._warmup(artifacts) if self.warmup_on_load else None
+                self.model_artifacts = artifacts
+                print(f"Model loaded successfully. Accuracy: {artifacts['accuracy']:.4f}")
+            except FileNotFoundError:
+                print(f"Model file not found at {self.model_path}. Please train the model first.")
+                self.model_artifacts = None
+    
+    def is_ready(self):
+        """Whether a loaded and warmed model is serving"""
+        return self.model_artifacts is not None
+    
+    def warmup(self):
+        """Warm the current model again, e.g. in a freshly forked worker"""
+        artifacts = self.model_artifacts
+        if artifacts is not None:
+            self.warmup_stats = self._warmup(artifacts)
+        return self.warmup_stats
+    
+    def _warmup(self, artifacts, batch_sizes=None, rounds=None):
+        """Score synthetic batches of every configured size with a snapshot"""
+        batch_sizes = MODEL_WARMUP_BATCH_SIZES if batch_sizes is None else batch_sizes
+        rounds = MODEL_WARMUP_ROUNDS if rounds is None else rounds
+        if not batch_sizes or rounds <= 0:
+            return None
+        
+        records = _synthetic_records(artifacts, max(batch_sizes))
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for size in batch_sizes:
+                self._score(artifacts, records[:size])
+        return {
+            'batch_sizes': list(batch_sizes),
+            'rounds': rounds,
+            'seconds': round(time.perf_counter() - start, 4)
+        }
+    
+    def _score(self, artifacts, data, timer=None, deadline=None):
+        """Preprocess records or a DataFrame and return (predictions, probabilities) from a snapshot"""
+        model = artifacts['model']
+        with _stage(timer, 'preprocess'):
+            # One C-contiguous float32 matrix, which the trees read without converting
+            X = build_model_input(
+                data,
+                artifacts['scaler'],
+                artifacts['encoders'],
+                artifacts['feature_names'],
+                category_codes=artifacts.get('category_codes')
+            )
+            X = model_input_for(model, X)
+        
+        if deadline is not None:
+            deadline.check('preprocessing')
+        
+        with _stage(timer, 'predict'):
+            # predict() would run predict_proba() a second time to take the argmax
+            probabilities = model.predict_proba(X)
+            predictions = model.classes_.take(probabilities.argmax(axis=1))
+        return predictions, probabilities
+    
+    def predict_single(self, customer_data, timer=None, deadline=None):
         """Predict churn for a single customer"""
-        if self.model_artifacts is None:
+        artifacts = self.model_artifacts
+        if artifacts is None:
             raise ValueError("Model not loaded. Please train the model first.")
         
-        # Convert to DataFrame if it's a dict
+        # Wrap a single dict as a one-row batch
         if isinstance(customer_data, dict):
-            df = pd.DataFrame([customer_data])
-        else:
-            df = customer_data.copy()
+            customer_data = [customer_data]
         
-        # Preprocess the data
-        df_processed = preprocess_features(
-            df, 
-            scaler=self.model_artifacts['scaler'],
-            encoders=self.model_artifacts['encoders'],
-            fit_transform=False
-        )
+        if deadline is not None:
+            deadline.check('queueing')
+        fingerprint = None
+        if PREDICTION_COALESCING_ENABLED and len(customer_data) == 1:
+            fingerprint = feature_fingerprint(customer_data[0])
         
-        # Make prediction
-        prediction = self.model_artifacts['model'].predict(df_processed)[0]
-        probability = self.model_artifacts['model'].predict_proba(df_processed)[0]
+        if fingerprint is None:
+            predictions, probabilities = self._score(artifacts, customer_data, timer, deadline)
+        else:
+            # id() is unique while the snapshot is alive, which it is for the whole flight
+            key = (id(artifacts), fingerprint)
+            timeout = max(0.0, deadline.remaining()) if deadline is not None else None
+            try:
+                (predictions, probabilities), shared = self.flights.do(
+                    key, lambda: self._score(artifacts, customer_data, timer, deadline), timeout=timeout
+                )
+            except TimeoutError:
+                raise DeadlineExceeded('queueing')
+            except DeadlineExceeded:
+                # Another caller's deadline is not ours; score it ourselves if we still have time
+                if deadline is not None and deadline.remaining() <= 0:
+                    raise
+                predictions, probabilities = self._score(artifacts, customer_data, timer, deadline)
+        prediction, probability = predictions[0], probabilities[0]
         
         return {
             'churn_prediction': int(prediction),
@@ -49,52 +272,96 @@ class ChurnPredictor:
             'no_churn_probability': float(probability[0])
         }
     
-    def predict_batch(self, customers_data):
-        """Predict churn for multiple customers"""
-        if self.model_artifacts is None:
-            raise ValueError("Model not loaded. Please train the model first.")
-        
-        # Convert to DataFrame if it's a list of dicts
-        if isinstance(customers_data, list):
-            df = pd.DataFrame(customers_data)
-        else:
-            df = customers_data.copy()
+    def predict_batch(self, customers_data, timer=None, deadline=None):
+        """Predict churn for multiple customers.
         
-        # Preprocess the data
-        df_processed = preprocess_features(
-            df,
-            scaler=self.model_artifacts['scaler'],
-            encoders=self.model_artifacts['encoders'],
-            fit_transform=False
-        )
+        With a deadline, rows are scored in chunks of DEADLINE_CHUNK_SIZE and the
+        deadline is checked before and after preprocessing each chunk; when it
+        passes, DeadlineExceeded carries the rows scored so far.
+        """
+        artifacts = self.model_artifacts
+        if artifacts is None:
+            raise ValueError("Model not loaded. Please train the model first.")
         
-        # Make predictions
-        predictions = self.model_artifacts['model'].predict(df_processed)
-        probabilities = self.model_artifacts['model'].predict_proba(df_processed)
+        if deadline is None:
+            predictions, probabilities = self._score(artifacts, customers_data, timer)
+            return _format_batch(predictions, probabilities)
         
         results = []
-        for i, (pred, prob) in enumerate(zip(predictions, probabilities)):
-            results.append({
-                'customer_index': i,
-                'churn_prediction': int(pred),
-                'churn_probability': float(prob[1]),
-                'no_churn_probability': float(prob[0])
-            })
+        for start in range(0, len(customers_data), DEADLINE_CHUNK_SIZE):
+            if isinstance(customers_data, list):
+                chunk = customers_data[start:start + DEADLINE_CHUNK_SIZE]
+            else:
+                chunk = customers_data.iloc[start:start + DEADLINE_CHUNK_SIZE]
+            try:
+                deadline.check('scoring' if results else 'queueing')
+                predictions, probabilities = self._score(artifacts, chunk, timer, deadline)
+            except DeadlineExceeded as e:
+                e.results = results
+                raise
+            results.extend(_format_batch(predictions, probabilities, offset=start))
         
         return results
     
+    def get_model_version(self):
+        """Get the version tag of the loaded model"""
+        artifacts = self.model_artifacts
+        if artifacts is None:
+            return None
+        return artifacts.get('model_version', 'v1.0')
+    
+    def get_reference_profile(self):
+        """Get the training-time feature distributions stored with the model, if any"""
+        artifacts = self.model_artifacts
+        if artifacts is None:
+            return None
+        return artifacts.get('reference_profile')
+    
     def get_model_info(self):
         """Get information about the loaded model"""
-        if self.model_artifacts is None:
+        artifacts = self.model_artifacts
+        if artifacts is None:
             return {"error": "Model not loaded"}
         
         return {
             "model_type": "RandomForestClassifier",
-            "accuracy": self.model_artifacts['accuracy'],
-            "feature_names": self.model_artifacts['feature_names'],
-            "model_loaded": True
+            "model_version": self.get_model_version(),
+            "accuracy": artifacts['accuracy'],
+            "feature_names": artifacts['feature_names'],
+            # None for models fitted on DataFrames, which are still served through one
+            "input_format": artifacts.get('input_format'),
+            "model_loaded": True,
+            "warmup": self.warmup_stats
         }
 
+def _format_batch(predictions, probabilities, offset=0):
+    results = []
+    for i, (pred, prob) in enumerate(zip(predictions, probabilities)):
+        results.append({
+            'customer_index': offset + i,
+            'churn_prediction': int(pred),
+            'churn_probability': float(prob[1]),
+            'no_churn_probability': float(prob[0])
+        })
+    return results
+
+def _synthetic_records(artifacts, count):
+    """Plausible input rows for warmup, in the model's feature order"""
+    scaler = artifacts['scaler']
+    encoders = artifacts['encoders']
+    records = []
+    for i in range(count):
+        record = {}
+        for feature in artifacts['feature_names']:
+            if feature in encoders:
+                classes = encoders[feature].classes_
+                record[feature] = classes[i % len(classes)]
+            else:
+                mean = scaler.mean_[NUMERICAL_FEATURES.index(feature)]
+                record[feature] = float(mean * (0.5 + (i % 10) / 10))
+        records.append(record)
+    return records
+
 def validate_customer_data(data):
     """Validate customer data format"""
     required_fields = [
@@ -1,7 +1,33 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.model_selection import train_test_split
+
+NUMERICAL_FEATURES = ['age', 'tenure', 'monthly_charges', 'total_charges']
+CATEGORICAL_FEATURES = ['contract_type', 'payment_method', 'internet_service', 'online_security', 'tech_support']
+
+# Number of quantile bins in the reference histograms of numerical features
+REFERENCE_BINS = 10
+
+# sklearn's trees compare float32 features and convert anything else to a new
+# C-contiguous float32 array on every call, so the pipelines produce that layout
+# directly. The format is recorded in the model artifacts.
+MODEL_INPUT_FORMAT = {'dtype': 'float32', 'order': 'C'}
+
+# Preprocessed training splits are cached here, keyed by a hash of the raw data
+# source and the preprocessing config
+TRAINING_CACHE_ENABLED = os.environ.get('TRAINING_CACHE_ENABLED', 'true').lower() == 'true'
+TRAINING_CACHE_DIR = os.environ.get('TRAINING_CACHE_DIR', 'data/cache')
+# Least recently used entries are deleted once the cache grows past this
+TRAINING_CACHE_MAX_BYTES = int(os.environ.get('TRAINING_CACHE_MAX_BYTES', 1024 ** 3))
+TEST_SIZE = 0.2
+SPLIT_RANDOM_STATE = 42
+# Bump when the cached layout or the preprocessing code changes meaning
+_CACHE_FORMAT = 2
 
 def create_sample_data():
     """Create sample customer churn data for training"""
@@ -46,10 +72,13 @@ def preprocess_features(df, scaler=None, encoders=None, fit_transform=True):
         df_processed = df_processed.drop('customer_id', axis=1)
     
     # Separate numerical and categorical features
-    numerical_features = ['age', 'tenure', 'monthly_charges', 'total_charges']
-    categorical_features = ['contract_type', 'payment_method', 'internet_service', 'online_security', 'tech_support']
+    numerical_features = NUMERICAL_FEATURES
+    categorical_features = CATEGORICAL_FEATURES
     
     if fit_transform:
+        # Only needed for training; serving uses the fitted objects from the model file
+        from sklearn.preprocessing import StandardScaler, LabelEncoder
+        
         # Initialize scalers and encoders
         scaler = StandardScaler()
         encoders = {}
@@ -73,20 +102,219 @@ def preprocess_features(df, scaler=None, encoders=None, fit_transform=True):
             
         return df_processed
 
-def prepare_training_data():
-    """Prepare data for model training"""
-    df = create_sample_data()
+def to_model_input(X, dtype=MODEL_INPUT_FORMAT['dtype']):
+    """Processed features as a C-contiguous float32 matrix; no copy when X already is one"""
+    if isinstance(X, pd.DataFrame):
+        X = X.to_numpy(dtype=dtype)
+    return np.ascontiguousarray(X, dtype=dtype)
+
+def category_code_tables(encoders):
+    """Per categorical feature, a dict from category to its LabelEncoder code"""
+    return {feature: {value: code for code, value in enumerate(encoder.classes_)}
+            for feature, encoder in encoders.items()}
+
+def build_model_input(data, scaler, encoders, feature_names, category_codes=None,
+                      dtype=MODEL_INPUT_FORMAT['dtype']):
+    """Preprocess raw records (list of dicts or DataFrame) straight into the model's input matrix.
+    
+    Gives the values of preprocess_features cast to float32, but writes them
+    into one preallocated C-contiguous array in `feature_names` order without
+    building any intermediate DataFrame. Pass `category_codes` (from
+    category_code_tables) to skip rebuilding the lookup tables per call.
+    """
+    if category_codes is None:
+        category_codes = category_code_tables(encoders)
+    is_frame = isinstance(data, pd.DataFrame)
+    column = {feature: i for i, feature in enumerate(feature_names)}
+    X = np.empty((len(data), len(feature_names)), dtype=dtype)
+    
+    # Scale in float64 like StandardScaler.transform, then round once into X
+    numerical = np.empty((len(data), len(NUMERICAL_FEATURES)))
+    for j, feature in enumerate(NUMERICAL_FEATURES):
+        numerical[:, j] = data[feature].to_numpy(dtype=np.float64) if is_frame else [record[feature] for record in data]
+    numerical -= scaler.mean_
+    numerical /= scaler.scale_
+    for j, feature in enumerate(NUMERICAL_FEATURES):
+        X[:, column[feature]] = numerical[:, j]
+    
+    for feature in CATEGORICAL_FEATURES:
+        codes = category_codes[feature]
+        values = data[feature] if is_frame else (record[feature] for record in data)
+        try:
+            X[:, column[feature]] = [codes[value] for value in values]
+        except KeyError as e:
+            raise ValueError(f"{feature} contains previously unseen label: {e.args[0]!r}")
+    return X
+
+def model_input_for(model, X):
+    """Wrap X in a DataFrame for models fitted on DataFrames (before the input format was recorded)"""
+    if hasattr(model, 'feature_names_in_'):
+        return pd.DataFrame(X, columns=model.feature_names_in_, copy=False)
+    return X
+
+def build_reference_profile(df):
+    """Summarize raw training features as reference histograms for drift detection"""
+    profile = {'numerical': {}, 'categorical': {}, 'samples': len(df)}
+    
+    for feature in NUMERICAL_FEATURES:
+        values = df[feature].astype(float).to_numpy()
+        # Interior quantile edges; bin i holds values in [edges[i-1], edges[i])
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, REFERENCE_BINS + 1)[1:-1]))
+        counts = np.bincount(np.searchsorted(edges, values, side='right'), minlength=len(edges) + 1)
+        profile['numerical'][feature] = {
+            'edges': edges.tolist(),
+            'proportions': (counts / len(values)).tolist(),
+            'mean': float(values.mean()),
+            'std': float(values.std())
+        }
+    
+    for feature in CATEGORICAL_FEATURES:
+        profile['categorical'][feature] = df[feature].value_counts(normalize=True).to_dict()
+    
+    return profile
+
+def training_cache_key(source=None):
+    """Content hash of a raw data source plus everything that shapes its preprocessing.
+    
+    A CSV source is hashed by its bytes; the synthetic source by the code of
+    create_sample_data (it is seeded, so the code determines the data). Either
+    way the data itself is not regenerated just to compute the key.
+    """
+    import sklearn
+    
+    digest = hashlib.blake2b(digest_size=16)
+    if source is None:
+        digest.update(inspect.getsource(create_sample_data).encode())
+    else:
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    digest.update(json.dumps({
+        'format': _CACHE_FORMAT,
+        'numerical': NUMERICAL_FEATURES,
+        'categorical': CATEGORICAL_FEATURES,
+        'preprocess': inspect.getsource(preprocess_features),
+        'test_size': TEST_SIZE,
+        'random_state': SPLIT_RANDOM_STATE,
+        'sklearn': sklearn.__version__
+    }, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def _load_cached_split(path):
+    """Memory-map a cached split; the arrays are only paged in as training reads them.
+    
+    The feature arrays are stored C-contiguous float32, so to_model_input on
+    the returned frames hands the mapped arrays to the model without copying.
+    """
+    # The directory's mtime marks the entry as recently used for pruning
+    os.utime(path)
+    with open(os.path.join(path, 'columns.json')) as f:
+        columns = json.load(f)
+    with open(os.path.join(path, 'transformers.pkl'), 'rb') as f:
+        scaler, encoders = pickle.load(f)
+    arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+              for name in ('X_train', 'X_test', 'y_train', 'y_test')}
+    return (
+        pd.DataFrame(arrays['X_train'], columns=columns, copy=False),
+        pd.DataFrame(arrays['X_test'], columns=columns, copy=False),
+        pd.Series(arrays['y_train'], name='churn', copy=False),
+        pd.Series(arrays['y_test'], name='churn', copy=False),
+        scaler,
+        encoders
+    )
+
+def _store_split(path, X_train, X_test, y_train, y_test, scaler, encoders, reference_profile):
+    # Write into a temporary directory and rename it, so readers see all files or none
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    os.makedirs(tmp_path, exist_ok=True)
+    np.save(os.path.join(tmp_path, 'X_train.npy'), to_model_input(X_train))
+    np.save(os.path.join(tmp_path, 'X_test.npy'), to_model_input(X_test))
+    np.save(os.path.join(tmp_path, 'y_train.npy'), y_train.to_numpy())
+    np.save(os.path.join(tmp_path, 'y_test.npy'), y_test.to_numpy())
+    with open(os.path.join(tmp_path, 'columns.json'), 'w') as f:
+        json.dump(X_train.columns.tolist(), f)
+    with open(os.path.join(tmp_path, 'transformers.pkl'), 'wb') as f:
+        pickle.dump((scaler, encoders), f)
+    with open(os.path.join(tmp_path, 'reference_profile.json'), 'w') as f:
+        json.dump(reference_profile, f)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # Another run cached the same key first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+def _directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def prune_training_cache(cache_dir=None, max_bytes=None, keep=None):
+    """Delete least recently used cache entries until the cache fits in max_bytes, returns the removed keys"""
+    cache_dir = TRAINING_CACHE_DIR if cache_dir is None else cache_dir
+    max_bytes = TRAINING_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(cache_dir):
+        return []
+    
+    # Skip other runs' half-written temporary directories
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if '.tmp' not in name]
+    entries = sorted((path for path in entries if os.path.isdir(path)), key=os.path.getmtime)
+    total = sum(_directory_bytes(path) for path in entries)
+    removed = []
+    for path in entries:
+        if total <= max_bytes:
+            break
+        if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        total -= _directory_bytes(path)
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(os.path.basename(path))
+    return removed
+
+def training_reference_profile(source=None, use_cache=None, cache_dir=None):
+    """Reference profile of the raw training data, from the cache entry when there is one"""
+    use_cache = TRAINING_CACHE_ENABLED if use_cache is None else use_cache
+    cache_dir = TRAINING_CACHE_DIR if cache_dir is None else cache_dir
+    if use_cache:
+        path = os.path.join(cache_dir, training_cache_key(source), 'reference_profile.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+    return build_reference_profile(create_sample_data() if source is None else pd.read_csv(source))
+
+def prepare_training_data(source=None, use_cache=None, cache_dir=None):
+    """Prepare data for model training.
+    
+    `source` is a CSV with the features and a churn label; by default the
+    synthetic sample data is used. The preprocessed splits and fitted
+    transformers are cached under `cache_dir`, keyed by training_cache_key,
+    and later runs memory-map them instead of rebuilding them. The raw data's
+    reference profile is cached with them (see training_reference_profile),
+    and the cache is pruned to TRAINING_CACHE_MAX_BYTES after each new entry.
+    """
+    use_cache = TRAINING_CACHE_ENABLED if use_cache is None else use_cache
+    cache_dir = TRAINING_CACHE_DIR if cache_dir is None else cache_dir
+    if use_cache:
+        path = os.path.join(cache_dir, training_cache_key(source))
+        if os.path.isdir(path):
+            return _load_cached_split(path)
+    
+    from sklearn.model_selection import train_test_split
+    
+    df = create_sample_data() if source is None else pd.read_csv(source)
     
     # Separate features and target
     X = df.drop('churn', axis=1)
     y = df['churn']
     
-    # Preprocess features
+    # Preprocess features into the model's float32 layout
     X_processed, scaler, encoders = preprocess_features(X, fit_transform=True)
+    X_processed = pd.DataFrame(to_model_input(X_processed), columns=X_processed.columns,
+                               index=X_processed.index, copy=False)
     
     # Split data
     X_train, X_test, y_train, y_test = train_test_split(
-        X_processed, y, test_size=0.2, random_state=42, stratify=y
+        X_processed, y, test_size=TEST_SIZE, random_state=SPLIT_RANDOM_STATE, stratify=y
     )
     
+    if use_cache:
+        _store_split(path, X_train, X_test, y_train, y_test, scaler, encoders, build_reference_profile(df))
+        prune_training_cache(cache_dir, keep=path)
     return X_train, X_test, y_train, y_test, scaler, encoders
\ No newline at end of file
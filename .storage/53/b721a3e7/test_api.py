@@ -1,6 +1,7 @@
 import pytest
 import json
 import sys
+import time
 import os
 
 # Add the parent directory to the path so we can import our modules
@@ -45,6 +46,30 @@ class TestHealthEndpoint:
         assert data['status'] == 'healthy'
         assert data['service'] == 'Customer Churn Prediction API'
         assert 'model_loaded' in data
+    
+    def test_liveness_and_readiness(self, client):
+        """Test probes report ready once the model is loaded and warmed up"""
+        response = client.get('/livez')
+        assert response.status_code == 200
+        
+        response = client.get('/readyz')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['status'] == 'ready'
+        assert data['warmup']['batch_sizes']
+    
+    def test_readiness_without_model(self, client):
+        """Test readiness fails while no model is loaded"""
+        from app.routes import predictor
+        
+        artifacts = predictor.model_artifacts
+        predictor.model_artifacts = None
+        try:
+            response = client.get('/readyz')
+            assert response.status_code == 503
+            assert client.get('/livez').status_code == 200
+        finally:
+            predictor.model_artifacts = artifacts
 
 class TestModelInfoEndpoint:
     """Test model info endpoint"""
@@ -72,6 +97,158 @@ class TestMetricsEndpoint:
         assert 'metrics' in data
         assert 'uptime_seconds' in data['metrics']
         assert 'total_requests' in data['metrics']
+        assert 'dropped' in data['metrics']['logging']
+        assert 'predictions_sampled_out' in data['metrics']['logging']
+
+class TestPrometheusEndpoint:
+    """Test Prometheus metrics endpoint"""
+    
+    def test_prometheus_endpoint(self, client, sample_customer_data):
+        """Test Prometheus endpoint renders counters, histograms and prediction classes"""
+        client.post('/predict',
+                    data=json.dumps(sample_customer_data),
+                    content_type='application/json')
+        
+        response = client.get('/metrics/prometheus')
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain')
+        
+        body = response.data.decode()
+        assert 'churn_api_requests_total{endpoint="main.predict_single"' in body
+        assert 'churn_api_request_duration_seconds_bucket{endpoint="main.predict_single",le="+Inf"}' in body
+        assert 'churn_api_predictions_total{churn_prediction=' in body
+
+class TestFeedbackEndpoint:
+    """Test ground-truth feedback and live quality endpoints"""
+    
+    def test_feedback_updates_quality(self, client, sample_customer_data):
+        """Test labelling a prediction shows up in the quality metrics"""
+        response = client.post('/predict',
+                             data=json.dumps(sample_customer_data),
+                             content_type='application/json')
+        prediction = json.loads(response.data)['prediction']
+        assert 'prediction_id' in prediction
+        
+        feedback = [
+            {"prediction_id": prediction['prediction_id'], "actual_churn": 1},
+            {"prediction_id": "unknown-id", "actual_churn": 0}
+        ]
+        response = client.post('/feedback',
+                             data=json.dumps(feedback),
+                             content_type='application/json')
+        assert response.status_code == 200
+        
+        data = json.loads(response.data)
+        assert data['accepted'] == 1
+        assert data['unknown_prediction_ids'] == ["unknown-id"]
+        
+        response = client.get('/model/quality')
+        data = json.loads(response.data)
+        quality = data['quality'][data['current_model_version']]
+        assert quality['labelled_predictions'] >= 1
+        assert 'precision' in quality
+        assert 'recall' in quality
+    
+    def test_feedback_invalid_label(self, client):
+        """Test feedback rejects labels other than 0/1"""
+        response = client.post('/feedback',
+                             data=json.dumps([{"prediction_id": "abc", "actual_churn": 2}]),
+                             content_type='application/json')
+        assert response.status_code == 400
+    
+    def test_full_writer_queue_still_stores_predictions(self, tmp_path, sample_customer_data, monkeypatch):
+        """Test a prediction that does not fit the writer's queue is inserted synchronously and can be labelled"""
+        import queue
+        from app.database import PredictionDatabase
+        
+        db = PredictionDatabase(str(tmp_path / 'predictions.db'))
+        monkeypatch.setattr(db.writer, 'enqueue', lambda row: False)
+        prediction_id = db.queue_prediction(sample_customer_data, 1, 0.7)
+        
+        assert prediction_id is not None
+        assert db.writer.get_stats()['fallback_writes'] == 1
+        assert db.record_feedback({prediction_id: 1}) == []
+        
+        # A full queue makes flush give up instead of blocking the request
+        full = queue.Queue(maxsize=1)
+        full.put_nowait(None)
+        monkeypatch.setattr(db.writer, '_queue', full)
+        assert db.writer.flush(timeout=0.05) is False
+    
+    def test_failed_batches_are_written_row_by_row(self, tmp_path, sample_customer_data, monkeypatch):
+        """Test a batch sunk by one bad row keeps the others, and an unexpected error leaves the writer running"""
+        from app.database import PredictionDatabase
+        
+        db = PredictionDatabase(str(tmp_path / 'predictions.db'))
+        existing = db.queue_prediction(sample_customer_data, 1, 0.7)
+        assert db.writer.flush()
+        
+        # A duplicate prediction id fails the whole batch insert
+        good = [(uid, sample_customer_data, 0, 0.2, 'v1.0', None, '/predict') for uid in ('a1', 'b2')]
+        for row in good[:1] + [(existing,) + good[0][1:]] + good[1:]:
+            assert db.writer.enqueue(row)
+        assert db.writer.flush()
+        
+        stats = db.writer.get_stats()
+        assert stats['fallback_writes'] == 2
+        assert stats['lost'] == 1
+        assert db.record_feedback({'a1': 0, 'b2': 1}) == []
+        
+        def fail(conn, rows):
+            raise RuntimeError('boom')
+        monkeypatch.setattr(db.writer, '_write_batch', fail)
+        db.writer.enqueue(good[0])
+        assert db.writer.flush()
+        monkeypatch.undo()
+        
+        assert db.queue_prediction(sample_customer_data, 0, 0.1) is not None
+        assert db.writer.flush()
+        assert db.writer.get_stats()['lost'] == 2
+        assert db.writer.get_stats()['written'] == 2
+
+class TestRetrainEndpoint:
+    """Test validation of incremental /retrain requests"""
+    
+    @pytest.mark.parametrize('options', [
+        {'trees': -1}, {'trees': 0}, {'trees': 2.5}, {'trees': True}, {'max_trees': -3}, {'compare': 'yes'}
+    ])
+    def test_invalid_options_rejected(self, client, sample_customer_data, options):
+        """Test bad tree counts and non-boolean compare get 400 before any training"""
+        body = dict(options, mode='incremental', data=[dict(sample_customer_data, churn=1)])
+        response = client.post('/retrain', data=json.dumps(body), content_type='application/json')
+        assert response.status_code == 400
+    
+    @pytest.mark.parametrize('change', [{'churn': None}, {'churn': 2}, {'churn': 'yes'}, {'age': None}, {'age': 7}])
+    def test_invalid_rows_rejected(self, client, sample_customer_data, change):
+        """Test rows without a 0/1 churn label or with a missing or invalid feature get 400 naming the row"""
+        bad = dict(sample_customer_data, churn=0)
+        bad.update(change)
+        bad = {key: value for key, value in bad.items() if value is not None}
+        body = {'mode': 'incremental', 'data': [dict(sample_customer_data, churn=1), bad]}
+        response = client.post('/retrain', data=json.dumps(body), content_type='application/json')
+        
+        assert response.status_code == 400
+        assert json.loads(response.data)['error'].startswith('Row 1:')
+
+class TestDriftEndpoint:
+    """Test drift monitoring endpoint"""
+    
+    def test_drift_endpoint(self, client, sample_customer_data):
+        """Test drift report covers every feature after a prediction"""
+        client.post('/predict',
+                    data=json.dumps(sample_customer_data),
+                    content_type='application/json')
+        
+        response = client.get('/monitoring/drift')
+        assert response.status_code == 200
+        
+        data = json.loads(response.data)
+        assert data['success'] is True
+        features = data['drift']['features']
+        assert set(features) == set(sample_customer_data)
+        assert 'psi' in features['age']
+        assert 'ks' in features['age']
+        assert 'psi' in features['contract_type']
 
 class TestPredictionEndpoint:
     """Test prediction endpoints"""
@@ -94,6 +271,16 @@ class TestPredictionEndpoint:
         assert data['prediction']['churn_prediction'] in [0, 1]
         assert 0 <= data['prediction']['churn_probability'] <= 1
     
+    def test_predict_single_server_timing(self, client, sample_customer_data):
+        """Test single prediction reports per-stage timings"""
+        response = client.post('/predict',
+                             data=json.dumps(sample_customer_data),
+                             content_type='application/json')
+        
+        server_timing = response.headers.get('Server-Timing', '')
+        for stage in ('parse', 'validate', 'preprocess', 'predict', 'serialize', 'total'):
+            assert f'{stage};dur=' in server_timing
+    
     def test_predict_single_missing_data(self, client):
         """Test single prediction with missing data"""
         incomplete_data = {
@@ -163,6 +350,462 @@ class TestPredictionEndpoint:
         data = json.loads(response.data)
         assert 'error' in data
         assert 'must be a list' in data['error']
+    
+    def test_predict_expired_deadline(self, client, sample_customer_data):
+        """Test a request past its deadline is abandoned with 504 and counted"""
+        response = client.post('/predict',
+                             data=json.dumps(sample_customer_data),
+                             content_type='application/json',
+                             headers={'X-Request-Deadline-Ms': '0'})
+        
+        assert response.status_code == 504
+        assert json.loads(response.data)['deadline_exceeded'] is True
+        
+        data = json.loads(client.get('/metrics').data)
+        assert data['deadlines']['rows_skipped'] >= 1
+    
+    def test_predict_batch_within_deadline(self, client, sample_customer_data):
+        """Test a batch that finishes in time is complete and not truncated"""
+        response = client.post('/batch_predict',
+                             data=json.dumps([sample_customer_data] * 30),
+                             content_type='application/json',
+                             headers={'X-Request-Deadline-Ms': '60000', 'X-Allow-Partial': 'true'})
+        
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['truncated'] is False
+        assert data['scored_customers'] == 30
+
+class TestAdminProfileEndpoint:
+    """Test on-demand profiler endpoint"""
+    
+    @pytest.fixture(autouse=True)
+    def admin(self, client, tmp_path, monkeypatch):
+        """Enable the admin endpoints and keep session files out of the working directory"""
+        from app.profiler import profiler
+        
+        monkeypatch.setitem(client.application.config, 'ADMIN_TOKEN', 'secret')
+        monkeypatch.setattr(profiler, 'profile_dir', str(tmp_path))
+    
+    def test_profile_requires_token(self, client):
+        """Test profiler endpoint rejects callers without the admin token"""
+        response = client.post('/admin/profile?seconds=1')
+        assert response.status_code == 401
+    
+    def test_profile_sample_mode(self, client):
+        """Test a sampling session returns collapsed stacks without the app's idle background threads"""
+        headers = {'X-Admin-Token': 'secret'}
+        
+        response = client.post('/admin/profile?seconds=0.2&mode=sample', headers=headers)
+        assert response.status_code == 202
+        
+        time.sleep(0.5)
+        response = client.get('/admin/profile', headers=headers)
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain')
+        assert response.headers['X-Profile-Pid'] == str(os.getpid())
+        assert 'database.py:_write_loop' not in response.get_data(as_text=True)
+        assert 'handlers.py:_monitor' not in response.get_data(as_text=True)
+    
+    def test_profile_of_another_worker(self, client, tmp_path):
+        """Test a session finished by another worker process is returned from its file"""
+        session = {'pid': 1, 'mode': 'sample', 'seconds': 1.0, 'started_at': time.time(), 'status': 'finished',
+                   'samples': 10, 'profiled_requests': 0, 'result': 'routes.py:predict_single 10\n'}
+        (tmp_path / 'profile-1.json').write_text(json.dumps(session))
+        
+        response = client.get('/admin/profile?pid=1', headers={'X-Admin-Token': 'secret'})
+        assert response.status_code == 200
+        assert response.get_data(as_text=True) == session['result']
+
+class TestConcurrentRequests:
+    """Test the API under threaded workers"""
+    
+    def test_concurrent_predictions(self, client, sample_customer_data, monkeypatch):
+        """Test concurrent predictions are all served and counted"""
+        from concurrent.futures import ThreadPoolExecutor
+        from app.monitoring import monitor
+        
+        # Load shedding and rate limiting are tested separately
+        monkeypatch.setattr('app.admission.ADMISSION_CONTROL_ENABLED', False)
+        monkeypatch.setattr('app.ratelimit.RATE_LIMIT_ENABLED', False)
+        app = client.application
+        
+        def predict(_):
+            with app.test_client() as thread_client:
+                return thread_client.post('/predict', data=json.dumps(sample_customer_data),
+                                          content_type='application/json').status_code
+        
+        before = monitor.request_count
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            statuses = list(executor.map(predict, range(64)))
+        
+        assert statuses == [200] * 64
+        assert monitor.request_count - before == 64
+
+class TestAdmissionControl:
+    """Test adaptive admission control on the scoring routes"""
+    
+    def test_rejects_over_limit(self, client, sample_customer_data):
+        """Test requests over the concurrency limit are rejected fast with Retry-After"""
+        from app.routes import admission
+        
+        controller = admission['predict']
+        saved = controller.in_flight
+        controller.in_flight = int(controller.limit)
+        try:
+            response = client.post('/predict', data=json.dumps(sample_customer_data),
+                                   content_type='application/json')
+        finally:
+            controller.in_flight = saved
+        
+        assert response.status_code == 503
+        assert int(response.headers['Retry-After']) >= 1
+        
+        data = json.loads(client.get('/metrics').data)
+        assert data['admission']['predict']['rejected'] >= 1
+    
+    def test_limit_adapts_to_latency(self):
+        """Test the limit grows while latency is flat and backs off when it rises"""
+        from app.admission import AdmissionController
+        
+        controller = AdmissionController('test', initial_limit=4, min_limit=1, max_limit=10)
+        for _ in range(50):
+            for _ in range(4):
+                controller.try_acquire()
+            for _ in range(4):
+                controller.release(0.01)
+        grown = controller.limit
+        assert grown > 4
+        
+        controller._last_decrease = 0
+        assert controller.try_acquire()
+        controller.release(1.0)
+        assert controller.limit < grown
+        
+        assert not controller.try_acquire(queue_wait=controller.max_queue_wait + 1)
+        assert controller.get_stats()['shed_queued'] == 1
+    
+    def test_ordinary_latency_variance_keeps_limit(self):
+        """Test a spread like p50 8 ms / p95 13 ms with one very fast outlier does not read as queueing"""
+        import random
+        from app.admission import AdmissionController
+        
+        rng = random.Random(0)
+        controller = AdmissionController('test', initial_limit=8, min_limit=1, max_limit=50)
+        controller.try_acquire()
+        controller.release(0.0001)
+        for _ in range(300):
+            for _ in range(8):
+                controller.try_acquire()
+            for _ in range(8):
+                controller.release(rng.choice([0.006, 0.007, 0.008, 0.008, 0.009, 0.010, 0.013]))
+        
+        assert controller.limit >= 8
+        assert 0.005 < controller.no_load_latency < 0.008
+    
+    def test_client_request_start_is_not_trusted(self, client, sample_customer_data, monkeypatch):
+        """Test an old X-Request-Start from a client neither sheds the request nor reaches the limit"""
+        from app.admission import request_arrival_time
+        from app.routes import admission
+        
+        now = time.time()
+        environ = {'HTTP_X_REQUEST_START': f't={now - 600:.3f}'}
+        assert request_arrival_time(environ, now) == now
+        monkeypatch.setattr('app.admission.TRUST_REQUEST_START', True)
+        assert request_arrival_time(environ, now) == pytest.approx(now - 600)
+        monkeypatch.setattr('app.admission.TRUST_REQUEST_START', False)
+        
+        response = client.post('/predict', data=json.dumps(sample_customer_data), content_type='application/json',
+                               headers={'X-Request-Start': f't={now - 600:.3f}'})
+        assert response.status_code == 200
+        assert admission['predict'].last_latency < 60
+    
+    def test_expired_deadlines_leave_limit_alone(self, client, sample_customer_data):
+        """Test 504s for a client's own expired deadline cut neither the limit nor the no-load latency"""
+        from app.routes import admission
+        
+        controller = admission['predict']
+        client.post('/predict', data=json.dumps(sample_customer_data), content_type='application/json')
+        limit, no_load_latency = controller.limit, controller.no_load_latency
+        
+        for _ in range(50):
+            response = client.post('/predict', data=json.dumps(sample_customer_data),
+                                   content_type='application/json', headers={'X-Request-Deadline-Ms': '0'})
+            assert response.status_code == 504
+        
+        assert controller.limit == limit
+        assert controller.no_load_latency == no_load_latency
+        assert controller.in_flight == 0
+
+class TestRequestDeadline:
+    """Test parsing of the X-Request-Deadline-Ms budget"""
+    
+    @pytest.mark.parametrize('value', ['inf', '-inf', 'nan', '-5', 'soon'])
+    def test_invalid_budgets_are_ignored(self, value):
+        """Test non-finite, negative and non-numeric budgets give no deadline"""
+        from app.admission import request_deadline
+        
+        assert request_deadline({'HTTP_X_REQUEST_DEADLINE_MS': value}) is None
+    
+    def test_budget_is_capped(self):
+        """Test a huge budget is cut to MAX_REQUEST_DEADLINE"""
+        from app.admission import MAX_REQUEST_DEADLINE, request_deadline
+        
+        deadline = request_deadline({'HTTP_X_REQUEST_DEADLINE_MS': '1e300'})
+        assert 0 < deadline.remaining() <= MAX_REQUEST_DEADLINE
+    
+    def test_infinite_budget_still_predicts(self, client, sample_customer_data):
+        """Test X-Request-Deadline-Ms: inf is served instead of failing with 500"""
+        response = client.post('/predict', data=json.dumps(sample_customer_data),
+                               content_type='application/json', headers={'X-Request-Deadline-Ms': 'inf'})
+        assert response.status_code == 200
+
+class TestFeatureStore:
+    """Test scoring customers by id from the feature store"""
+    
+    @pytest.fixture
+    def feature_store(self, tmp_path, sample_customer_data, monkeypatch):
+        """A temporary feature store holding two customers, used by the app"""
+        import app.routes
+        from app.feature_store import FeatureStore
+        
+        store = FeatureStore(str(tmp_path / 'features.db'))
+        rejected = store.upsert([
+            dict(sample_customer_data, customer_id='c1'),
+            dict(sample_customer_data, customer_id='c2', contract_type='Two year'),
+            dict(sample_customer_data, customer_id='bad', age=7)
+        ])
+        assert [index for index, message in rejected] == [2]
+        monkeypatch.setattr(app.routes, 'feature_store', store)
+        return store
+    
+    def test_predict_by_customer_id(self, client, feature_store, sample_customer_data):
+        """Test a prediction for an id alone matches one sent with the full features"""
+        by_id = json.loads(client.post('/predict', data=json.dumps({"customer_id": "c1"}),
+                                       content_type='application/json').data)
+        full = json.loads(client.post('/predict', data=json.dumps(sample_customer_data),
+                                      content_type='application/json').data)
+        
+        assert by_id['success'] is True
+        assert by_id['prediction']['churn_probability'] == full['prediction']['churn_probability']
+        
+        response = client.post('/predict', data=json.dumps({"customer_id": "missing"}),
+                               content_type='application/json')
+        assert response.status_code == 404
+    
+    def test_batch_predict_by_customer_ids(self, client, feature_store, sample_customer_data):
+        """Test batches mix ids and full records, with ids fetched in one multi-get"""
+        payload = [{"customer_id": "c1"}, {"customer_id": "c2"}, sample_customer_data]
+        response = client.post('/batch_predict', data=json.dumps(payload), content_type='application/json')
+        data = json.loads(response.data)
+        
+        assert response.status_code == 200
+        assert data['total_customers'] == 3
+        assert feature_store.get_stats()['store_hits'] == 2
+
+class TestCustomerRisk:
+    """Test the precomputed risk table and its lookup endpoint"""
+    
+    @pytest.fixture
+    def risk_table(self, tmp_path, sample_customer_data, monkeypatch):
+        """Score a two-customer file into a temporary risk table served by the app"""
+        import pandas as pd
+        import app.routes
+        from ml_model.batch_scoring import RiskTable, score_customers
+        
+        customers = pd.DataFrame([dict(sample_customer_data, customer_id=101),
+                                  dict(sample_customer_data, customer_id=102, age=12)])
+        customers.to_csv(tmp_path / 'customers.csv', index=False)
+        db_path = str(tmp_path / 'risk.db')
+        summary = score_customers(str(tmp_path / 'customers.csv'), db_path)
+        assert summary['scored'] == 1
+        assert summary['skipped'] == 1
+        
+        table = RiskTable(db_path)
+        monkeypatch.setattr(app.routes, 'risk_table', table)
+        return table
+    
+    def test_lookup_from_table_then_cache(self, client, risk_table):
+        """Test a scored customer is served from the table, then from memory"""
+        response = client.get('/customers/101/risk')
+        data = json.loads(response.data)
+        
+        assert response.status_code == 200
+        assert data['source'] == 'table'
+        assert 0 <= data['churn_probability'] <= 1
+        
+        data = json.loads(client.get('/customers/101/risk').data)
+        assert data['source'] == 'cache'
+        assert client.get('/customers/102/risk').status_code == 404
+    
+    def test_stale_rows_are_rescored_live(self, client, risk_table):
+        """Test rows past the maximum age are rescored from their stored features"""
+        risk_table.max_age = -1
+        response = client.get('/customers/101/risk')
+        data = json.loads(response.data)
+        
+        assert response.status_code == 200
+        assert data['source'] == 'live'
+        assert risk_table.get_stats()['rescored_live'] == 1
+
+class TestRateLimiting:
+    """Test per-client token-bucket rate limiting"""
+    
+    def test_rate_limit_headers(self, client, sample_customer_data, monkeypatch):
+        """Test responses carry the standard rate-limit headers"""
+        monkeypatch.setattr('app.ratelimit.RATE_LIMIT_ENABLED', True)
+        response = client.post('/predict', data=json.dumps(sample_customer_data),
+                               content_type='application/json', headers={'X-API-Key': 'headers-test'})
+        
+        assert response.status_code == 200
+        assert 'RateLimit-Limit' in response.headers
+        assert 'RateLimit-Remaining' in response.headers
+    
+    def test_bucket_exhaustion_and_refill(self, tmp_path):
+        """Test a bucket rejects once empty, refills over time and is shared between limiters"""
+        from app.ratelimit import TokenBucketLimiter
+        
+        db_path = str(tmp_path / 'ratelimit.db')
+        limiter = TokenBucketLimiter(db_path, limits={'predict': (1.0, 2.0)})
+        # A second limiter on the same file stands in for another worker
+        other_worker = TokenBucketLimiter(db_path, limits={'predict': (1.0, 2.0)})
+        
+        assert limiter.check('predict', 'client-a', now=1000.0)[0] is True
+        assert other_worker.check('predict', 'client-a', now=1000.0)[0] is True
+        allowed, limit, remaining, reset, retry_after = limiter.check('predict', 'client-a', now=1000.0)
+        assert allowed is False
+        assert retry_after == 1
+        
+        assert limiter.check('predict', 'client-b', now=1000.0)[0] is True
+        assert other_worker.check('predict', 'client-a', now=1001.0)[0] is True
+        assert limiter.check('unlimited_route', 'client-a') is None
+    
+    def test_client_identity(self):
+        """Test only configured API keys get their own bucket and forwarded IPs need trusted proxies"""
+        from app.ratelimit import _hash_key, client_key
+        
+        api_keys = {_hash_key('known')}
+        environ = {'REMOTE_ADDR': '10.0.0.1', 'HTTP_X_FORWARDED_FOR': '1.1.1.1, 203.0.113.7'}
+        
+        assert client_key(dict(environ, HTTP_X_API_KEY='known'), api_keys, 0).startswith('key:')
+        assert client_key(dict(environ, HTTP_X_API_KEY='made-up'), api_keys, 0) == 'ip:10.0.0.1'
+        assert client_key(environ, api_keys, 1) == 'ip:203.0.113.7'
+        assert client_key(environ, api_keys, 3) == 'ip:10.0.0.1'
+
+class TestPriorityScheduler:
+    """Test weighted slot scheduling between priority classes"""
+    
+    def test_weighted_order(self):
+        """Test freed slots go to waiting classes in proportion to their weights"""
+        from app.scheduling import PriorityScheduler
+        
+        scheduler = PriorityScheduler(slots=1, classes={
+            'interactive': {'weight': 3, 'max_running': None, 'max_queue': 10},
+            'bulk': {'weight': 1, 'max_running': None, 'max_queue': 10},
+        })
+        scheduler.acquire('bulk')
+        
+        granted = []
+        with scheduler._lock:
+            for priority in ['bulk'] * 4 + ['interactive'] * 4:
+                scheduler._enqueue(priority, lambda priority=priority: granted.append(priority))
+        
+        holder = 'bulk'
+        for _ in range(8):
+            scheduler.release(holder)
+            holder = granted[-1]
+        
+        assert granted[:4].count('interactive') == 3
+        stats = scheduler.get_stats()
+        assert stats['interactive']['served'] == 4
+        assert stats['bulk']['queue_depth'] == 0
+    
+    def test_scheduler_in_metrics(self, client):
+        """Test per-class queue depth and wait time are exposed"""
+        data = json.loads(client.get('/metrics').data)
+        assert 'queue_depth' in data['scheduler']['interactive']
+        assert 'avg_wait_ms' in data['scheduler']['bulk']
+
+class TestAsyncServer:
+    """Test the asyncio serving entry point"""
+    
+    def test_keep_alive_requests(self, client, sample_customer_data):
+        """Test several requests are served over one keep-alive connection"""
+        import asyncio
+        import http.client
+        import threading
+        from app.async_server import AsyncServer
+        
+        server = AsyncServer(client.application, scoring_threads=2, io_threads=2)
+        loop = asyncio.new_event_loop()
+        listener = loop.run_until_complete(server.start('127.0.0.1', 0))
+        port = listener.sockets[0].getsockname()[1]
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            for _ in range(3):
+                connection.request('POST', '/predict', body=json.dumps(sample_customer_data),
+                                   headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                assert response.status == 200
+                assert json.loads(response.read())['success'] is True
+            connection.close()
+            
+            stats = server.get_stats()
+            assert stats['requests_total'] == 3
+            assert stats['connections_total'] == 1
+        finally:
+            asyncio.run_coroutine_threadsafe(server.shutdown(), loop).result(timeout=10)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout=5)
+    
+    def test_cpu_bound_paths_use_scoring_pool(self):
+        """Test retraining and live risk rescoring run on the bounded scoring pool"""
+        from app.async_server import is_scoring_path
+        
+        for path in ('/predict', '/batch_predict', '/retrain', '/customers/C-1/risk'):
+            assert is_scoring_path(path)
+        for path in ('/feedback', '/metrics', '/customers'):
+            assert not is_scoring_path(path)
+    
+    def test_cancelled_request_releases_admission_slot(self):
+        """Test a request cancelled while its handler runs gives its admission slot back"""
+        import asyncio
+        import threading
+        from unittest.mock import MagicMock
+        from app.admission import AdmissionController
+        from app.async_server import AsyncServer
+        
+        started, finish = threading.Event(), threading.Event()
+        
+        def slow_app(environ, start_response):
+            started.set()
+            finish.wait(5)
+            start_response('200 OK', [])
+            return [b'']
+        
+        controller = AdmissionController('test')
+        server = AsyncServer(slow_app, scoring_threads=1, io_threads=1, admission={'/predict': controller})
+        
+        async def scenario():
+            reader = asyncio.StreamReader()
+            reader.feed_data(b'POST /predict HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}')
+            writer = MagicMock()
+            writer.get_extra_info.return_value = ('127.0.0.1', 0)
+            task = asyncio.create_task(server._handle_connection(reader, writer))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+            assert controller.in_flight == 1
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        
+        try:
+            asyncio.run(scenario())
+        finally:
+            finish.set()
+            server.scoring_executor.shutdown(wait=True)
+        assert controller.in_flight == 0
 
 class TestIndexEndpoint:
     """Test index/home endpoint"""
@@ -50,6 +50,14 @@ class TestChurnPredictor:
         assert isinstance(info['features'], list)
         assert len(info['features']) > 0
     
+    def test_warmup_covers_batch_sizes(self, predictor):
+        """Test warmup scores every configured batch size before the model is published"""
+        stats = predictor._warmup(predictor.model_artifacts, batch_sizes=[1, 7, 32], rounds=1)
+        
+        assert stats['batch_sizes'] == [1, 7, 32]
+        assert stats['seconds'] >= 0
+        assert predictor.is_ready()
+    
     def test_predict_single(self, predictor, sample_customer):
         """Test single prediction"""
         result = predictor.predict_single(sample_customer)
@@ -72,6 +80,66 @@ class TestChurnPredictor:
             assert 'churn_probability' in result
             assert result['churn_prediction'] in [0, 1]
             assert 0 <= result['churn_probability'] <= 1
+    
+    def test_predict_batch_deadline_partial(self, predictor, sample_customer):
+        """Test a deadline passing mid-batch keeps the chunks already scored"""
+        from ml_model.model_utils import DEADLINE_CHUNK_SIZE, DeadlineExceeded
+        
+        class ExpiresAfter:
+            """Deadline that passes after a number of checks"""
+            def __init__(self, checks):
+                self.checks = checks
+            
+            def check(self, phase):
+                self.checks -= 1
+                if self.checks < 0:
+                    raise DeadlineExceeded(phase)
+        
+        batch_data = [sample_customer] * (DEADLINE_CHUNK_SIZE * 3)
+        # Two checks per chunk: before it and after preprocessing it
+        with pytest.raises(DeadlineExceeded) as excinfo:
+            predictor.predict_batch(batch_data, deadline=ExpiresAfter(2))
+        
+        assert excinfo.value.phase == 'scoring'
+        assert len(excinfo.value.results) == DEADLINE_CHUNK_SIZE
+        assert excinfo.value.results[-1]['customer_index'] == DEADLINE_CHUNK_SIZE - 1
+    
+    def test_concurrent_identical_predictions_coalesce(self, predictor, sample_customer, monkeypatch):
+        """Test concurrent predictions of the same features are scored once and shared"""
+        import threading
+        import time
+        from ml_model.model_utils import feature_fingerprint
+        
+        score = predictor._score
+        calls = []
+        
+        def slow_score(*args, **kwargs):
+            calls.append(1)
+            time.sleep(0.2)
+            return score(*args, **kwargs)
+        
+        monkeypatch.setattr(predictor, '_score', slow_score)
+        # Same features in a different form: int vs float, extra field
+        variant = dict(sample_customer, age=35.0, note='retry')
+        assert feature_fingerprint(variant) == feature_fingerprint(sample_customer)
+        
+        results = []
+        threads = [
+            threading.Thread(target=lambda data=data: results.append(predictor.predict_single(data)))
+            for data in [sample_customer, variant] * 3
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert len(results) == 6
+        assert all(result == results[0] for result in results)
+        assert len(calls) < 6
+        stats = predictor.flights.get_stats()
+        assert stats['computed'] == len(calls)
+        assert stats['coalesced'] == 6 - len(calls)
+        assert stats['in_flight'] == 0
 
 class TestDataValidation:
     """Test data validation functions"""
@@ -189,4 +257,226 @@ class TestDataPreprocessing:
         assert X_new.shape[1] == X_processed.shape[1]  # Same number of features
 
 if __name__ == '__main__':
-    pytest.main([__file__])
\ No newline at end of file
+    pytest.main([__file__])
+class TestBatchScoring:
+    """Test full and incremental scoring into the risk table"""
+    
+    def test_incremental_run_rescores_only_changes(self, tmp_path):
+        """Test an incremental run rescores changed and new customers and reports removals"""
+        import csv
+        from ml_model.batch_scoring import score_customers
+        
+        df = create_sample_data()
+        df = df[(df['age'] >= 18) & (df['monthly_charges'] > 0) & (df['total_charges'] >= 0)].head(200)
+        db_path = str(tmp_path / 'risk.db')
+        df.to_csv(tmp_path / 'day1.csv', index=False)
+        first = score_customers(str(tmp_path / 'day1.csv'), db_path, incremental=True)
+        assert first['incremental'] is False
+        assert first['scored'] == 200
+        
+        changed = df.copy()
+        changed.iloc[:5, changed.columns.get_loc('tenure')] += 1.0
+        changed = changed.iloc[:-3]
+        changed.to_csv(tmp_path / 'day2.csv', index=False)
+        delta_path = str(tmp_path / 'delta.csv')
+        second = score_customers(str(tmp_path / 'day2.csv'), db_path, incremental=True, delta_path=delta_path)
+        
+        assert second['incremental'] is True
+        assert second['scored'] == 5
+        assert second['features'] == 5
+        assert second['unchanged'] == 192
+        assert second['removed'] == 3
+        with open(delta_path) as f:
+            changes = [row['change'] for row in csv.DictReader(f)]
+        assert changes.count('features') == 5
+        assert changes.count('removed') == 3
+        
+        # Unchanged rows are not rewritten; the run confirms them through one timestamp
+        import sqlite3
+        conn = sqlite3.connect(db_path)
+        scored_at = dict(conn.execute('SELECT customer_id, scored_at FROM risk_scores'))
+        confirmed_at = conn.execute("SELECT value FROM risk_table_meta WHERE key = 'confirmed_at'").fetchone()[0]
+        conn.close()
+        ids = df['customer_id'].astype(str).tolist()
+        assert len(scored_at) == 197 and ids[-1] not in scored_at
+        assert scored_at[ids[10]] < scored_at[ids[0]] == confirmed_at
+
+class TestIncrementalTraining:
+    """Test growing the forest with warm_start on new labeled data"""
+    
+    def test_grow_and_retire_trees(self, tmp_path):
+        """Test new trees are added, the oldest retired and the preprocessors kept"""
+        import pickle
+        import shutil
+        from ml_model.train_model import train_incremental
+        
+        model_path = str(tmp_path / 'churn_model.pkl')
+        shutil.copy('models/churn_model.pkl', model_path)
+        with open(model_path, 'rb') as f:
+            before = pickle.load(f)
+        
+        new_data = create_sample_data().sample(200, random_state=1)
+        artifacts = train_incremental(new_data, model_path, n_new_trees=10, max_trees=105, compare=True)
+        
+        record = artifacts['training_history'][-1]
+        assert record['mode'] == 'incremental'
+        assert record['trees'] == 105
+        assert record['retired_trees'] == len(before['model'].estimators_) + 10 - 105
+        assert 0 <= record['full_retrain']['holdout_accuracy'] <= 1
+        assert artifacts['scaler'].mean_.tolist() == before['scaler'].mean_.tolist()
+        assert artifacts['accuracy'] == before['accuracy']
+        assert 0 <= record['holdout_accuracy'] <= 1
+        assert ChurnPredictor(model_path).get_model_info()['model_version'] == artifacts['model_version']
+    
+    def test_weights_and_seeds_of_new_trees(self, tmp_path):
+        """Test new trees use the full training's class weights, without warnings, and fresh seeds"""
+        import shutil
+        import warnings
+        from ml_model.train_model import train_incremental
+        
+        model_path = str(tmp_path / 'churn_model.pkl')
+        shutil.copy('models/churn_model.pkl', model_path)
+        new_data = create_sample_data().sample(200, random_state=1)
+        
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', UserWarning)
+            first = train_incremental(new_data, model_path, n_new_trees=5, max_trees=100)
+        second = train_incremental(new_data, model_path, n_new_trees=5, max_trees=100)
+        
+        assert second['model'].class_weight == first['class_weight']
+        seeds = [record['random_state'] for record in second['training_history'][-2:]]
+        assert seeds[0] != seeds[1]
+        first_trees = {tree.random_state for tree in first['model'].estimators_[-5:]}
+        assert not first_trees & {tree.random_state for tree in second['model'].estimators_[-5:]}
+
+class TestTrainingDataCache:
+    """Test the content-addressed cache of preprocessed training data"""
+    
+    def test_second_run_memory_maps_the_cache(self, tmp_path):
+        """Test a repeated run loads identical splits from memory-mapped arrays"""
+        from ml_model.data_preprocessing import prepare_training_data, training_cache_key
+        
+        cache_dir = str(tmp_path / 'cache')
+        X_train, X_test, y_train, y_test, scaler, encoders = prepare_training_data(cache_dir=cache_dir)
+        assert os.listdir(cache_dir) == [training_cache_key()]
+        
+        cached = prepare_training_data(cache_dir=cache_dir)
+        assert isinstance(np.load(os.path.join(cache_dir, training_cache_key(), 'X_train.npy'), mmap_mode='r'), np.memmap)
+        assert cached[0].columns.tolist() == X_train.columns.tolist()
+        assert np.array_equal(cached[0].to_numpy(), X_train.to_numpy(dtype=np.float64))
+        assert np.array_equal(cached[3].to_numpy(), y_test.to_numpy())
+        assert cached[4].mean_.tolist() == scaler.mean_.tolist()
+    
+    def test_key_follows_the_source_content(self, tmp_path):
+        """Test different source files get different keys and identical ones the same"""
+        from ml_model.data_preprocessing import training_cache_key
+        
+        df = create_sample_data()
+        df.to_csv(tmp_path / 'a.csv', index=False)
+        df.to_csv(tmp_path / 'b.csv', index=False)
+        df.head(500).to_csv(tmp_path / 'c.csv', index=False)
+        
+        assert training_cache_key(str(tmp_path / 'a.csv')) == training_cache_key(str(tmp_path / 'b.csv'))
+        assert training_cache_key(str(tmp_path / 'a.csv')) != training_cache_key(str(tmp_path / 'c.csv'))
+        assert training_cache_key(str(tmp_path / 'a.csv')) != training_cache_key()
+    
+    def test_reference_profile_cached_and_cache_pruned(self, tmp_path):
+        """Test the reference profile comes from the cache entry and old entries are pruned"""
+        from ml_model.data_preprocessing import (
+            build_reference_profile, prepare_training_data, prune_training_cache, training_cache_key,
+            training_reference_profile
+        )
+        
+        cache_dir = str(tmp_path / 'cache')
+        df = create_sample_data()
+        df.head(500).to_csv(tmp_path / 'old.csv', index=False)
+        prepare_training_data(str(tmp_path / 'old.csv'), cache_dir=cache_dir)
+        os.utime(os.path.join(cache_dir, training_cache_key(str(tmp_path / 'old.csv'))), (0, 0))
+        prepare_training_data(cache_dir=cache_dir)
+        
+        profile = training_reference_profile(cache_dir=cache_dir)
+        assert profile['samples'] == build_reference_profile(df)['samples']
+        
+        assert prune_training_cache(cache_dir, max_bytes=1, keep=os.path.join(cache_dir, training_cache_key())) == [
+            training_cache_key(str(tmp_path / 'old.csv'))
+        ]
+        assert os.listdir(cache_dir) == [training_cache_key()]
+
+class TestForestCompression:
+    """Test the post-training forest compression stage"""
+    
+    def test_merging_identical_leaves_keeps_probabilities(self):
+        """Test lossless leaf merging never changes a probability"""
+        import pickle
+        from ml_model.compress_model import compress_tree
+        
+        with open('models/churn_model.pkl', 'rb') as f:
+            artifacts = pickle.load(f)
+        X = preprocess_features(create_sample_data().drop('churn', axis=1), scaler=artifacts['scaler'],
+                                encoders=artifacts['encoders'], fit_transform=False).to_numpy(dtype=np.float32)
+        for estimator in artifacts['model'].estimators_[:10]:
+            before = estimator.predict_proba(X)
+            node_count = estimator.tree_.node_count
+            estimator.tree_ = compress_tree(estimator.tree_, collapse_same_class=False)
+            assert estimator.tree_.node_count <= node_count
+            assert np.allclose(estimator.predict_proba(X), before)
+    
+    def test_compressed_model_loads_and_reports(self, tmp_path):
+        """Test the compressed model is smaller, reported and loadable by ChurnPredictor"""
+        from ml_model.compress_model import compress_model
+        
+        output_path = str(tmp_path / 'compressed.pkl')
+        report = compress_model(output_path=output_path, tolerance=0.02)
+        
+        assert report['after']['trees'] <= report['before']['trees']
+        assert report['after']['nodes'] < report['before']['nodes']
+        assert report['after']['pickle_bytes'] < report['before']['pickle_bytes']
+        assert ChurnPredictor(output_path).get_model_info()['model_loaded'] is True
+    
+    def test_defaults_keep_the_original_and_probabilities(self, tmp_path):
+        """Test the default output is a new file and lossless compression on given data keeps probabilities"""
+        import shutil
+        from ml_model.compress_model import compress_model
+        
+        model_path = str(tmp_path / 'churn_model.pkl')
+        shutil.copy('models/churn_model.pkl', model_path)
+        create_sample_data().sample(300, random_state=7).to_csv(tmp_path / 'holdout.csv', index=False)
+        
+        report = compress_model(model_path, source=str(tmp_path / 'holdout.csv'))
+        
+        assert report['collapse_same_class'] is False
+        assert os.path.exists(str(tmp_path / 'churn_model.compressed.pkl'))
+        with open(model_path, 'rb') as f, open('models/churn_model.pkl', 'rb') as original:
+            assert f.read() == original.read()
+
+class TestModelInput:
+    """Test the float32 model input pipeline"""
+    
+    def test_matches_preprocess_features_in_model_layout(self):
+        """Test records and DataFrames give preprocess_features' values as one C-contiguous float32 matrix"""
+        import pickle
+        from ml_model.data_preprocessing import build_model_input
+        
+        with open('models/churn_model.pkl', 'rb') as f:
+            artifacts = pickle.load(f)
+        df = create_sample_data().drop('churn', axis=1)
+        expected = preprocess_features(df, scaler=artifacts['scaler'], encoders=artifacts['encoders'],
+                                       fit_transform=False)[artifacts['feature_names']].to_numpy(dtype=np.float32)
+        
+        for data in (df.to_dict('records'), df):
+            X = build_model_input(data, artifacts['scaler'], artifacts['encoders'], artifacts['feature_names'])
+            assert X.dtype == np.float32 and X.flags['C_CONTIGUOUS']
+            assert np.array_equal(X, expected)
+        
+        with pytest.raises(ValueError):
+            build_model_input([dict(df.iloc[0], contract_type='Weekly')], artifacts['scaler'],
+                              artifacts['encoders'], artifacts['feature_names'])
+    
+    def test_model_records_input_format(self):
+        """Test the trained model takes the float32 matrix directly, without feature names"""
+        predictor = ChurnPredictor()
+        artifacts = predictor.model_artifacts
+        
+        assert artifacts['input_format'] == {'dtype': 'float32', 'order': 'C'}
+        assert not hasattr(artifacts['model'], 'feature_names_in_')
+        assert predictor.get_model_info()['input_format'] == artifacts['input_format']
@@ -1,20 +1,206 @@
 import sqlite3
 import json
+import logging
+import queue
+import threading
+import time
+import uuid
 from datetime import datetime
 import os
 
+# Background prediction writer settings
+DB_WRITER_QUEUE_SIZE = int(os.environ.get('DB_WRITER_QUEUE_SIZE', 10000))
+DB_WRITER_BATCH_SIZE = int(os.environ.get('DB_WRITER_BATCH_SIZE', 500))
+DB_WRITER_FLUSH_INTERVAL = float(os.environ.get('DB_WRITER_FLUSH_INTERVAL', 0.2))
+# Attempts at a failed batch insert (with doubling delays) before its rows are
+# inserted one by one
+DB_WRITER_RETRIES = int(os.environ.get('DB_WRITER_RETRIES', 3))
+DB_WRITER_RETRY_DELAY = 0.1
+
+logger = logging.getLogger(__name__)
+
+# Number of equal-width probability bins for calibration tracking
+CALIBRATION_BINS = 10
+# SQLite limits the number of host parameters per statement
+_SQLITE_CHUNK = 500
+
+def _calibration_bin(probability):
+    return min(int(probability * CALIBRATION_BINS), CALIBRATION_BINS - 1)
+
+_INSERT_PREDICTION = '''
+    INSERT INTO predictions (prediction_uid, input_data, prediction, probability,
+                             model_version, response_time_ms, endpoint)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+def _prediction_params(row):
+    uid, input_data, prediction, probability, model_version, response_time_ms, endpoint = row
+    return uid, json.dumps(input_data), prediction, probability, model_version, response_time_ms, endpoint
+
+class PredictionWriter:
+    """Writes queued predictions to SQLite in batches from a background thread"""
+    
+    def __init__(self, db_path, queue_size=DB_WRITER_QUEUE_SIZE, batch_size=DB_WRITER_BATCH_SIZE,
+                 flush_interval=DB_WRITER_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        # Rows inserted one at a time because the queue was full or their batch failed
+        self.fallback_writes = 0
+        self.batches = 0
+        # Failed batch attempts, and rows that could not be stored at all
+        self.write_errors = 0
+        self.lost = 0
+        self._count_lock = threading.Lock()
+        self._start()
+        # Threads do not survive fork: restart the writer in each preloaded worker
+        os.register_at_fork(after_in_child=self._start)
+    
+    def _start(self):
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        threading.Thread(target=self._write_loop, name='prediction-writer', daemon=True).start()
+    
+    def enqueue(self, row):
+        """Queue a predictions row without blocking, returns False if it was dropped"""
+        try:
+            self._queue.put_nowait(row)
+            with self._count_lock:
+                self.enqueued += 1
+            return True
+        except queue.Full:
+            with self._count_lock:
+                self.dropped += 1
+            return False
+    
+    def write_now(self, row):
+        """Insert one row synchronously, returns False if it cannot be stored"""
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            try:
+                conn.execute(_INSERT_PREDICTION, _prediction_params(row))
+                conn.commit()
+            finally:
+                conn.close()
+        except (sqlite3.Error, TypeError, ValueError):
+            return False
+        with self._count_lock:
+            self.fallback_writes += 1
+        return True
+    
+    def flush(self, timeout=5.0):
+        """Wait until everything queued so far has been written, returns False on timeout"""
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+    
+    def get_stats(self):
+        return {
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'fallback_writes': self.fallback_writes,
+            'batches': self.batches,
+            'write_errors': self.write_errors,
+            'lost': self.lost,
+            'queue_depth': self._queue.qsize()
+        }
+    
+    def _write_loop(self):
+        conn = None
+        while True:
+            rows, waiters = [], []
+            try:
+                item = self._queue.get()
+                deadline = time.monotonic() + self.flush_interval
+                while True:
+                    if isinstance(item, threading.Event):
+                        waiters.append(item)
+                        break
+                    rows.append(item)
+                    remaining = deadline - time.monotonic()
+                    if len(rows) >= self.batch_size or remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                
+                if rows:
+                    conn = self._write_batch(conn, rows)
+            except Exception:
+                # The writer must outlive any error, or later rows pile up in the queue unwritten
+                logger.exception("Prediction writer failed on a batch of %d rows", len(rows))
+                with self._count_lock:
+                    self.write_errors += 1
+                    self.lost += len(rows)
+                conn = None
+            finally:
+                for waiter in waiters:
+                    waiter.set()
+    
+    def _write_batch(self, conn, rows):
+        """Insert rows in one transaction, retrying, then one by one; returns the connection to reuse.
+        
+        Their prediction ids were already returned to clients, so a failed batch
+        is not dropped.
+        """
+        for attempt in range(DB_WRITER_RETRIES):
+            try:
+                if conn is None:
+                    conn = sqlite3.connect(self.db_path, timeout=30)
+                conn.executemany(_INSERT_PREDICTION, [_prediction_params(row) for row in rows])
+                conn.commit()
+                with self._count_lock:
+                    self.written += len(rows)
+                    self.batches += 1
+                return conn
+            except sqlite3.Error as e:
+                logger.warning("Prediction batch insert failed (attempt %d of %d): %s", attempt + 1, DB_WRITER_RETRIES, e)
+                with self._count_lock:
+                    self.write_errors += 1
+                if conn is not None:
+                    conn.close()
+                    conn = None
+                # A constraint violation fails the same way every time
+                if isinstance(e, sqlite3.IntegrityError):
+                    break
+                time.sleep(DB_WRITER_RETRY_DELAY * 2 ** attempt)
+        
+        # Only the bad rows are lost when one row (or a transient error) sank the batch
+        failed = [row for row in rows if not self.write_now(row)]
+        if failed:
+            logger.error("Prediction writer lost %d of %d rows", len(failed), len(rows))
+            with self._count_lock:
+                self.lost += len(failed)
+        return conn
+
 class PredictionDatabase:
-    """Simple SQLite database for storing predictions and requests"""
+    """Simple SQLite database for storing predictions and requests.
+    
+    Thread-safe: every method opens its own connection, predictions go through
+    the writer's queue, and feedback updates run in IMMEDIATE transactions.
+    """
     
     def __init__(self, db_path='predictions.db'):
         self.db_path = db_path
         self.init_database()
+        self.writer = PredictionWriter(db_path)
     
     def init_database(self):
         """Initialize the database with required tables"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
+        # WAL lets the background writer, feedback upserts and readers in other workers overlap
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Create predictions table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS predictions (
@@ -29,6 +215,42 @@ class PredictionDatabase:
             )
         ''')
         
+        # Public prediction ids that clients attach ground-truth labels to
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(predictions)')]
+        if 'prediction_uid' not in columns:
+            cursor.execute('ALTER TABLE predictions ADD COLUMN prediction_uid TEXT')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_predictions_uid ON predictions (prediction_uid)')
+        
+        # Ground-truth labels reported after the fact
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS feedback (
+                prediction_uid TEXT PRIMARY KEY,
+                actual_churn INTEGER NOT NULL,
+                received_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Incrementally maintained confusion matrix and calibration bins per model version
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS quality_confusion (
+                model_version TEXT PRIMARY KEY,
+                true_positives INTEGER NOT NULL DEFAULT 0,
+                false_positives INTEGER NOT NULL DEFAULT 0,
+                true_negatives INTEGER NOT NULL DEFAULT 0,
+                false_negatives INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS quality_calibration (
+                model_version TEXT NOT NULL,
+                bin INTEGER NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                probability_sum REAL NOT NULL DEFAULT 0,
+                positives INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (model_version, bin)
+            )
+        ''')
+        
         # Create requests table for API monitoring
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS api_requests (
@@ -76,6 +298,157 @@ class PredictionDatabase:
         
         return prediction_id
     
+    def queue_prediction(self, input_data, prediction, probability, model_version='v1.0',
+                         response_time_ms=None, endpoint='/predict'):
+        """Queue a prediction for the background writer, returns its public prediction id.
+        
+        When the writer's queue is full the row is inserted synchronously
+        instead; None is returned only if that fails too, since the id could
+        never be labelled.
+        """
+        prediction_uid = uuid.uuid4().hex
+        row = (prediction_uid, input_data, prediction, probability, model_version, response_time_ms, endpoint)
+        if self.writer.enqueue(row) or self.writer.write_now(row):
+            return prediction_uid
+        return None
+    
+    def record_feedback(self, labels):
+        """Upsert ground-truth labels and fold them into the quality aggregates.
+        
+        `labels` maps prediction id -> actual churn (0/1). Relabelling a prediction
+        replaces its previous contribution. Returns the ids that matched no stored
+        prediction (those are not recorded).
+        """
+        uids = list(labels)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            # Serialize feedback writers so previous labels are read consistently
+            conn.execute('BEGIN IMMEDIATE')
+            predictions, previous = {}, {}
+            for i in range(0, len(uids), _SQLITE_CHUNK):
+                chunk = uids[i:i + _SQLITE_CHUNK]
+                placeholders = ','.join('?' * len(chunk))
+                for uid, prediction, probability, model_version in conn.execute(f'''
+                    SELECT prediction_uid, prediction, probability, model_version
+                    FROM predictions WHERE prediction_uid IN ({placeholders})
+                ''', chunk):
+                    predictions[uid] = (prediction, probability, model_version)
+                for uid, actual in conn.execute(f'''
+                    SELECT prediction_uid, actual_churn FROM feedback WHERE prediction_uid IN ({placeholders})
+                ''', chunk):
+                    previous[uid] = actual
+            
+            confusion, calibration = {}, {}
+            def apply(prediction, probability, model_version, actual, sign):
+                cell = ('true' if prediction == actual else 'false') + ('_positives' if prediction == 1 else '_negatives')
+                counts = confusion.setdefault(model_version, {
+                    'true_positives': 0, 'false_positives': 0, 'true_negatives': 0, 'false_negatives': 0
+                })
+                counts[cell] += sign
+                bin_counts = calibration.setdefault((model_version, _calibration_bin(probability)), [0, 0.0, 0])
+                bin_counts[0] += sign
+                bin_counts[1] += sign * probability
+                bin_counts[2] += sign * actual
+            
+            upserts = []
+            for uid in uids:
+                if uid not in predictions:
+                    continue
+                actual = labels[uid]
+                if previous.get(uid) == actual:
+                    continue
+                prediction, probability, model_version = predictions[uid]
+                if uid in previous:
+                    apply(prediction, probability, model_version, previous[uid], -1)
+                apply(prediction, probability, model_version, actual, 1)
+                upserts.append((uid, actual))
+            
+            conn.executemany('''
+                INSERT INTO feedback (prediction_uid, actual_churn) VALUES (?, ?)
+                ON CONFLICT(prediction_uid) DO UPDATE SET
+                    actual_churn = excluded.actual_churn, received_at = CURRENT_TIMESTAMP
+            ''', upserts)
+            conn.executemany('''
+                INSERT INTO quality_confusion (model_version, true_positives, false_positives, true_negatives, false_negatives)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(model_version) DO UPDATE SET
+                    true_positives = true_positives + excluded.true_positives,
+                    false_positives = false_positives + excluded.false_positives,
+                    true_negatives = true_negatives + excluded.true_negatives,
+                    false_negatives = false_negatives + excluded.false_negatives
+            ''', [(version, c['true_positives'], c['false_positives'], c['true_negatives'], c['false_negatives'])
+                  for version, c in confusion.items()])
+            conn.executemany('''
+                INSERT INTO quality_calibration (model_version, bin, count, probability_sum, positives)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(model_version, bin) DO UPDATE SET
+                    count = count + excluded.count,
+                    probability_sum = probability_sum + excluded.probability_sum,
+                    positives = positives + excluded.positives
+            ''', [(version, bin_index, c[0], c[1], c[2]) for (version, bin_index), c in calibration.items()])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        return [uid for uid in uids if uid not in predictions]
+    
+    def get_quality_metrics(self):
+        """Get live precision, recall and calibration per model version from the aggregates"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        confusion = cursor.execute('''
+            SELECT model_version, true_positives, false_positives, true_negatives, false_negatives
+            FROM quality_confusion
+        ''').fetchall()
+        calibration = cursor.execute('''
+            SELECT model_version, bin, count, probability_sum, positives
+            FROM quality_calibration WHERE count > 0 ORDER BY model_version, bin
+        ''').fetchall()
+        conn.close()
+        
+        metrics = {}
+        for model_version, tp, fp, tn, fn in confusion:
+            total = tp + fp + tn + fn
+            precision = tp / (tp + fp) if tp + fp else None
+            recall = tp / (tp + fn) if tp + fn else None
+            metrics[model_version] = {
+                'labelled_predictions': total,
+                'confusion_matrix': {
+                    'true_positives': tp, 'false_positives': fp,
+                    'true_negatives': tn, 'false_negatives': fn
+                },
+                'accuracy': round((tp + tn) / total, 4) if total else None,
+                'precision': round(precision, 4) if precision is not None else None,
+                'recall': round(recall, 4) if recall is not None else None,
+                'f1_score': round(2 * precision * recall / (precision + recall), 4) if precision and recall else None,
+                'calibration': [],
+                'expected_calibration_error': None
+            }
+        
+        for model_version, bin_index, count, probability_sum, positives in calibration:
+            entry = metrics.get(model_version)
+            if entry is None:
+                continue
+            entry['calibration'].append({
+                'bin': [bin_index / CALIBRATION_BINS, (bin_index + 1) / CALIBRATION_BINS],
+                'count': count,
+                'mean_predicted': round(probability_sum / count, 4),
+                'observed_rate': round(positives / count, 4)
+            })
+        
+        for entry in metrics.values():
+            total = entry['labelled_predictions']
+            if total:
+                entry['expected_calibration_error'] = round(sum(
+                    b['count'] / total * abs(b['mean_predicted'] - b['observed_rate']) for b in entry['calibration']
+                ), 4)
+        
+        return metrics
+    
     def store_api_request(self, endpoint, method, status_code, response_time_ms, user_agent=None, ip_address=None):
         """Store API request information"""
         conn = sqlite3.connect(self.db_path)
@@ -183,4 +556,4 @@ class PredictionDatabase:
         ]
 
 # Global database instance
-db = PredictionDatabase()
\ No newline at end of file
+db = PredictionDatabase(os.environ.get('PREDICTIONS_DB', 'predictions.db'))
\ No newline at end of file
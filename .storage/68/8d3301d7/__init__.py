@@ -1,19 +1,34 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from config import Config
 
-db = SQLAlchemy()
-migrate = Migrate()
+def _create_extensions():
+    global db, migrate
+    from flask_sqlalchemy import SQLAlchemy
+    from flask_migrate import Migrate
+    
+    db = SQLAlchemy()
+    migrate = Migrate()
+
+def __getattr__(name):
+    # flask_sqlalchemy and flask_migrate are slow to import and unused by the
+    # prediction endpoints, so `db` and `migrate` are created on first access
+    if name in ('db', 'migrate'):
+        _create_extensions()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
-    db.init_app(app)
-    migrate.init_app(app, db)
+    if app.config.get('SQLALCHEMY_ENABLED'):
+        if 'db' not in globals():
+            _create_extensions()
+        db.init_app(app)
+        migrate.init_app(app, db)
 
-    from app.routes import main_bp
+    from app.routes import main_bp, init_model
     app.register_blueprint(main_bp)
+    init_model()
 
     return app 
\ No newline at end of file
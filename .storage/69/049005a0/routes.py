@@ -1,11 +1,16 @@
-from flask import Blueprint, jsonify, request, render_template_string
+from flask import Blueprint, Response, current_app, jsonify, request, render_template_string
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from functools import wraps
+import hmac
 import sys
+import time
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 # Import monitoring components with error handling
 try:
-    from app.monitoring import monitor_requests, monitor
+    from app.monitoring import monitor_requests, monitor, request_stage, current_stage_timer
     MONITORING_ENABLED = True
 except ImportError as e:
     print(f"Warning: Monitoring disabled due to import error: {e}")
@@ -14,20 +19,137 @@ except ImportError as e:
     def monitor_requests(f):
         return f
     
+    def request_stage(name):
+        return nullcontext()
+    
+    def current_stage_timer():
+        return None
+    
     class DummyMonitor:
         def log_prediction(self, *args, **kwargs):
             pass
+        def log_batch(self, *args, **kwargs):
+            pass
         def get_metrics(self):
             return {"error": "Monitoring unavailable"}
+        def register_stats_source(self, *args, **kwargs):
+            pass
+        def render_prometheus(self, model_version=None):
+            return ""
     
     monitor = DummyMonitor()
 
-from ml_model.model_utils import ChurnPredictor, validate_customer_data
+from app.admission import AdmissionController, DeadlineCounters, admission_control, request_deadline
+from app.database import db as prediction_db
+from app.drift import DriftMonitor
+from app.feature_store import FEATURES, FeatureStore
+from app.profiler import profiler
+from app.ratelimit import TokenBucketLimiter, rate_limited
+from app.scheduling import PriorityScheduler, prioritized
+from ml_model.batch_scoring import RiskTable
+from ml_model.model_utils import ChurnPredictor, DeadlineExceeded, validate_customer_data
 
 main_bp = Blueprint('main', __name__)
 
-# Initialize the predictor
-predictor = ChurnPredictor()
+# The model is loaded by init_model (called from create_app), not at import time
+predictor = ChurnPredictor(autoload=False)
+
+# Streaming input statistics for drift detection against the training data
+drift = DriftMonitor()
+
+# Maximum number of labels accepted per /feedback call
+MAX_FEEDBACK_BATCH = 10000
+# Incremental /retrain runs inside the request, so its size is bounded; larger
+# batches go through `train_model.py --incremental`
+MAX_RETRAIN_ROWS = 50000
+MAX_RETRAIN_TREES = 500
+# Unknown prediction ids are matched once more after this many seconds, giving
+# other workers' background writers time to write their pending batches
+FEEDBACK_RETRY_DELAY = float(os.environ.get('FEEDBACK_RETRY_DELAY', 0.5))
+
+# Adaptive concurrency limits for the scoring routes, one per route since
+# their latencies differ by the batch size
+admission = {
+    'predict': AdmissionController('predict'),
+    'batch_predict': AdmissionController('batch_predict')
+}
+
+# Slots shared by the priority classes, so bulk work cannot starve /predict
+scheduler = PriorityScheduler()
+
+# Work abandoned because the X-Request-Deadline-Ms budget ran out
+deadline_counters = DeadlineCounters()
+
+# Per-client token buckets, shared by all workers on the host
+limiter = TokenBucketLimiter()
+
+# Nightly precomputed scores by customer_id (ml_model/batch_scoring.py)
+risk_table = RiskTable()
+
+# Raw features by customer_id, so callers can send just an id
+feature_store = FeatureStore()
+
+if MONITORING_ENABLED:
+    monitor.register_stats_source('db_writer', prediction_db.writer.get_stats)
+    for name, controller in admission.items():
+        monitor.register_stats_source(f'admission_{name}', controller.get_stats)
+    for name in scheduler.classes:
+        monitor.register_stats_source(f'scheduler_{name}', lambda name=name: scheduler.get_stats()[name])
+    monitor.register_stats_source('deadlines', deadline_counters.get_stats)
+    monitor.register_stats_source('rate_limit', limiter.get_stats)
+    monitor.register_stats_source('coalescing', predictor.flights.get_stats)
+    monitor.register_stats_source('risk_table', risk_table.get_stats)
+    monitor.register_stats_source('feature_store', feature_store.get_stats)
+
+def _check_deadline(deadline, phase):
+    if deadline is not None:
+        deadline.check(phase)
+
+def _with_stored_features(records):
+    """Complete records that carry a customer_id but not every feature from the feature store.
+    
+    Fields sent by the caller win over stored ones. Returns the records and
+    the ids that the store does not know.
+    """
+    wanted = [
+        str(record['customer_id']) for record in records
+        if isinstance(record, dict) and record.get('customer_id') is not None
+        and any(feature not in record for feature in FEATURES)
+    ]
+    if not wanted:
+        return records, []
+    stored = feature_store.get_many(wanted)
+    completed = [
+        dict(stored[str(record['customer_id'])], **record)
+        if isinstance(record, dict) and str(record.get('customer_id')) in stored else record
+        for record in records
+    ]
+    return completed, [customer_id for customer_id in wanted if customer_id not in stored]
+
+def init_model():
+    """Load the model and drift reference once per process.
+    
+    With gunicorn's preload_app this runs in the master, so the workers share
+    the loaded model through copy-on-write pages.
+    """
+    if predictor.model_artifacts is None:
+        predictor.load_model()
+        drift.set_reference(predictor.get_reference_profile())
+
+def require_admin(f):
+    """Decorator restricting an endpoint to callers presenting the admin token"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        admin_token = current_app.config.get('ADMIN_TOKEN')
+        if not admin_token:
+            return jsonify({"error": "Admin endpoints are disabled"}), 403
+        
+        supplied = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(supplied.encode(), admin_token.encode()):
+            return jsonify({"error": "Invalid admin token"}), 401
+        
+        return f(*args, **kwargs)
+    return decorated_function
 
 @main_bp.route('/')
 @monitor_requests
@@ -62,6 +184,11 @@ def index():
                 <p>Check API health status</p>
             </div>
             
+            <div class="endpoint">
+                <h3><span class="method">GET</span> /livez, /readyz</h3>
+                <p>Liveness and readiness probes; ready once the model is loaded and warmed up</p>
+            </div>
+            
             <div class="endpoint">
                 <h3><span class="method">GET</span> /model/info</h3>
                 <p>Get information about the loaded model</p>
@@ -72,6 +199,16 @@ def index():
                 <p>Get API usage metrics and monitoring data</p>
             </div>
             
+            <div class="endpoint">
+                <h3><span class="method">GET</span> /metrics/prometheus</h3>
+                <p>Metrics in the Prometheus text exposition format</p>
+            </div>
+            
+            <div class="endpoint">
+                <h3><span class="method">GET</span> /monitoring/drift</h3>
+                <p>Input drift (PSI/KS) per feature against the training data</p>
+            </div>
+            
             <div class="endpoint">
                 <h3><span class="method">POST</span> /predict</h3>
                 <p>Predict churn for a single customer</p>
@@ -93,6 +230,16 @@ def index():
                 <p>Predict churn for multiple customers (send array of customer objects)</p>
             </div>
             
+            <div class="endpoint">
+                <h3><span class="method">POST</span> /feedback</h3>
+                <p>Report actual churn for earlier predictions (send array of {prediction_id, actual_churn})</p>
+            </div>
+            
+            <div class="endpoint">
+                <h3><span class="method">GET</span> /model/quality</h3>
+                <p>Live precision, recall and calibration per model version</p>
+            </div>
+            
             <div class="test-form">
                 <h3>🧪 Test Single Prediction</h3>
                 <form id="predictionForm">
@@ -216,13 +363,32 @@ def index():
 @monitor_requests
 def health():
     """Health check endpoint"""
+    ready = predictor.is_ready()
     return jsonify({
-        "status": "healthy",
+        "status": "healthy" if ready else "not_ready",
         "service": "Customer Churn Prediction API",
         "model_loaded": predictor.model_artifacts is not None,
+        "ready": ready,
         "monitoring_enabled": MONITORING_ENABLED
     })
 
+# Probes are not wrapped in monitor_requests: they would swamp the request counters
+@main_bp.route('/livez')
+def liveness():
+    """Liveness probe: the worker is up and serving requests"""
+    return jsonify({"status": "alive"})
+
+@main_bp.route('/readyz')
+def readiness():
+    """Readiness probe: 200 only once a model is loaded and warmed up"""
+    if not predictor.is_ready():
+        return jsonify({"status": "not_ready", "reason": "model not loaded"}), 503
+    return jsonify({
+        "status": "ready",
+        "model_version": predictor.get_model_version(),
+        "warmup": predictor.warmup_stats
+    })
+
 @main_bp.route('/model/info')
 @monitor_requests
 def model_info():
@@ -236,40 +402,169 @@ def get_metrics():
     return jsonify({
         "success": True,
         "metrics": monitor.get_metrics(),
+        "admission": {name: controller.get_stats() for name, controller in admission.items()},
+        "scheduler": scheduler.get_stats(),
+        "deadlines": deadline_counters.get_stats(),
+        "rate_limit": limiter.get_stats(),
+        "coalescing": predictor.flights.get_stats(),
+        "risk_table": risk_table.get_stats(),
+        "feature_store": feature_store.get_stats(),
         "service": "Customer Churn Prediction API",
         "monitoring_enabled": MONITORING_ENABLED
     })
 
+@main_bp.route('/feedback', methods=['POST'])
+@monitor_requests
+@rate_limited(limiter, 'feedback')
+def submit_feedback():
+    """Attach ground-truth churn labels to earlier predictions"""
+    try:
+        data = request.get_json()
+        if isinstance(data, dict):
+            data = [data]
+        
+        if not data or not isinstance(data, list):
+            return jsonify({"error": "Data must be a list of {prediction_id, actual_churn} objects"}), 400
+        
+        if len(data) > MAX_FEEDBACK_BATCH:
+            return jsonify({"error": f"Maximum {MAX_FEEDBACK_BATCH} labels per request"}), 400
+        
+        labels = {}
+        for i, item in enumerate(data):
+            if not isinstance(item, dict) or not isinstance(item.get('prediction_id'), str):
+                return jsonify({"error": f"Label {i}: prediction_id must be a string"}), 400
+            if item.get('actual_churn') not in (0, 1):
+                return jsonify({"error": f"Label {i}: actual_churn must be 0 or 1"}), 400
+            labels[item['prediction_id']] = int(item['actual_churn'])
+        
+        # Only this worker's writer can be flushed. A prediction served by another
+        # worker may still be in that worker's queue, so unknown ids are retried once
+        # after FEEDBACK_RETRY_DELAY; ones still unknown after that are not recorded.
+        prediction_db.writer.flush()
+        unknown_ids = prediction_db.record_feedback(labels)
+        if unknown_ids and FEEDBACK_RETRY_DELAY > 0:
+            time.sleep(FEEDBACK_RETRY_DELAY)
+            unknown_ids = prediction_db.record_feedback({uid: labels[uid] for uid in unknown_ids})
+        
+        return jsonify({
+            "success": True,
+            "accepted": len(labels) - len(unknown_ids),
+            "unknown_prediction_ids": unknown_ids
+        })
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@main_bp.route('/model/quality')
+@monitor_requests
+def model_quality():
+    """Get live model quality per model version from ground-truth feedback"""
+    return jsonify({
+        "success": True,
+        "current_model_version": predictor.get_model_version(),
+        "quality": prediction_db.get_quality_metrics()
+    })
+
+@main_bp.route('/monitoring/drift')
+@monitor_requests
+def get_drift():
+    """Get per-feature drift (PSI/KS) of served inputs against the training data"""
+    report = drift.get_report()
+    if 'error' in report:
+        return jsonify(report), 404
+    return jsonify({"success": True, "drift": report})
+
+# Not wrapped in monitor_requests: scrapes should not show up in the request counters
+@main_bp.route('/metrics/prometheus')
+def get_prometheus_metrics():
+    """Get API metrics in the Prometheus text exposition format"""
+    return Response(
+        monitor.render_prometheus(model_version=predictor.get_model_version()),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
 @main_bp.route('/predict', methods=['POST'])
 @monitor_requests
+@rate_limited(limiter, 'predict')
+@admission_control(admission['predict'])
+@prioritized(scheduler, 'interactive')
 def predict_single():
     """Predict churn for a single customer"""
     try:
-        data = request.get_json()
+        deadline = request_deadline(request.environ)
+        with request_stage('parse'):
+            data = request.get_json()
         
         if not data:
             return jsonify({"error": "No data provided"}), 400
         
+        # {"customer_id": ...} alone is scored with the stored features
+        with request_stage('features'):
+            (data,), unknown = _with_stored_features([data])
+        if unknown:
+            return jsonify({"error": f"Unknown customer_id: {unknown[0]}"}), 404
+        
         # Validate input data
-        is_valid, message = validate_customer_data(data)
+        _check_deadline(deadline, 'parsing')
+        with request_stage('validate'):
+            is_valid, message = validate_customer_data(data)
         if not is_valid:
             return jsonify({"error": message}), 400
         
         # Make prediction
-        result = predictor.predict_single(data)
+        _check_deadline(deadline, 'validation')
+        result = predictor.predict_single(data, timer=current_stage_timer(), deadline=deadline)
         
         # Log prediction for monitoring (if enabled)
-        if MONITORING_ENABLED:
-            monitor.log_prediction(
-                input_data=data,
-                prediction=result['churn_prediction'],
-                confidence=result['churn_probability']
+        with request_stage('monitoring'):
+            result['prediction_id'] = prediction_db.queue_prediction(
+                data, result['churn_prediction'], result['churn_probability'],
+                model_version=predictor.get_model_version(), endpoint='/predict'
             )
+            drift.update(data)
+            if MONITORING_ENABLED:
+                monitor.log_prediction(
+                    input_data=data,
+                    prediction=result['churn_prediction'],
+                    confidence=result['churn_probability']
+                )
+        
+        with request_stage('serialize'):
+            return jsonify({
+                "success": True,
+                "prediction": result,
+                "input_data": data
+            })
+        
+    except DeadlineExceeded as e:
+        deadline_counters.record('predict', e.phase, rows_skipped=1)
+        return jsonify({"error": str(e), "deadline_exceeded": True}), 504
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@main_bp.route('/customers/<customer_id>/risk')
+@monitor_requests
+@rate_limited(limiter, 'customer_risk')
+def customer_risk(customer_id):
+    """Churn risk of a known customer from the precomputed table, rescored live when stale"""
+    try:
+        risk = risk_table.get_risk(customer_id, predictor)
+        if risk is None:
+            # Not in the nightly table: score live if the feature store knows the customer
+            features = feature_store.get(customer_id)
+            if features is None:
+                return jsonify({"error": f"Unknown customer_id: {customer_id}"}), 404
+            result = predictor.predict_single(features)
+            risk = dict(result, model_version=predictor.get_model_version(), scored_at=time.time(), source='live')
         
         return jsonify({
             "success": True,
-            "prediction": result,
-            "input_data": data
+            "customer_id": customer_id,
+            "churn_prediction": risk['churn_prediction'],
+            "churn_probability": risk['churn_probability'],
+            "model_version": risk['model_version'],
+            "scored_at": datetime.fromtimestamp(risk['scored_at'], timezone.utc).isoformat(),
+            "source": risk['source']
         })
         
     except Exception as e:
@@ -277,10 +572,17 @@ def predict_single():
 
 @main_bp.route('/batch_predict', methods=['POST'])
 @monitor_requests
+@rate_limited(limiter, 'batch_predict')
+@admission_control(admission['batch_predict'])
+@prioritized(scheduler, 'bulk')
 def predict_batch():
     """Predict churn for multiple customers"""
     try:
-        data = request.get_json()
+        deadline = request_deadline(request.environ)
+        # With X-Allow-Partial, an expired deadline returns the rows scored so far
+        allow_partial = request.headers.get('X-Allow-Partial', '').lower() in ('1', 'true')
+        with request_stage('parse'):
+            data = request.get_json()
         
         if not data or not isinstance(data, list):
             return jsonify({"error": "Data must be a list of customer objects"}), 400
@@ -288,51 +590,157 @@ def predict_batch():
         if len(data) > 100:
             return jsonify({"error": "Maximum 100 customers per batch"}), 400
         
+        # Customers given only by id are completed with one multi-get
+        with request_stage('features'):
+            data, unknown = _with_stored_features(data)
+        if unknown:
+            return jsonify({"error": f"Unknown customer_ids: {unknown}"}), 404
+        
         # Validate each customer data
-        for i, customer in enumerate(data):
-            is_valid, message = validate_customer_data(customer)
-            if not is_valid:
-                return jsonify({"error": f"Customer {i}: {message}"}), 400
+        _check_deadline(deadline, 'parsing')
+        with request_stage('validate'):
+            for i, customer in enumerate(data):
+                is_valid, message = validate_customer_data(customer)
+                if not is_valid:
+                    return jsonify({"error": f"Customer {i}: {message}"}), 400
         
         # Make predictions
-        results = predictor.predict_batch(data)
+        truncated = False
+        try:
+            _check_deadline(deadline, 'validation')
+            results = predictor.predict_batch(data, timer=current_stage_timer(), deadline=deadline)
+        except DeadlineExceeded as e:
+            partial = allow_partial and bool(e.results)
+            deadline_counters.record('batch_predict', e.phase, rows_skipped=len(data) - len(e.results), partial=partial)
+            if not partial:
+                return jsonify({"error": str(e), "deadline_exceeded": True}), 504
+            results = e.results
+            truncated = True
         
-        # Log batch predictions (if monitoring enabled)
-        if MONITORING_ENABLED:
-            for i, result in enumerate(results):
-                monitor.log_prediction(
-                    input_data=data[i],
-                    prediction=result['churn_prediction'],
-                    confidence=result['churn_probability']
+        # Log one summary record for the batch (if monitoring enabled)
+        with request_stage('monitoring'):
+            model_version = predictor.get_model_version()
+            for customer, result in zip(data, results):
+                result['prediction_id'] = prediction_db.queue_prediction(
+                    customer, result['churn_prediction'], result['churn_probability'],
+                    model_version=model_version, endpoint='/batch_predict'
                 )
+            drift.update_batch(data[:len(results)])
+            if MONITORING_ENABLED:
+                monitor.log_batch(results)
         
-        return jsonify({
-            "success": True,
-            "predictions": results,
-            "total_customers": len(data)
-        })
+        with request_stage('serialize'):
+            return jsonify({
+                "success": True,
+                "predictions": results,
+                "total_customers": len(data),
+                "scored_customers": len(results),
+                "truncated": truncated
+            })
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _incremental_options(options):
+    """Validated train_incremental keyword arguments from a /retrain body, or (None, error)"""
+    data = options.get('data')
+    if not data or not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+        return None, "Incremental training needs labeled rows (objects) in 'data'"
+    if len(data) > MAX_RETRAIN_ROWS:
+        return None, f"Maximum {MAX_RETRAIN_ROWS} rows per request; use train_model.py --incremental for more"
+    for i, row in enumerate(data):
+        is_valid, message = validate_customer_data(row)
+        if not is_valid:
+            return None, f"Row {i}: {message}"
+        if row.get('churn') not in (0, 1):
+            return None, f"Row {i}: churn must be 0 or 1"
+    
+    kwargs = {}
+    for key, name, minimum in (('trees', 'n_new_trees', 1), ('max_trees', 'max_trees', 0)):
+        if key in options:
+            value = options[key]
+            # bool is an int subclass, but true/false is never a tree count
+            if not isinstance(value, int) or isinstance(value, bool) or not minimum <= value <= MAX_RETRAIN_TREES:
+                return None, f"'{key}' must be an integer from {minimum} to {MAX_RETRAIN_TREES}"
+            kwargs[name] = value
+    if 'compare' in options:
+        if not isinstance(options['compare'], bool):
+            return None, "'compare' must be true or false"
+        kwargs['compare'] = options['compare']
+    return kwargs, None
+
 @main_bp.route('/retrain', methods=['POST'])
 @monitor_requests
+@prioritized(scheduler, 'maintenance')
 def retrain_model():
-    """Retrain the model (in production, this would be more sophisticated)"""
+    """Retrain the model (in production, this would be more sophisticated).
+    
+    With {"mode": "incremental", "data": [labeled customers]} the current forest
+    grows extra trees on the new rows instead of being rebuilt from scratch.
+    Training runs synchronously in the request, in the maintenance priority class.
+    """
     try:
-        from ml_model.train_model import train_churn_model
+        from ml_model.train_model import train_churn_model, train_incremental
         
-        # Retrain model
-        model_artifacts = train_churn_model()
+        options = request.get_json(silent=True) or {}
+        if options.get('mode') == 'incremental':
+            kwargs, error = _incremental_options(options)
+            if error:
+                return jsonify({"error": error}), 400
+            model_artifacts = train_incremental(options['data'], predictor.model_path, **kwargs)
+        else:
+            model_artifacts = train_churn_model()
         
         # Reload predictor
         predictor.load_model()
+        drift.set_reference(predictor.get_reference_profile())
         
         return jsonify({
             "success": True,
             "message": "Model retrained successfully",
-            "new_accuracy": model_artifacts['accuracy']
+            "new_accuracy": model_artifacts['accuracy'],
+            "training": model_artifacts.get('training_history', [None])[-1]
         })
         
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+# Admin endpoints are not wrapped in monitor_requests so they are never profiled themselves
+@main_bp.route('/admin/profile', methods=['POST'])
+@require_admin
+def start_profile():
+    """Profile this worker in the background for N seconds"""
+    try:
+        status = profiler.start(
+            seconds=request.args.get('seconds', 10),
+            mode=request.args.get('mode', 'sample'),
+            interval=float(request.args.get('interval_ms', 5)) / 1000
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if status is None:
+        return jsonify({"error": "A profiling session is already running", "profile": profiler.get_status()}), 409
+    
+    return jsonify({"success": True, "profile": status}), 202
+
+@main_bp.route('/admin/profile', methods=['GET'])
+@require_admin
+def get_profile():
+    """Get the result of the newest profiling session of any worker (collapsed stacks or cProfile stats).
+    
+    `?pid=` picks a worker. While the newest session is running, returns the
+    status of each worker's last session instead.
+    """
+    sessions = profiler.get_sessions()
+    pid = request.args.get('pid', type=int)
+    if pid is not None:
+        sessions = [session for session in sessions if session['pid'] == pid]
+    if sessions and sessions[0]['status'] == 'finished':
+        return Response(sessions[0]['result'], content_type='text/plain; charset=utf-8',
+                        headers={'X-Profile-Pid': str(sessions[0]['pid'])})
+    
+    workers = [{key: value for key, value in session.items() if key != 'result'} for session in sessions]
+    return jsonify({"success": True, "profile": workers[0] if workers else profiler.get_status(), "workers": workers})
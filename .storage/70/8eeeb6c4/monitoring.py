@@ -1,33 +1,196 @@
+import atexit
 import logging
+import logging.handlers
+import queue
+import threading
 import time
+from bisect import bisect_left
+from contextlib import nullcontext
 from functools import wraps
-from flask import request, jsonify
+from flask import g, make_response, request, jsonify
 import json
 from datetime import datetime
 import os
+from app.capture import recorder_from_env
+from app.profiler import profiler
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
-)
+# Logging settings. Every worker appends to the same LOG_FILE, so rotation is
+# left to an external tool (logrotate): workers reopen the file once it moves.
+LOG_FILE = os.environ.get('LOG_FILE', 'app.log')
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# Fraction of PREDICTION records written to the log (1.0 logs every prediction)
+PREDICTION_LOG_SAMPLE_RATE = float(os.environ.get('PREDICTION_LOG_SAMPLE_RATE', 1.0))
+# Per-stage request timing and the Server-Timing response header
+STAGE_TIMING_ENABLED = os.environ.get('STAGE_TIMING_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+class _LazyJSON:
+    """Defer json.dumps until the record is formatted on the listener thread"""
+    __slots__ = ('data',)
+    
+    def __init__(self, data):
+        self.data = data
+    
+    def __str__(self):
+        return json.dumps(self.data)
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """Non-blocking queue handler that drops records instead of waiting when the queue is full"""
+    
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.enqueued = 0
+        self.dropped = 0
+        self._count_lock = threading.Lock()
+    
+    def prepare(self, record):
+        # Formatting happens in the listener thread, not in the request
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            with self._count_lock:
+                self.enqueued += 1
+        except queue.Full:
+            with self._count_lock:
+                self.dropped += 1
+
+# Configure logging: requests only enqueue records, a listener thread writes them
+_log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_file_handler = logging.handlers.WatchedFileHandler(LOG_FILE)
+_stream_handler = logging.StreamHandler()
+for _handler in (_file_handler, _stream_handler):
+    _handler.setFormatter(_formatter)
+
+queue_handler = BackgroundQueueHandler(_log_queue)
+logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
+
+def _start_log_listener():
+    listener = logging.handlers.QueueListener(
+        _log_queue, _file_handler, _stream_handler, respect_handler_level=True
+    )
+    listener.start()
+    # Named so the profiler can leave this idle thread out of its samples
+    listener._thread.name = 'log-listener'
+    return listener
+
+def _stop_log_listener():
+    _log_listener.stop()
+
+_log_listener = _start_log_listener()
+atexit.register(_stop_log_listener)
+
+def _restart_log_listener():
+    """Threads do not survive fork: give each (preloaded) worker its own queue and listener"""
+    global _log_queue, _log_listener
+    _log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler.queue = _log_queue
+    _log_listener = _start_log_listener()
+
+os.register_at_fork(after_in_child=_restart_log_listener)
 
 logger = logging.getLogger(__name__)
 
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape_label(value):
+    """Escape a label value for the Prometheus text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class _Stage:
+    """Context manager adding its elapsed time to one stage of a StageTimer"""
+    __slots__ = ('timer', 'name', 'start')
+    
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        stages = self.timer.stages
+        stages[self.name] = stages.get(self.name, 0.0) + time.perf_counter() - self.start
+        return False
+
+class StageTimer:
+    """Accumulates wall time per named stage of a single request"""
+    __slots__ = ('stages',)
+    
+    def __init__(self):
+        self.stages = {}
+    
+    def stage(self, name):
+        return _Stage(self, name)
+    
+    def server_timing_header(self, total):
+        """Format the stages as a Server-Timing header value (durations in ms)"""
+        parts = [f'{name};dur={seconds * 1000:.3f}' for name, seconds in self.stages.items()]
+        parts.append(f'total;dur={total * 1000:.3f}')
+        return ', '.join(parts)
+
+_NO_STAGE = nullcontext()
+
+def current_stage_timer():
+    """Get the StageTimer of the current request, or None when stage timing is disabled"""
+    if not STAGE_TIMING_ENABLED:
+        return None
+    return g.get('stage_timer')
+
+def request_stage(name):
+    """Time a block of the current request as stage `name`"""
+    timer = current_stage_timer()
+    return timer.stage(name) if timer is not None else _NO_STAGE
+
 class APIMonitor:
+    """In-process request and prediction metrics.
+    
+    Safe for threaded workers: each group of counters has its own lock, held
+    only for the few dict/int updates of a request, and readers copy under the
+    same lock before rendering.
+    """
+    
     def __init__(self):
+        self._request_lock = threading.Lock()
+        self._prediction_lock = threading.Lock()
+        self._stage_lock = threading.Lock()
+        
         self.request_count = 0
         self.prediction_count = 0
         self.error_count = 0
         self.start_time = time.time()
+        self.sampled_out_count = 0
+        
+        # Pre-aggregated state for the Prometheus exposition
+        self.request_counts = {}        # (endpoint, method, status_code) -> count
+        self.latency_histograms = {}    # endpoint -> [bucket counts..., +Inf count]
+        self.latency_sums = {}          # endpoint -> total seconds
+        self.prediction_classes = {0: 0, 1: 0}
+        self.stage_stats = {}           # (endpoint, stage) -> [count, total seconds, max seconds]
+        self.stats_sources = {}         # name -> callable returning {stat: number}
         
     def log_request(self, endpoint, method, status_code, response_time):
         """Log API request details"""
-        self.request_count += 1
+        bucket = bisect_left(LATENCY_BUCKETS, response_time)
+        key = (endpoint, method, status_code)
+        
+        with self._request_lock:
+            self.request_count += 1
+            request_count = self.request_count
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+            
+            histogram = self.latency_histograms.get(endpoint)
+            if histogram is None:
+                histogram = self.latency_histograms[endpoint] = [0] * (len(LATENCY_BUCKETS) + 1)
+                self.latency_sums[endpoint] = 0.0
+            histogram[bucket] += 1
+            self.latency_sums[endpoint] += response_time
+            
+            if status_code >= 400:
+                self.error_count += 1
         
         log_data = {
             'timestamp': datetime.utcnow().isoformat(),
@@ -35,27 +198,102 @@ class APIMonitor:
             'method': method,
             'status_code': status_code,
             'response_time_ms': round(response_time * 1000, 2),
-            'request_count': self.request_count
+            'request_count': request_count
         }
         
-        logger.info(f"API_REQUEST: {json.dumps(log_data)}")
-        
-        if status_code >= 400:
-            self.error_count += 1
+        logger.info("API_REQUEST: %s", _LazyJSON(log_data))
             
+    def log_stages(self, endpoint, stages):
+        """Fold one request's stage timings into the per-endpoint aggregates"""
+        with self._stage_lock:
+            for name, seconds in stages.items():
+                stats = self.stage_stats.get((endpoint, name))
+                if stats is None:
+                    stats = self.stage_stats[(endpoint, name)] = [0, 0.0, 0.0]
+                stats[0] += 1
+                stats[1] += seconds
+                if seconds > stats[2]:
+                    stats[2] = seconds
+    
+    def _copy_stage_stats(self):
+        with self._stage_lock:
+            return {key: tuple(stats) for key, stats in self.stage_stats.items()}
+    
+    def get_stage_stats(self):
+        """Get average and max time per stage, grouped by endpoint"""
+        result = {}
+        for (endpoint, name), (count, total, worst) in self._copy_stage_stats().items():
+            result.setdefault(endpoint, {})[name] = {
+                'count': count,
+                'avg_ms': round(total / count * 1000, 3),
+                'max_ms': round(worst * 1000, 3)
+            }
+        return result
+    
+    def _count_prediction(self, prediction):
+        # Caller holds _prediction_lock
+        self.prediction_count += 1
+        self.prediction_classes[int(prediction)] = self.prediction_classes.get(int(prediction), 0) + 1
+    
+    def _should_log_prediction(self):
+        """Deterministic sampling: log exactly PREDICTION_LOG_SAMPLE_RATE of predictions, evenly spaced"""
+        # Caller holds _prediction_lock
+        n = self.prediction_count
+        if int(n * PREDICTION_LOG_SAMPLE_RATE) != int((n - 1) * PREDICTION_LOG_SAMPLE_RATE):
+            return True
+        self.sampled_out_count += 1
+        return False
+    
     def log_prediction(self, input_data, prediction, confidence=None):
         """Log prediction details"""
-        self.prediction_count += 1
+        with self._prediction_lock:
+            self._count_prediction(prediction)
+            should_log = self._should_log_prediction()
+            prediction_count = self.prediction_count
+        
+        if not should_log:
+            return
         
         log_data = {
             'timestamp': datetime.utcnow().isoformat(),
             'prediction': prediction,
             'confidence': confidence,
-            'input_features': input_data,
-            'prediction_count': self.prediction_count
+            'input_features': dict(input_data),
+            'prediction_count': prediction_count
+        }
+        
+        logger.info("PREDICTION: %s", _LazyJSON(log_data))
+    
+    def log_batch(self, results):
+        """Log a single summary record for a batch of predictions"""
+        churn_count = 0
+        probability_sum = 0.0
+        with self._prediction_lock:
+            for result in results:
+                self._count_prediction(result['churn_prediction'])
+                churn_count += result['churn_prediction']
+                probability_sum += result['churn_probability']
+            prediction_count = self.prediction_count
+        
+        log_data = {
+            'timestamp': datetime.utcnow().isoformat(),
+            'batch_size': len(results),
+            'churn_predictions': churn_count,
+            'avg_churn_probability': round(probability_sum / max(len(results), 1), 4),
+            'prediction_count': prediction_count
         }
         
-        logger.info(f"PREDICTION: {json.dumps(log_data)}")
+        logger.info("PREDICTION_BATCH: %s", _LazyJSON(log_data))
+    
+    def get_logging_stats(self):
+        """Get background logging counters"""
+        return {
+            'enqueued': queue_handler.enqueued,
+            'dropped': queue_handler.dropped,
+            'queue_depth': _log_queue.qsize(),
+            'predictions_sampled_out': self.sampled_out_count,
+            'prediction_sample_rate': PREDICTION_LOG_SAMPLE_RATE
+        }
         
     def get_metrics(self):
         """Get current metrics"""
@@ -67,30 +305,127 @@ class APIMonitor:
             'total_predictions': self.prediction_count,
             'error_count': self.error_count,
             'error_rate': round(self.error_count / max(self.request_count, 1) * 100, 2),
-            'requests_per_minute': round(self.request_count / (uptime / 60), 2) if uptime > 0 else 0
+            'requests_per_minute': round(self.request_count / (uptime / 60), 2) if uptime > 0 else 0,
+            'logging': self.get_logging_stats(),
+            'stages': self.get_stage_stats()
         }
+    
+    def register_stats_source(self, name, source):
+        """Register a callable returning a flat dict of numeric stats (caches, queues, writers)"""
+        self.stats_sources[name] = source
+    
+    def render_prometheus(self, model_version=None):
+        """Render the pre-aggregated metrics in the Prometheus text exposition format"""
+        with self._request_lock:
+            request_counts = dict(self.request_counts)
+            latency_histograms = {endpoint: list(histogram) for endpoint, histogram in self.latency_histograms.items()}
+            latency_sums = dict(self.latency_sums)
+        with self._prediction_lock:
+            prediction_classes = dict(self.prediction_classes)
+        stage_stats = self._copy_stage_stats()
+        
+        lines = [
+            '# HELP churn_api_uptime_seconds Seconds since the monitor started.',
+            '# TYPE churn_api_uptime_seconds gauge',
+            f'churn_api_uptime_seconds {time.time() - self.start_time:.3f}',
+            '# HELP churn_api_requests_total API requests by endpoint, method and status.',
+            '# TYPE churn_api_requests_total counter',
+        ]
+        for (endpoint, method, status_code), count in sorted(request_counts.items(), key=str):
+            lines.append(
+                f'churn_api_requests_total{{endpoint="{_escape_label(endpoint)}",'
+                f'method="{_escape_label(method)}",status="{status_code}"}} {count}'
+            )
+        
+        lines.append('# HELP churn_api_request_duration_seconds API request latency.')
+        lines.append('# TYPE churn_api_request_duration_seconds histogram')
+        for endpoint, histogram in sorted(latency_histograms.items(), key=str):
+            label = _escape_label(endpoint)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, histogram):
+                cumulative += count
+                lines.append(f'churn_api_request_duration_seconds_bucket{{endpoint="{label}",le="{bound}"}} {cumulative}')
+            cumulative += histogram[-1]
+            lines.append(f'churn_api_request_duration_seconds_bucket{{endpoint="{label}",le="+Inf"}} {cumulative}')
+            lines.append(f'churn_api_request_duration_seconds_sum{{endpoint="{label}"}} {latency_sums[endpoint]:.6f}')
+            lines.append(f'churn_api_request_duration_seconds_count{{endpoint="{label}"}} {cumulative}')
+        
+        lines.append('# HELP churn_api_stage_duration_seconds Time spent per request stage.')
+        lines.append('# TYPE churn_api_stage_duration_seconds summary')
+        for (endpoint, name), (count, total, worst) in sorted(stage_stats.items(), key=str):
+            labels = f'endpoint="{_escape_label(endpoint)}",stage="{_escape_label(name)}"'
+            lines.append(f'churn_api_stage_duration_seconds_sum{{{labels}}} {total:.6f}')
+            lines.append(f'churn_api_stage_duration_seconds_count{{{labels}}} {count}')
+        
+        lines.append('# HELP churn_api_predictions_total Predictions served by predicted class.')
+        lines.append('# TYPE churn_api_predictions_total counter')
+        for churn_class, count in sorted(prediction_classes.items()):
+            lines.append(f'churn_api_predictions_total{{churn_prediction="{churn_class}"}} {count}')
+        
+        if model_version is not None:
+            lines.append('# HELP churn_api_model_info Currently loaded model version.')
+            lines.append('# TYPE churn_api_model_info gauge')
+            lines.append(f'churn_api_model_info{{version="{_escape_label(model_version)}"}} 1')
+        
+        for name, source in sorted(dict(self.stats_sources).items()):
+            try:
+                stats = source()
+            except Exception as e:
+                logger.error(f"Stats source {name} failed: {str(e)}")
+                continue
+            for stat, value in sorted(stats.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                metric = f'churn_api_{name}_{stat}'
+                lines.append(f'# TYPE {metric} gauge')
+                lines.append(f'{metric} {value}')
+        
+        return '\n'.join(lines) + '\n'
 
 # Global monitor instance
 monitor = APIMonitor()
+monitor.register_stats_source('log', monitor.get_logging_stats)
+
+# Opt-in traffic capture for replay (TRAFFIC_CAPTURE_FILE)
+recorder = recorder_from_env()
+if recorder is not None:
+    monitor.register_stats_source('capture', recorder.get_stats)
 
 def monitor_requests(f):
     """Decorator to monitor API requests"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
         start_time = time.time()
+        timer = None
+        if STAGE_TIMING_ENABLED:
+            timer = g.stage_timer = StageTimer()
         
         try:
-            response = f(*args, **kwargs)
+            response = profiler.call(f, *args, **kwargs)
+            
+            if timer is not None:
+                response = make_response(response)
+                total = time.time() - start_time
+                response.headers['Server-Timing'] = timer.server_timing_header(total)
+                monitor.log_stages(request.endpoint, timer.stages)
+            
             status_code = getattr(response, 'status_code', 200)
+            response_time = time.time() - start_time
             
             # Log successful request
             monitor.log_request(
                 endpoint=request.endpoint,
                 method=request.method,
                 status_code=status_code,
-                response_time=time.time() - start_time
+                response_time=response_time
             )
             
+            if recorder is not None and request.method == 'POST':
+                recorder.record(
+                    request.method, request.full_path.rstrip('?'), request.get_data(cache=True),
+                    start_time, response_time, status_code
+                )
+            
             return response
             
         except Exception as e:
@@ -102,7 +437,7 @@ def monitor_requests(f):
                 response_time=time.time() - start_time
             )
             
-            logger.error(f"ERROR in {request.endpoint}: {str(e)}")
+            logger.error("ERROR in %s: %s", request.endpoint, e)
             raise
             
     return decorated_function
\ No newline at end of file
@@ -1,12 +1,53 @@
+import gc
 import os
 
 # Gunicorn configuration for production deployment
 bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
 workers = int(os.environ.get('WEB_CONCURRENCY', 2))
-worker_class = "sync"
+# "sync" handles one request per process; "gthread" serves GUNICORN_THREADS
+# requests per process against a single copy of the model
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+threads = int(os.environ.get('GUNICORN_THREADS', 4 if worker_class == 'gthread' else 1))
+# Priority scheduling is per worker and only reorders requests waiting for a
+# scoring slot, so give each worker fewer slots than request threads. With sync
+# workers (one thread) nothing ever waits and the priority classes do nothing.
+os.environ.setdefault('SCHEDULER_SLOTS', str(max(1, threads // 2)))
 worker_connections = 1000
 max_requests = 1000
 max_requests_jitter = 100
 timeout = 30
 keepalive = 2
-preload_app = True
\ No newline at end of file
+preload_app = True
+
+# Copy-on-write friendly preload: the master loads the app and model with the
+# collector off (no freed holes in the pages it shares), then freezes everything
+# it allocated so collections in the workers never write to those pages
+GC_FREEZE = os.environ.get('GC_FREEZE', 'true').lower() == 'true'
+
+if GC_FREEZE:
+    gc.disable()
+
+def when_ready(server):
+    if worker_class == 'sync' and os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true':
+        server.log.warning("Priority scheduling has no effect with sync workers; "
+                           "use GUNICORN_WORKER_CLASS=gthread or app.async_server")
+    # The concurrency limit is per worker too: a sync worker never has more than
+    # one request in flight, so only the X-Request-Start queue wait can shed load
+    if (worker_class == 'sync' and os.environ.get('ADMISSION_CONTROL_ENABLED', 'true').lower() == 'true'
+            and os.environ.get('TRUST_REQUEST_START', 'false').lower() != 'true'):
+        server.log.warning("Admission control never sheds load with sync workers; use "
+                           "GUNICORN_WORKER_CLASS=gthread, app.async_server or TRUST_REQUEST_START=true")
+    if GC_FREEZE:
+        gc.freeze()
+        gc.enable()
+
+def pre_fork(server, worker):
+    if GC_FREEZE:
+        # Also freeze anything the master allocated since the last fork
+        gc.freeze()
+
+def post_worker_init(worker):
+    # Thread pools and caches do not survive fork: warm each worker before it
+    # accepts connections
+    from app.routes import predictor
+    predictor.warmup()
@@ -5,6 +5,11 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///churn_predictions.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Flask-SQLAlchemy/Flask-Migrate are only imported and initialised when enabled
+    SQLALCHEMY_ENABLED = os.environ.get('SQLALCHEMY_ENABLED', 'false').lower() == 'true'
+    
+    # Token required by the /admin endpoints; they are disabled when unset
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
     
     # Production settings
     if os.environ.get('FLASK_ENV') == 'production':
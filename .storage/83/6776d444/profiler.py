@@ -0,0 +1,176 @@
+import cProfile
+import glob
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+# Upper bound on a single profiling session
+MAX_PROFILE_SECONDS = 60
+# Sampling interval bounds (seconds) for the stack sampler
+MIN_SAMPLE_INTERVAL = 0.001
+DEFAULT_SAMPLE_INTERVAL = 0.005
+# Each worker writes its sessions to profile-<pid>.json here, so a GET served by
+# any worker can return them
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+# The app's own background threads idle in queue waits; sampling them only adds noise
+BACKGROUND_THREAD_NAMES = frozenset({'log-listener', 'prediction-writer', 'traffic-recorder', 'worker-profiler'})
+
+class WorkerProfiler:
+    """On-demand profiler for the current worker process.
+    
+    Sessions run in the background so the worker keeps serving traffic while
+    it is being profiled. Their status and result are written to a file per
+    process under `profile_dir`, since the worker that started a session is
+    not necessarily the one asked for its result. Two modes are supported:
+    
+    - 'sample': a daemon thread snapshots every thread's stack at a fixed
+      interval and aggregates them as collapsed stacks (flamegraph input).
+    - 'cprofile': requests passing through `call` are run under cProfile,
+      one at a time, for deterministic call counts.
+    """
+    
+    def __init__(self, profile_dir=PROFILE_DIR):
+        self.profile_dir = profile_dir
+        self._lock = threading.Lock()
+        self._cprofile_lock = threading.Lock()
+        self.session = None
+    
+    def start(self, seconds, mode='sample', interval=DEFAULT_SAMPLE_INTERVAL):
+        """Start a profiling session, returns None if one is already running"""
+        if mode not in ('sample', 'cprofile'):
+            raise ValueError("Mode must be 'sample' or 'cprofile'")
+        seconds = min(max(float(seconds), 0.1), MAX_PROFILE_SECONDS)
+        interval = max(float(interval), MIN_SAMPLE_INTERVAL)
+        
+        with self._lock:
+            if self.session is not None and self.session['status'] == 'running':
+                return None
+            self.session = {
+                'mode': mode,
+                'seconds': seconds,
+                'interval': interval,
+                'started_at': time.time(),
+                'status': 'running',
+                'samples': 0,
+                'profiled_requests': 0,
+                'result': None,
+                'profiler': cProfile.Profile() if mode == 'cprofile' else None
+            }
+            session = self.session
+        
+        self._publish(session)
+        target = self._sample if mode == 'sample' else self._wait
+        threading.Thread(target=target, args=(session,), name='worker-profiler', daemon=True).start()
+        return self.get_status()
+    
+    def get_status(self):
+        """Get the state of the current session (without its result)"""
+        session = self.session
+        if session is None:
+            return {'pid': os.getpid(), 'status': 'idle'}
+        return {
+            'pid': os.getpid(),
+            'mode': session['mode'],
+            'seconds': session['seconds'],
+            'started_at': session['started_at'],
+            'status': session['status'],
+            'samples': session['samples'],
+            'profiled_requests': session['profiled_requests']
+        }
+    
+    def get_result(self):
+        """Get the text output of the last finished session, or None"""
+        session = self.session
+        if session is None or session['status'] != 'finished':
+            return None
+        return session['result']
+    
+    def get_sessions(self):
+        """Last session of every worker that has profiled, newest first (status plus 'result')"""
+        sessions = []
+        for path in glob.glob(os.path.join(self.profile_dir, 'profile-*.json')):
+            try:
+                with open(path) as f:
+                    sessions.append(json.load(f))
+            except (OSError, ValueError):
+                # Being replaced by its worker
+                continue
+        return sorted(sessions, key=lambda session: session['started_at'], reverse=True)
+    
+    def _publish(self, session):
+        """Write the session's status and result to this worker's file"""
+        record = dict(self.get_status(), result=session['result'])
+        path = os.path.join(self.profile_dir, f'profile-{os.getpid()}.json')
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(record, f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"Could not write profile to {path}: {e}", file=sys.stderr)
+    
+    def call(self, f, *args, **kwargs):
+        """Run a request handler, under cProfile when a cprofile session is active"""
+        session = self.session
+        if session is None or session['profiler'] is None or session['status'] != 'running':
+            return f(*args, **kwargs)
+        # cProfile objects are not re-entrant: profile one request at a time and let
+        # concurrent requests run unprofiled rather than wait
+        if not self._cprofile_lock.acquire(blocking=False):
+            return f(*args, **kwargs)
+        try:
+            cprofiler = session['profiler']
+            if cprofiler is None or session['status'] != 'running':
+                return f(*args, **kwargs)
+            session['profiled_requests'] += 1
+            return cprofiler.runcall(f, *args, **kwargs)
+        finally:
+            self._cprofile_lock.release()
+    
+    def _sample(self, session):
+        """Sample the stacks of all threads but the app's background ones until the session ends"""
+        stacks = Counter()
+        deadline = time.monotonic() + session['seconds']
+        
+        while time.monotonic() < deadline:
+            skipped = {thread.ident for thread in threading.enumerate() if thread.name in BACKGROUND_THREAD_NAMES}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in skipped:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stacks[';'.join(reversed(stack))] += 1
+            session['samples'] += 1
+            time.sleep(session['interval'])
+        
+        session['result'] = ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        session['status'] = 'finished'
+        self._publish(session)
+    
+    def _wait(self, session):
+        """End a cprofile session after its duration and render its stats"""
+        time.sleep(session['seconds'])
+        session['status'] = 'stopping'
+        # Wait for an in-flight profiled request to finish before reading the stats
+        with self._cprofile_lock:
+            output = io.StringIO()
+            profiler = session['profiler']
+            if session['profiled_requests']:
+                pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(50)
+            else:
+                output.write("No requests were profiled\n")
+            session['profiler'] = None
+        session['result'] = output.getvalue()
+        session['status'] = 'finished'
+        self._publish(session)
+
+# Global profiler instance
+profiler = WorkerProfiler()
@@ -0,0 +1,192 @@
+"""Inference micro-benchmarks with JSON baselines.
+
+Run from the project root after training the model:
+
+    python benchmarks/bench_inference.py --output benchmarks/baseline.json
+    python benchmarks/bench_inference.py --compare benchmarks/baseline.json --threshold 0.15
+
+Compare mode exits with status 1 when any benchmark's median latency
+regresses by more than the threshold. Warm results also carry the median
+peak of memory allocated during one call (tracemalloc, which includes numpy
+array buffers).
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+from ml_model.model_utils import ChurnPredictor, validate_customer_data
+from ml_model.data_preprocessing import create_sample_data, preprocess_features, build_model_input
+
+BATCH_SIZES = [1, 10, 100, 1000]
+COLD_RUNS = 5
+
+def _customer_records(n):
+    """Get n customer dicts in the /predict payload format"""
+    df = create_sample_data().drop(columns=['churn'])
+    records = df.to_dict('records')
+    return [records[i % len(records)] for i in range(n)]
+
+def _summarize(latencies, batch_size):
+    latencies_ms = np.array(latencies) * 1000
+    mean_ms = float(latencies_ms.mean())
+    return {
+        'runs': len(latencies),
+        'p50_ms': round(float(np.percentile(latencies_ms, 50)), 4),
+        'p95_ms': round(float(np.percentile(latencies_ms, 95)), 4),
+        'p99_ms': round(float(np.percentile(latencies_ms, 99)), 4),
+        'mean_ms': round(mean_ms, 4),
+        'rows_per_second': round(batch_size / (mean_ms / 1000), 1) if mean_ms > 0 else None
+    }
+
+def _time_calls(fn, iterations):
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def _peak_allocation_kb(fn, iterations=20):
+    """Median peak of memory allocated while one call runs, in KB"""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(iterations):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+    finally:
+        tracemalloc.stop()
+    return round(float(np.median(peaks)) / 1024, 1)
+
+def _benchmark_cases(predictor, batch_size):
+    """Benchmarked callables for one batch size: name -> zero-argument function"""
+    records = _customer_records(batch_size)
+    df = create_sample_data().drop(columns=['churn']).head(batch_size)
+    artifacts = predictor.model_artifacts
+    
+    cases = {
+        'predict_batch': lambda: predictor.predict_batch(records),
+        'preprocess_features': lambda: preprocess_features(
+            df, scaler=artifacts['scaler'], encoders=artifacts['encoders'], fit_transform=False
+        ),
+        'build_model_input': lambda: build_model_input(
+            records, artifacts['scaler'], artifacts['encoders'], artifacts['feature_names'],
+            category_codes=artifacts['category_codes']
+        ),
+        'validate_customer_data': lambda: [validate_customer_data(record) for record in records],
+    }
+    if batch_size == 1:
+        cases['predict_single'] = lambda: predictor.predict_single(records[0])
+    return cases
+
+def run_benchmarks(model_path='models/churn_model.pkl', batch_sizes=BATCH_SIZES, warmup=5, iterations=50):
+    """Benchmark the inference functions, returns a results dict keyed by function/batch size/cache"""
+    predictor = ChurnPredictor(model_path)
+    if predictor.model_artifacts is None:
+        raise ValueError("Model not loaded. Please train the model first.")
+    
+    results = {}
+    for batch_size in batch_sizes:
+        # Warm: steady state after warmup calls on a long-lived predictor
+        for name, fn in _benchmark_cases(predictor, batch_size).items():
+            _time_calls(fn, warmup)
+            latencies = _time_calls(fn, max(1, iterations // max(1, batch_size // 100)))
+            stats = _summarize(latencies, batch_size)
+            stats['alloc_peak_kb'] = _peak_allocation_kb(fn)
+            results[f"{name}/batch={batch_size}/warm"] = stats
+        
+        # Cold: first call on a freshly loaded predictor, one per function; load
+        # warmup is off, since it would have made the call warm already
+        cold = {}
+        for _ in range(COLD_RUNS):
+            for name in _benchmark_cases(predictor, batch_size):
+                fresh = ChurnPredictor(model_path, warmup_on_load=False)
+                fn = _benchmark_cases(fresh, batch_size)[name]
+                cold.setdefault(name, []).extend(_time_calls(fn, 1))
+        for name, latencies in cold.items():
+            results[f"{name}/batch={batch_size}/cold"] = _summarize(latencies, batch_size)
+    
+    return {
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'model_version': predictor.get_model_version(),
+        'results': results
+    }
+
+def compare_results(baseline, current, threshold=0.15, metric='p50_ms'):
+    """Compare two benchmark runs, returns a list of regressions beyond the threshold"""
+    regressions = []
+    for key, base in baseline['results'].items():
+        new = current['results'].get(key)
+        if new is None or not base[metric]:
+            continue
+        change = (new[metric] - base[metric]) / base[metric]
+        if change > threshold:
+            regressions.append({
+                'benchmark': key,
+                'baseline_ms': base[metric],
+                'current_ms': new[metric],
+                'change_pct': round(change * 100, 1)
+            })
+    return regressions
+
+def _print_results(results):
+    print(f"{'benchmark':<48}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rows/s':>12}{'peak KB':>10}")
+    for key, stats in results['results'].items():
+        print(f"{key:<48}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}"
+              f"{stats['rows_per_second'] or 0:>12.0f}{stats.get('alloc_peak_kb', ''):>10}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inference micro-benchmarks")
+    parser.add_argument('--model-path', default='models/churn_model.pkl')
+    parser.add_argument('--batch-sizes', default=','.join(str(n) for n in BATCH_SIZES))
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--output', help="Write results to this JSON file (e.g. a new baseline)")
+    parser.add_argument('--compare', help="Baseline JSON file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="Allowed median latency increase before failing (0.15 = 15%%)")
+    args = parser.parse_args(argv)
+    
+    results = run_benchmarks(
+        model_path=args.model_path,
+        batch_sizes=[int(n) for n in args.batch_sizes.split(',')],
+        warmup=args.warmup,
+        iterations=args.iterations
+    )
+    _print_results(results)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output}")
+    
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, results, threshold=args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression['benchmark']}: {regression['baseline_ms']:.3f}ms -> "
+                      f"{regression['current_ms']:.3f}ms (+{regression['change_pct']}%)")
+            return 1
+        print(f"\nNo regressions beyond {args.threshold:.0%} against {args.compare}")
+    
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
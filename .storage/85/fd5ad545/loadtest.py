@@ -0,0 +1,285 @@
+"""HTTP load generator and capacity report for /predict and /batch_predict.
+
+Starts the app under gunicorn with gunicorn_config.py (or targets --url),
+then runs a sweep of load steps and reports throughput, error rate and
+latency percentiles per second of each step, plus the knee point: the
+highest load step that still kept up with the offered load within the
+latency budget.
+
+    # Open loop: fixed arrival rates (requests/second)
+    python benchmarks/loadtest.py --mode open --steps 20,40,80,160 --workers 2
+
+    # Closed loop: fixed numbers of concurrent clients
+    python benchmarks/loadtest.py --mode closed --steps 1,2,4,8,16 --endpoint batch_predict --batch-size 50
+
+Open-loop latency is measured from each request's scheduled send time, so
+queueing on the client side when the server falls behind is included.
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+from ml_model.data_preprocessing import create_sample_data
+from ml_model.model_utils import validate_customer_data
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Request body profiles drawn from create_sample_data
+PROFILES = {
+    'mixed': lambda df: df,
+    'high_risk': lambda df: df[(df['contract_type'] == 'Month-to-month') & (df['online_security'] == 'No')],
+    'low_risk': lambda df: df[df['contract_type'] == 'Two year'],
+}
+
+def build_payloads(endpoint='predict', profile='mixed', batch_size=10, count=200):
+    """Build encoded request bodies for an endpoint from a sample data profile"""
+    df = PROFILES[profile](create_sample_data().drop(columns=['customer_id', 'churn']))
+    # The synthetic data has some out-of-range rows; only send payloads the API accepts
+    records = [record for record in df.to_dict('records') if validate_customer_data(record)[0]]
+    payloads = []
+    for i in range(count):
+        if endpoint == 'predict':
+            body = records[i % len(records)]
+        else:
+            start = (i * batch_size) % len(records)
+            body = [records[(start + j) % len(records)] for j in range(batch_size)]
+        payloads.append(json.dumps(body).encode())
+    return payloads
+
+def find_free_port():
+    """Find a free local port for the server under test"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(workers=2, extra_env=None, startup_timeout=60, project_root=PROJECT_ROOT):
+    """Start the app under gunicorn with gunicorn_config.py and wait until it is ready, returns (process, base_url)"""
+    port = find_free_port()
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers), FLASK_ENV='production')
+    env.update(extra_env or {})
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:create_app()', '--config', 'gunicorn_config.py'],
+        cwd=project_root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    
+    # /health answers before the model is loaded; /readyz only once it is loaded and warmed up
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited during startup with status {process.returncode}")
+        try:
+            if send_request(base_url, 'GET', '/readyz', timeout=1)[0] == 200:
+                return process, base_url
+        except OSError:
+            pass
+        time.sleep(0.2)
+    
+    stop_server(process)
+    raise RuntimeError(f"Server did not become ready within {startup_timeout}s")
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def send_request(base_url, method, path, body=None, headers=None, timeout=30):
+    """Send one HTTP request, returns (status, response body)"""
+    url = urlparse(base_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port, timeout=timeout)
+    try:
+        request_headers = {'Content-Type': 'application/json'}
+        request_headers.update(headers or {})
+        connection.request(method, path, body=body, headers=request_headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+def _timed_request(base_url, path, body, scheduled_at, samples, lock):
+    try:
+        status = send_request(base_url, 'POST', path, body)[0]
+    except OSError:
+        status = None
+    finished_at = time.perf_counter()
+    with lock:
+        samples.append((scheduled_at, finished_at - scheduled_at, status == 200))
+
+def run_open_loop(base_url, path, payloads, rate, duration, max_inflight=512):
+    """Send requests at a fixed arrival rate, returns (start, samples)"""
+    samples, lock = [], threading.Lock()
+    total = int(rate * duration)
+    with ThreadPoolExecutor(max_workers=max_inflight) as executor:
+        start = time.perf_counter()
+        for i in range(total):
+            scheduled_at = start + i / rate
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(_timed_request, base_url, path, payloads[i % len(payloads)], scheduled_at, samples, lock)
+    return start, samples
+
+def run_closed_loop(base_url, path, payloads, concurrency, duration):
+    """Run `concurrency` clients that each send their next request when the last one returns"""
+    samples, lock = [], threading.Lock()
+    start = time.perf_counter()
+    deadline = start + duration
+    
+    def client(offset):
+        i = offset
+        while time.perf_counter() < deadline:
+            _timed_request(base_url, path, payloads[i % len(payloads)], time.perf_counter(), samples, lock)
+            i += concurrency
+    
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return start, samples
+
+def summarize(samples, duration, rows_per_request=1):
+    """Throughput, error rate and latency percentiles for a set of samples"""
+    if not samples:
+        return {'requests': 0, 'throughput_rps': 0.0, 'error_rate': 0.0}
+    latencies_ms = np.array([latency for _, latency, _ in samples]) * 1000
+    errors = sum(1 for _, _, ok in samples if not ok)
+    # A server that falls behind keeps completing requests after the step ends
+    first_sent = min(sent for sent, _, _ in samples)
+    duration = max(duration, max(sent + latency for sent, latency, _ in samples) - first_sent)
+    return {
+        'requests': len(samples),
+        'throughput_rps': round((len(samples) - errors) / duration, 2),
+        'rows_per_second': round((len(samples) - errors) * rows_per_request / duration, 1),
+        'error_rate': round(errors / len(samples), 4),
+        'p50_ms': round(float(np.percentile(latencies_ms, 50)), 2),
+        'p95_ms': round(float(np.percentile(latencies_ms, 95)), 2),
+        'p99_ms': round(float(np.percentile(latencies_ms, 99)), 2),
+    }
+
+def timeline(start, samples, rows_per_request=1):
+    """Per-second summaries, keyed by the second (since step start) the request was sent in"""
+    windows = {}
+    for sample in samples:
+        windows.setdefault(int(sample[0] - start), []).append(sample)
+    return {second: summarize(window, 1.0, rows_per_request) for second, window in sorted(windows.items())}
+
+def find_knee(steps, max_error_rate=0.01, latency_factor=3.0, min_efficiency=0.9):
+    """Highest step that kept up with its load within the error and latency budget.
+    
+    A step is healthy when its error rate is at most max_error_rate and its p99
+    is within latency_factor times the p99 of the lightest step. Open-loop steps
+    must also achieve min_efficiency of the offered rate; closed-loop steps must
+    still increase throughput over the previous step.
+    """
+    if not steps:
+        return None
+    baseline_p99 = steps[0]['summary'].get('p99_ms') or 0
+    knee = None
+    previous_throughput = 0.0
+    for step in steps:
+        summary = step['summary']
+        healthy = (
+            summary['requests'] > 0
+            and summary['error_rate'] <= max_error_rate
+            and summary['p99_ms'] <= baseline_p99 * latency_factor
+        )
+        if step['mode'] == 'open':
+            healthy = healthy and summary['throughput_rps'] >= step['load'] * min_efficiency
+        else:
+            healthy = healthy and summary['throughput_rps'] > previous_throughput
+        if not healthy:
+            break
+        knee = step
+        previous_throughput = summary['throughput_rps']
+    return knee
+
+def run_sweep(base_url, mode, loads, duration, endpoint='predict', profile='mixed', batch_size=10):
+    """Run one step per load level, returns the list of step reports"""
+    path = '/predict' if endpoint == 'predict' else '/batch_predict'
+    rows_per_request = 1 if endpoint == 'predict' else batch_size
+    payloads = build_payloads(endpoint, profile, batch_size)
+    
+    steps = []
+    for load in loads:
+        if mode == 'open':
+            start, samples = run_open_loop(base_url, path, payloads, load, duration)
+        else:
+            start, samples = run_closed_loop(base_url, path, payloads, int(load), duration)
+        step = {
+            'mode': mode,
+            'load': load,
+            'summary': summarize(samples, duration, rows_per_request),
+            'timeline': timeline(start, samples, rows_per_request)
+        }
+        steps.append(step)
+        summary = step['summary']
+        unit = 'req/s offered' if mode == 'open' else 'clients'
+        print(f"{load:>8} {unit}: {summary['throughput_rps']:>8.1f} req/s  "
+              f"errors {summary['error_rate']:.2%}  p50 {summary.get('p50_ms', 0):.1f}ms  "
+              f"p95 {summary.get('p95_ms', 0):.1f}ms  p99 {summary.get('p99_ms', 0):.1f}ms")
+    return steps
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test /predict and /batch_predict")
+    parser.add_argument('--mode', choices=['open', 'closed'], default='open')
+    parser.add_argument('--steps', default='10,20,40,80',
+                        help="Arrival rates (open) or concurrent clients (closed), comma separated")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per step")
+    parser.add_argument('--endpoint', choices=['predict', 'batch_predict'], default='predict')
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='mixed')
+    parser.add_argument('--workers', type=int, default=2, help="WEB_CONCURRENCY for the local server")
+    parser.add_argument('--url', help="Target an already running server instead of starting one")
+    parser.add_argument('--output', help="Write the full report to this JSON file")
+    args = parser.parse_args(argv)
+    
+    process = None
+    base_url = args.url
+    if base_url is None:
+        process, base_url = start_server(args.workers)
+    
+    try:
+        steps = run_sweep(
+            base_url, args.mode, [float(n) for n in args.steps.split(',')], args.duration,
+            endpoint=args.endpoint, profile=args.profile, batch_size=args.batch_size
+        )
+    finally:
+        if process is not None:
+            stop_server(process)
+    
+    knee = find_knee(steps)
+    if knee is None:
+        print("\nNo healthy step: the lightest load already exceeded the error or latency budget")
+    else:
+        print(f"\nKnee point with {args.workers} worker(s): {knee['load']} "
+              f"({knee['summary']['throughput_rps']} req/s, p99 {knee['summary']['p99_ms']}ms)")
+    
+    if args.output:
+        report = {
+            'mode': args.mode,
+            'endpoint': args.endpoint,
+            'workers': args.workers,
+            'steps': steps,
+            'knee': knee['load'] if knee else None
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
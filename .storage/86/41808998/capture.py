@@ -0,0 +1,110 @@
+import os
+import queue
+import struct
+import threading
+import time
+
+# Record header: arrival time (unix seconds), response time (seconds), status code,
+# method length, path length, body length. Followed by method, path and body bytes.
+RECORD_HEADER = struct.Struct('<dfHBHI')
+MAGIC = b'CHURNCAP1\n'
+
+class TrafficRecorder:
+    """Append sampled requests to a compact binary capture file from a background thread.
+    
+    Several gunicorn workers can share one file: the file is opened with O_APPEND
+    and every record is written with a single os.write call. The writer thread is
+    restarted in each forked worker, since threads do not survive fork.
+    """
+    
+    def __init__(self, path, sample_rate=1.0, queue_size=10000):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.seen = 0
+        self.captured = 0
+        self.dropped = 0
+        self.write_errors = 0
+        self._count_lock = threading.Lock()
+        self.queue_size = queue_size
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size == 0:
+            os.write(self._fd, MAGIC)
+        self._start_writer()
+        os.register_at_fork(after_in_child=self._start_writer)
+    
+    def _start_writer(self):
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        threading.Thread(target=self._write_loop, name='traffic-recorder', daemon=True).start()
+    
+    def record(self, method, path, body, arrival_time, response_time, status_code):
+        """Queue one request for capture if it falls in the sample"""
+        with self._count_lock:
+            self.seen += 1
+            n = self.seen
+        if int(n * self.sample_rate) == int((n - 1) * self.sample_rate):
+            return
+        try:
+            self._queue.put_nowait((method, path, body, arrival_time, response_time, status_code))
+        except queue.Full:
+            with self._count_lock:
+                self.dropped += 1
+    
+    def get_stats(self):
+        return {
+            'seen': self.seen,
+            'captured': self.captured,
+            'dropped': self.dropped,
+            'write_errors': self.write_errors,
+            'queue_depth': self._queue.qsize()
+        }
+    
+    def _write_loop(self):
+        while True:
+            method, path, body, arrival_time, response_time, status_code = self._queue.get()
+            method_bytes = method.encode()
+            path_bytes = path.encode()
+            record = RECORD_HEADER.pack(
+                arrival_time, response_time, status_code,
+                len(method_bytes), len(path_bytes), len(body)
+            ) + method_bytes + path_bytes + body
+            try:
+                os.write(self._fd, record)
+                self.captured += 1
+            except OSError:
+                self.write_errors += 1
+
+def read_capture(path):
+    """Iterate over captured requests as dicts, in file order"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a traffic capture file")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            arrival_time, response_time, status_code, method_len, path_len, body_len = RECORD_HEADER.unpack(header)
+            method = f.read(method_len).decode()
+            request_path = f.read(path_len).decode()
+            body = f.read(body_len)
+            if len(body) < body_len:
+                # Truncated trailing record from a worker that was killed mid-write
+                return
+            yield {
+                'arrival_time': arrival_time,
+                'response_time': response_time,
+                'status_code': status_code,
+                'method': method,
+                'path': request_path,
+                'body': body
+            }
+
+def recorder_from_env():
+    """Build the recorder configured by TRAFFIC_CAPTURE_FILE, or None when capture is off"""
+    path = os.environ.get('TRAFFIC_CAPTURE_FILE')
+    if not path:
+        return None
+    return TrafficRecorder(
+        path,
+        sample_rate=float(os.environ.get('TRAFFIC_CAPTURE_SAMPLE_RATE', 1.0)),
+        queue_size=int(os.environ.get('TRAFFIC_CAPTURE_QUEUE_SIZE', 10000))
+    )
@@ -0,0 +1,155 @@
+"""Replay captured traffic against local servers and compare builds.
+
+Capture traffic by starting the app with TRAFFIC_CAPTURE_FILE set (and
+optionally TRAFFIC_CAPTURE_SAMPLE_RATE), then:
+
+    # Replay at 1x against a running server and save the latencies
+    python benchmarks/replay.py capture.bin --url http://127.0.0.1:5000 --output before.json
+
+    # Replay at 4x against two checkouts, each started under gunicorn, and diff them
+    python benchmarks/replay.py capture.bin --speed 4 --builds ../churn-main,../churn-branch
+
+    # Diff two saved replays
+    python benchmarks/replay.py --diff before.json after.json
+
+Inter-arrival times from the capture are preserved (divided by --speed), and
+latency is measured from each request's scheduled send time.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.capture import read_capture
+from loadtest import send_request, start_server, stop_server, summarize
+
+def replay(base_url, records, speed=1.0, max_inflight=512):
+    """Send captured requests with their original spacing, returns per-path summaries"""
+    samples, lock = {}, threading.Lock()
+    status_mismatches = 0
+    
+    def send(record, scheduled_at):
+        nonlocal status_mismatches
+        try:
+            status = send_request(base_url, record['method'], record['path'], record['body'])[0]
+        except OSError:
+            status = None
+        latency = time.perf_counter() - scheduled_at
+        with lock:
+            samples.setdefault(record['path'], []).append((scheduled_at, latency, status == 200))
+            if status != record['status_code']:
+                status_mismatches += 1
+    
+    with ThreadPoolExecutor(max_workers=max_inflight) as executor:
+        start = time.perf_counter()
+        first_arrival = records[0]['arrival_time'] if records else 0
+        for record in records:
+            scheduled_at = start + (record['arrival_time'] - first_arrival) / speed
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, record, scheduled_at)
+    duration = time.perf_counter() - start
+    
+    all_samples = [sample for path_samples in samples.values() for sample in path_samples]
+    return {
+        'speed': speed,
+        'requests': len(records),
+        'status_mismatches': status_mismatches,
+        'overall': summarize(all_samples, duration),
+        'paths': {path: summarize(path_samples, duration) for path, path_samples in sorted(samples.items())}
+    }
+
+def diff_reports(before, after):
+    """Latency differences (after - before) per path for p50/p95/p99"""
+    result = {}
+    for path in ['overall'] + sorted(set(before['paths']) & set(after['paths'])):
+        a = before['overall'] if path == 'overall' else before['paths'][path]
+        b = after['overall'] if path == 'overall' else after['paths'][path]
+        result[path] = {}
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if metric not in a or metric not in b:
+                continue
+            result[path][metric] = {
+                'before': a[metric],
+                'after': b[metric],
+                'change_pct': round((b[metric] - a[metric]) / a[metric] * 100, 1) if a[metric] else None
+            }
+        result[path]['error_rate'] = {'before': a['error_rate'], 'after': b['error_rate']}
+    return result
+
+def _print_report(label, report):
+    overall = report['overall']
+    print(f"{label}: {report['requests']} requests, {overall['throughput_rps']} req/s, "
+          f"errors {overall['error_rate']:.2%}, status mismatches {report['status_mismatches']}")
+    for path, summary in report['paths'].items():
+        print(f"  {path:<24} p50 {summary.get('p50_ms', 0):>8.1f}ms  p95 {summary.get('p95_ms', 0):>8.1f}ms  "
+              f"p99 {summary.get('p99_ms', 0):>8.1f}ms")
+
+def _print_diff(diff):
+    print(f"\n{'path':<24}{'metric':>8}{'before':>12}{'after':>12}{'change':>10}")
+    for path, metrics in diff.items():
+        for metric, values in metrics.items():
+            if metric == 'error_rate':
+                continue
+            change = f"{values['change_pct']:+.1f}%" if values['change_pct'] is not None else 'n/a'
+            print(f"{path:<24}{metric:>8}{values['before']:>12.2f}{values['after']:>12.2f}{change:>10}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured traffic")
+    parser.add_argument('capture', nargs='?', help="Capture file written with TRAFFIC_CAPTURE_FILE")
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay speed multiplier (2 = twice as fast)")
+    parser.add_argument('--limit', type=int, help="Only replay the first N captured requests")
+    parser.add_argument('--url', help="Replay against an already running server")
+    parser.add_argument('--builds', help="Comma separated project directories to start and compare (two)")
+    parser.add_argument('--workers', type=int, default=2, help="WEB_CONCURRENCY for started servers")
+    parser.add_argument('--output', help="Write the replay report(s) to this JSON file")
+    parser.add_argument('--diff', nargs=2, metavar=('BEFORE', 'AFTER'), help="Diff two saved replay reports")
+    args = parser.parse_args(argv)
+    
+    if args.diff:
+        with open(args.diff[0]) as f:
+            before = json.load(f)
+        with open(args.diff[1]) as f:
+            after = json.load(f)
+        _print_diff(diff_reports(before, after))
+        return
+    
+    if not args.capture:
+        parser.error("a capture file is required unless --diff is used")
+    records = list(read_capture(args.capture))[:args.limit]
+    print(f"Loaded {len(records)} captured requests from {args.capture}")
+    
+    if args.url:
+        report = replay(args.url, records, args.speed)
+        _print_report(args.url, report)
+        reports = report
+    else:
+        builds = args.builds.split(',') if args.builds else [os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))]
+        reports = []
+        for build in builds:
+            process, base_url = start_server(args.workers, project_root=os.path.abspath(build))
+            try:
+                report = replay(base_url, records, args.speed)
+            finally:
+                stop_server(process)
+            _print_report(build, report)
+            reports.append(dict(report, build=build))
+        if len(reports) == 2:
+            _print_diff(diff_reports(reports[0], reports[1]))
+        if len(reports) == 1:
+            reports = reports[0]
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import math
+import threading
+from bisect import bisect_right
+
+# Population stability index thresholds for the per-feature status
+PSI_WARNING = 0.1
+PSI_ALERT = 0.25
+# Floor for empty bins so PSI stays finite
+PSI_EPSILON = 1e-4
+
+def population_stability_index(expected, actual):
+    """PSI between two aligned lists of proportions"""
+    psi = 0.0
+    for e, a in zip(expected, actual):
+        e = max(e, PSI_EPSILON)
+        a = max(a, PSI_EPSILON)
+        psi += (a - e) * math.log(a / e)
+    return psi
+
+def binned_ks(expected, actual):
+    """Kolmogorov-Smirnov statistic evaluated at the reference bin edges"""
+    ks = 0.0
+    expected_cdf = actual_cdf = 0.0
+    for e, a in zip(expected, actual):
+        expected_cdf += e
+        actual_cdf += a
+        ks = max(ks, abs(expected_cdf - actual_cdf))
+    return ks
+
+class _NumericAccumulator:
+    """Running mean/variance (Welford) and counts over the reference bins"""
+    __slots__ = ('edges', 'counts', 'n', 'mean', 'm2')
+    
+    def __init__(self, edges):
+        self.edges = edges
+        self.counts = [0] * (len(edges) + 1)
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+    
+    def add(self, value):
+        self.counts[bisect_right(self.edges, value)] += 1
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+    
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / self.n) if self.n else 0.0
+
+class DriftMonitor:
+    """Streaming per-feature statistics of served inputs, compared against the
+    reference histograms stored in the model artifact by train_churn_model."""
+    
+    def __init__(self, reference_profile=None):
+        self._lock = threading.Lock()
+        self.set_reference(reference_profile)
+    
+    def set_reference(self, reference_profile):
+        """Switch to a new reference profile (e.g. after retraining) and reset the live state"""
+        numeric, categorical = {}, {}
+        if reference_profile is not None:
+            for feature, reference in reference_profile['numerical'].items():
+                numeric[feature] = _NumericAccumulator(reference['edges'])
+            for feature in reference_profile['categorical']:
+                categorical[feature] = {}
+        with self._lock:
+            self.reference = reference_profile
+            self.numeric = numeric
+            self.categorical = categorical
+    
+    def _add(self, customer):
+        # Caller holds _lock
+        for feature, accumulator in self.numeric.items():
+            accumulator.add(float(customer[feature]))
+        for feature, counts in self.categorical.items():
+            value = customer[feature]
+            counts[value] = counts.get(value, 0) + 1
+    
+    def update(self, customer):
+        """Fold one validated customer record into the running statistics"""
+        with self._lock:
+            self._add(customer)
+    
+    def update_batch(self, customers):
+        with self._lock:
+            for customer in customers:
+                self._add(customer)
+    
+    def _status(self, psi):
+        if psi >= PSI_ALERT:
+            return 'alert'
+        if psi >= PSI_WARNING:
+            return 'warning'
+        return 'ok'
+    
+    def get_report(self):
+        """PSI/KS per feature against the reference, computed from the in-memory state"""
+        with self._lock:
+            return self._build_report()
+    
+    def _build_report(self):
+        if self.reference is None:
+            return {"error": "Loaded model has no reference profile. Retrain to enable drift detection."}
+        
+        features = {}
+        for feature, accumulator in self.numeric.items():
+            reference = self.reference['numerical'][feature]
+            entry = {'count': accumulator.n, 'reference_mean': reference['mean'], 'reference_std': reference['std']}
+            if accumulator.n:
+                actual = [count / accumulator.n for count in accumulator.counts]
+                psi = population_stability_index(reference['proportions'], actual)
+                entry.update({
+                    'mean': accumulator.mean,
+                    'std': accumulator.std,
+                    'psi': round(psi, 4),
+                    'ks': round(binned_ks(reference['proportions'], actual), 4),
+                    'status': self._status(psi)
+                })
+            features[feature] = entry
+        
+        for feature, counts in self.categorical.items():
+            reference = self.reference['categorical'][feature]
+            total = sum(counts.values())
+            entry = {'count': total}
+            if total:
+                categories = sorted(set(reference) | set(counts))
+                expected = [reference.get(category, 0.0) for category in categories]
+                actual = [counts.get(category, 0) / total for category in categories]
+                psi = population_stability_index(expected, actual)
+                entry.update({
+                    'distribution': {category: round(counts.get(category, 0) / total, 4) for category in categories},
+                    'psi': round(psi, 4),
+                    'status': self._status(psi)
+                })
+            features[feature] = entry
+        
+        statuses = [entry['status'] for entry in features.values() if 'status' in entry]
+        overall = 'alert' if 'alert' in statuses else 'warning' if 'warning' in statuses else 'ok'
+        return {
+            'status': overall if statuses else 'no_data',
+            'reference_samples': self.reference.get('samples'),
+            'features': features
+        }
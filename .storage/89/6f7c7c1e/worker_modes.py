@@ -0,0 +1,119 @@
+"""Compare sync and gthread gunicorn workers by throughput per GB of memory.
+
+Each configuration starts the app under gunicorn_config.py, drives /predict
+with a closed loop of concurrent clients, then reads the proportional set
+size (PSS) of the master and its workers from /proc, so pages shared through
+preload_app are only counted once.
+
+    python benchmarks/worker_modes.py --configs sync:4,gthread:1x4,gthread:2x4 --clients 16
+
+Configurations are `sync:<workers>` or `gthread:<workers>x<threads>`.
+Memory readings need Linux /proc.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from loadtest import build_payloads, run_closed_loop, start_server, stop_server, summarize
+
+def parse_config(spec):
+    """Parse `sync:4` or `gthread:2x4` into (worker_class, workers, threads)"""
+    worker_class, _, size = spec.partition(':')
+    if worker_class not in ('sync', 'gthread'):
+        raise ValueError(f"Unknown worker class: {worker_class}")
+    workers, _, threads = size.partition('x')
+    return worker_class, int(workers or 1), int(threads or 1)
+
+def _children(pid):
+    children = []
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+def _memory_kb(pid, field):
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def process_tree_memory(pid):
+    """PSS and RSS in MB summed over a process and all its descendants"""
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        pending.extend(_children(current))
+    return {
+        'processes': len(pids),
+        'pss_mb': round(sum(_memory_kb(p, 'Pss') for p in pids) / 1024, 1),
+        'rss_mb': round(sum(_memory_kb(p, 'Rss') for p in pids) / 1024, 1),
+    }
+
+def run_config(spec, clients, duration, payloads):
+    """Benchmark one worker configuration, returns its report"""
+    worker_class, workers, threads = parse_config(spec)
+    process, base_url = start_server(workers, extra_env={
+        'GUNICORN_WORKER_CLASS': worker_class,
+        'GUNICORN_THREADS': str(threads),
+    })
+    try:
+        # Warm every worker before measuring
+        run_closed_loop(base_url, '/predict', payloads, clients, min(duration, 2.0))
+        _, samples = run_closed_loop(base_url, '/predict', payloads, clients, duration)
+        # Read memory after the load so lazily allocated state is included
+        time.sleep(0.5)
+        memory = process_tree_memory(process.pid)
+    finally:
+        stop_server(process)
+    
+    summary = summarize(samples, duration)
+    gb = memory['pss_mb'] / 1024
+    return {
+        'config': spec,
+        'worker_class': worker_class,
+        'workers': workers,
+        'threads': threads,
+        'summary': summary,
+        'memory': memory,
+        'rps_per_gb': round(summary['throughput_rps'] / gb, 1) if gb else None,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare sync and gthread workers by throughput per GB")
+    parser.add_argument('--configs', default='sync:4,gthread:1x4,gthread:2x4',
+                        help="Comma separated sync:<workers> or gthread:<workers>x<threads>")
+    parser.add_argument('--clients', type=int, default=16, help="Concurrent closed-loop clients")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per configuration")
+    parser.add_argument('--output', help="Write the full report to this JSON file")
+    args = parser.parse_args(argv)
+    
+    payloads = build_payloads('predict')
+    reports = []
+    print(f"{'config':<14} {'req/s':>8} {'p99 ms':>8} {'PSS MB':>8} {'RSS MB':>8} {'req/s/GB':>9}")
+    for spec in args.configs.split(','):
+        report = run_config(spec.strip(), args.clients, args.duration, payloads)
+        reports.append(report)
+        summary, memory = report['summary'], report['memory']
+        print(f"{report['config']:<14} {summary['throughput_rps']:>8.1f} {summary.get('p99_ms', 0):>8.1f} "
+              f"{memory['pss_mb']:>8.1f} {memory['rss_mb']:>8.1f} {report['rps_per_gb'] or 0:>9.1f}")
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'clients': args.clients, 'duration': args.duration, 'configs': reports}, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,68 @@
 import os
 import pickle
+import sys
+import time
+import numpy as np
 import pandas as pd
+from datetime import datetime
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
-from data_preprocessing import prepare_training_data, create_sample_data
+from sklearn.utils.class_weight import compute_class_weight
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from ml_model.data_preprocessing import (
+    prepare_training_data, create_sample_data, preprocess_features, training_reference_profile,
+    to_model_input, model_input_for, CATEGORICAL_FEATURES, NUMERICAL_FEATURES, MODEL_INPUT_FORMAT
+)
 
-def train_churn_model():
-    """Train customer churn prediction model"""
-    print("Preparing training data...")
-    X_train, X_test, y_train, y_test, scaler, encoders = prepare_training_data()
-    
-    print("Training Random Forest model...")
-    model = RandomForestClassifier(
+# Trees added per incremental run, and the forest size kept by retiring the
+# oldest trees (0 keeps every tree)
+INCREMENTAL_TREES = int(os.environ.get('INCREMENTAL_TREES', 20))
+INCREMENTAL_MAX_TREES = int(os.environ.get('INCREMENTAL_MAX_TREES', 0))
+FOREST_RANDOM_STATE = 42
+
+def _new_forest():
+    return RandomForestClassifier(
         n_estimators=100,
         max_depth=10,
-        random_state=42,
+        random_state=FOREST_RANDOM_STATE,
         class_weight='balanced'
     )
+
+def _balanced_class_weight(y):
+    """The weights class_weight='balanced' gives the labels y, as an explicit {class: weight}"""
+    classes = np.unique(y)
+    return {int(c): float(w) for c, w in zip(classes, compute_class_weight('balanced', classes=classes, y=y))}
+
+def _trees_grown(artifacts):
+    """Trees grown over the model's history, counting those retired since"""
+    grown = 0
+    for record in artifacts.get('training_history', []):
+        grown = record['trees'] if record['mode'] == 'full' else grown + record['added_trees']
+    return grown or len(artifacts['model'].estimators_)
+
+def _save_artifacts(model_artifacts, model_path):
+    # Write then rename, so a worker reloading never reads a partial file
+    os.makedirs(os.path.dirname(model_path) or '.', exist_ok=True)
+    tmp_path = model_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(model_artifacts, f)
+    os.replace(tmp_path, model_path)
+
+def train_churn_model(source=None):
+    """Train customer churn prediction model on a labeled CSV, by default the synthetic sample data"""
+    print("Preparing training data...")
+    X_train, X_test, y_train, y_test, scaler, encoders = prepare_training_data(source)
+    
+    print("Training Random Forest model...")
+    model = _new_forest()
     
-    model.fit(X_train, y_train)
+    # Fit on the float32 matrix serving will pass, so the model expects no feature names
+    start = time.perf_counter()
+    model.fit(to_model_input(X_train), y_train)
+    training_seconds = time.perf_counter() - start
     
     # Evaluate model
-    y_pred = model.predict(X_test)
+    y_pred = model.predict(to_model_input(X_test))
     accuracy = accuracy_score(y_test, y_pred)
     
     print(f"Model Accuracy: {accuracy:.4f}")
@@ -37,21 +78,164 @@ def train_churn_model():
         'scaler': scaler,
         'encoders': encoders,
         'feature_names': X_train.columns.tolist(),
-        'accuracy': accuracy
+        # Layout of the feature matrix the model takes, in feature_names order
+        'input_format': dict(MODEL_INPUT_FORMAT),
+        'accuracy': accuracy,
+        # The 'balanced' weights of the full training set, reused when trees are added
+        'class_weight': _balanced_class_weight(y_train),
+        'model_version': datetime.utcnow().strftime('v%Y%m%d%H%M%S'),
+        # Raw feature distributions of the training data, for drift detection
+        'reference_profile': training_reference_profile(source),
+        'training_history': [{
+            'mode': 'full',
+            # None: the synthetic sample data
+            'source': source,
+            'trees': len(model.estimators_),
+            'samples': len(X_train),
+            'seconds': round(training_seconds, 3),
+            'accuracy': accuracy
+        }]
     }
     
-    with open('models/churn_model.pkl', 'wb') as f:
-        pickle.dump(model_artifacts, f)
+    _save_artifacts(model_artifacts, 'models/churn_model.pkl')
     
     print("Model saved to models/churn_model.pkl")
     
-    # Save sample data for reference
-    os.makedirs('data', exist_ok=True)
-    sample_df = create_sample_data()
-    sample_df.to_csv('data/sample_data.csv', index=False)
-    print("Sample data saved to data/sample_data.csv")
+    # Save sample data for reference (it is seeded, so one copy is enough)
+    if source is None and not os.path.exists('data/sample_data.csv'):
+        os.makedirs('data', exist_ok=True)
+        create_sample_data().to_csv('data/sample_data.csv', index=False)
+        print("Sample data saved to data/sample_data.csv")
     
     return model_artifacts
 
+def _full_retrain_baseline(X_train, y_train, X_test, y_test):
+    """Time and accuracy of rebuilding the forest from scratch on the history plus the new rows"""
+    history = create_sample_data()
+    X_all = pd.concat([history[NUMERICAL_FEATURES + CATEGORICAL_FEATURES], X_train], ignore_index=True)
+    y_all = pd.concat([history['churn'], y_train], ignore_index=True)
+    
+    start = time.perf_counter()
+    X_processed, scaler, encoders = preprocess_features(X_all, fit_transform=True)
+    model = _new_forest()
+    model.fit(to_model_input(X_processed), y_all)
+    seconds = time.perf_counter() - start
+    
+    X_test_processed = to_model_input(
+        preprocess_features(X_test, scaler=scaler, encoders=encoders, fit_transform=False)
+    )
+    return {
+        'trees': len(model.estimators_),
+        'samples': len(X_all),
+        'seconds': round(seconds, 3),
+        'holdout_accuracy': accuracy_score(y_test, model.predict(X_test_processed))
+    }
+
+def train_incremental(new_data, model_path='models/churn_model.pkl', n_new_trees=INCREMENTAL_TREES,
+                      max_trees=INCREMENTAL_MAX_TREES, compare=False):
+    """Grow extra trees on newly labeled data with warm_start, keeping the fitted scaler and encoders.
+    
+    `new_data` is a DataFrame (or list of records) with the model features and
+    a `churn` label. A stratified 20% of it is held out to measure accuracy
+    before and after. With `max_trees`, the oldest trees are retired so the
+    forest keeps that size. With `compare`, a full retrain on the history plus
+    the new rows is timed and scored on the same holdout (and not saved).
+    """
+    from sklearn.model_selection import train_test_split
+    
+    if n_new_trees < 1:
+        raise ValueError("n_new_trees must be at least 1")
+    if max_trees < 0:
+        raise ValueError("max_trees must be 0 (keep every tree) or positive")
+    
+    with open(model_path, 'rb') as f:
+        artifacts = pickle.load(f)
+    model, scaler, encoders = artifacts['model'], artifacts['scaler'], artifacts['encoders']
+    
+    new_data = pd.DataFrame(new_data)
+    X = new_data[NUMERICAL_FEATURES + CATEGORICAL_FEATURES]
+    y = new_data['churn'].astype(int)
+    if set(y.unique()) != set(model.classes_):
+        raise ValueError(f"New data must contain every class {list(model.classes_)}")
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+    feature_names = artifacts['feature_names']
+    X_train_processed = to_model_input(
+        preprocess_features(X_train, scaler=scaler, encoders=encoders, fit_transform=False)[feature_names]
+    )
+    X_test_processed = to_model_input(
+        preprocess_features(X_test, scaler=scaler, encoders=encoders, fit_transform=False)[feature_names]
+    )
+    accuracy_before = accuracy_score(y_test, model.predict(model_input_for(model, X_test_processed)))
+    
+    # New trees keep the class weights of the full training ('balanced' would
+    # reweigh by this batch alone). Models saved before the weights were
+    # recorded fall back to this batch's balanced weights.
+    class_weight = artifacts.get('class_weight') or _balanced_class_weight(y_train)
+    # warm_start seeds new trees by their position in the forest, which repeats
+    # once trees are retired; a seed counting every tree ever grown does not
+    random_state = FOREST_RANDOM_STATE + _trees_grown(artifacts)
+    
+    # Fitting on a matrix also moves models fitted on DataFrames to the float32 input format
+    start = time.perf_counter()
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + n_new_trees,
+                     class_weight=class_weight, random_state=random_state)
+    model.fit(X_train_processed, y_train)
+    retired = 0
+    if max_trees and len(model.estimators_) > max_trees:
+        retired = len(model.estimators_) - max_trees
+        model.estimators_ = model.estimators_[retired:]
+    model.set_params(warm_start=False, n_estimators=len(model.estimators_))
+    training_seconds = time.perf_counter() - start
+    accuracy = accuracy_score(y_test, model.predict(X_test_processed))
+    
+    record = {
+        'mode': 'incremental',
+        'trees': len(model.estimators_),
+        'added_trees': n_new_trees,
+        'retired_trees': retired,
+        'samples': len(X_train),
+        'random_state': random_state,
+        'seconds': round(training_seconds, 3),
+        'holdout_accuracy_before': accuracy_before,
+        'holdout_accuracy': accuracy
+    }
+    if compare:
+        record['full_retrain'] = _full_retrain_baseline(X_train, y_train, X_test, y_test)
+    
+    # `accuracy` stays the test-split figure from the full training; the holdout
+    # of one new batch is not comparable with it and lives in the history record
+    artifacts.update(
+        model=model,
+        input_format=dict(MODEL_INPUT_FORMAT),
+        model_version=datetime.utcnow().strftime('v%Y%m%d%H%M%S'),
+        training_history=artifacts.get('training_history', []) + [record]
+    )
+    _save_artifacts(artifacts, model_path)
+    
+    print(f"Grew {n_new_trees} trees on {len(X_train)} new rows in {record['seconds']}s "
+          f"({retired} retired, {record['trees']} total). "
+          f"Holdout accuracy {accuracy_before:.4f} -> {accuracy:.4f}")
+    if compare:
+        full = record['full_retrain']
+        print(f"Full retrain on {full['samples']} rows: {full['seconds']}s, holdout accuracy {full['holdout_accuracy']:.4f}")
+    return artifacts
+
 if __name__ == "__main__":
-    train_churn_model()
\ No newline at end of file
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Train the churn model")
+    parser.add_argument('--data', metavar='CSV',
+                        help="Labeled training file for a full training (default: synthetic sample data)")
+    parser.add_argument('--incremental', metavar='CSV',
+                        help="Grow trees on this labeled file instead of training from scratch")
+    parser.add_argument('--trees', type=int, default=INCREMENTAL_TREES, help="Trees to add in incremental mode")
+    parser.add_argument('--max-trees', type=int, default=INCREMENTAL_MAX_TREES,
+                        help="Retire the oldest trees beyond this many (0 keeps all)")
+    parser.add_argument('--compare', action='store_true', help="Also time a full retrain for comparison")
+    args = parser.parse_args()
+    
+    if args.incremental:
+        train_incremental(pd.read_csv(args.incremental), n_new_trees=args.trees,
+                          max_trees=args.max_trees, compare=args.compare)
+    else:
+        train_churn_model(args.data)
\ No newline at end of file
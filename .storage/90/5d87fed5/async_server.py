@@ -0,0 +1,364 @@
+"""Asyncio HTTP/1.1 server for the Flask app.
+
+Connections, keep-alive, header/body reading and response writing are handled
+on one event loop, so slow or idle clients cost a coroutine rather than a
+worker. Once a request is fully read, the existing blueprint runs unchanged in
+a thread pool: scoring, live risk rescoring and retraining on a scoring pool
+bounded by the core count, everything else (feedback writes, admin, metrics)
+on a separate I/O pool so it never takes a scoring slot. Prediction logging and DB writes
+are already queued to background threads by the monitor and PredictionWriter.
+
+    python -m app.async_server
+"""
+import asyncio
+import io
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from urllib.parse import unquote_to_bytes
+from app.scheduling import SchedulerRejected
+
+ASYNC_SCORING_THREADS = int(os.environ.get('ASYNC_SCORING_THREADS', os.cpu_count() or 1))
+ASYNC_IO_THREADS = int(os.environ.get('ASYNC_IO_THREADS', 16))
+KEEPALIVE_TIMEOUT = float(os.environ.get('KEEPALIVE_TIMEOUT', 75))
+REQUEST_READ_TIMEOUT = float(os.environ.get('REQUEST_READ_TIMEOUT', 30))
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = int(os.environ.get('MAX_BODY_BYTES', 10 * 1024 * 1024))
+GRACEFUL_TIMEOUT = 30
+
+# Paths whose handlers are CPU bound and share the bounded scoring pool;
+# /customers/<id>/risk rescores stale or unknown customers live
+SCORING_PATHS = ('/predict', '/batch_predict', '/retrain')
+
+def is_scoring_path(path):
+    return path in SCORING_PATHS or (path.startswith('/customers/') and path.endswith('/risk'))
+
+class _BadRequest(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+class AsyncServer:
+    """Serve a WSGI app from an asyncio event loop with bounded executors"""
+    
+    def __init__(self, wsgi_app, scoring_threads=ASYNC_SCORING_THREADS, io_threads=ASYNC_IO_THREADS,
+                 admission=None, scheduler=None, route_priorities=None):
+        self.wsgi_app = wsgi_app
+        # Path -> AdmissionController, consulted before a request queues for a thread
+        self.admission = admission or {}
+        # PriorityScheduler and path -> priority class; slots are taken on the loop,
+        # so waiting requests never hold a thread
+        self.scheduler = scheduler
+        self.route_priorities = route_priorities or {}
+        self.scoring_threads = scoring_threads
+        self.scoring_executor = ThreadPoolExecutor(max_workers=scoring_threads, thread_name_prefix='scoring')
+        self.io_executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='io')
+        self.connections_open = 0
+        self.connections_total = 0
+        self.requests_total = 0
+        self.requests_active = 0
+        self.rejected = 0
+        self._idle = set()
+        self._closing = False
+        self._server = None
+    
+    def get_stats(self):
+        return {
+            'connections_open': self.connections_open,
+            'connections_total': self.connections_total,
+            'requests_total': self.requests_total,
+            'requests_active': self.requests_active,
+            'rejected': self.rejected,
+            'scoring_threads': self.scoring_threads
+        }
+    
+    async def start(self, host='0.0.0.0', port=5000):
+        """Start listening, returns the asyncio server"""
+        self._server = await asyncio.start_server(self._handle_connection, host, port, limit=MAX_HEADER_BYTES)
+        return self._server
+    
+    async def shutdown(self):
+        """Stop accepting, close idle keep-alive connections and let in-flight requests finish"""
+        self._closing = True
+        if self._server is not None:
+            self._server.close()
+        for writer in list(self._idle):
+            writer.close()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + GRACEFUL_TIMEOUT
+        while self.connections_open and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        self.scoring_executor.shutdown(wait=False)
+        self.io_executor.shutdown(wait=False)
+    
+    async def _handle_connection(self, reader, writer):
+        self.connections_open += 1
+        self.connections_total += 1
+        peer = writer.get_extra_info('peername') or ('', 0)
+        try:
+            while not self._closing:
+                self._idle.add(writer)
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._write_error(writer, '431 Request Header Fields Too Large')
+                    break
+                finally:
+                    self._idle.discard(writer)
+                arrival_time = time.time()
+                
+                try:
+                    method, target, version, headers = self._parse_head(head)
+                    body = await asyncio.wait_for(self._read_body(reader, headers), REQUEST_READ_TIMEOUT)
+                except _BadRequest as e:
+                    self.rejected += 1
+                    await self._write_error(writer, e.status)
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                
+                keep_alive = self._keep_alive(version, headers)
+                environ = self._build_environ(method, target, version, headers, body, peer, writer)
+                # Lets admission control count time spent waiting for a scoring thread
+                environ['churn.arrival_time'] = arrival_time
+                path = environ['PATH_INFO']
+                executor = self.scoring_executor if is_scoring_path(path) else self.io_executor
+                
+                controller = self.admission.get(path)
+                if controller is not None:
+                    if not controller.try_acquire():
+                        body, extra_headers = controller.rejection()
+                        keep_alive = keep_alive and not self._closing
+                        response_headers = [('Content-Type', 'application/json')] + list(extra_headers.items())
+                        writer.write(self._serialize('503 Service Unavailable', response_headers,
+                                                     json.dumps(body).encode(), keep_alive))
+                        await writer.drain()
+                        if not keep_alive:
+                            break
+                        continue
+                    environ['churn.admitted'] = True
+                
+                priority = self.route_priorities.get(path) if self.scheduler is not None else None
+                if priority is not None:
+                    try:
+                        await self.scheduler.acquire_async(priority)
+                    except asyncio.CancelledError:
+                        if controller is not None:
+                            controller.release()
+                        raise
+                    except SchedulerRejected as e:
+                        if controller is not None:
+                            controller.release()
+                        keep_alive = keep_alive and not self._closing
+                        writer.write(self._serialize(
+                            '503 Service Unavailable', [('Content-Type', 'application/json'), ('Retry-After', '1')],
+                            json.dumps({"error": f"Server is busy: {e}"}).encode(), keep_alive
+                        ))
+                        await writer.drain()
+                        if not keep_alive:
+                            break
+                        continue
+                    environ['churn.scheduled'] = True
+                
+                self.requests_total += 1
+                self.requests_active += 1
+                status = None
+                try:
+                    status, response_headers, response_body = await asyncio.get_running_loop().run_in_executor(
+                        executor, self._call_app, environ
+                    )
+                except Exception as e:
+                    print(f"Unhandled error serving {method} {path}: {e}", file=sys.stderr)
+                    status, response_headers, response_body = '500 Internal Server Error', [], b''
+                    keep_alive = False
+                finally:
+                    self.requests_active -= 1
+                    if priority is not None:
+                        self.scheduler.release(priority)
+                    # Also runs when the wait is cancelled (CancelledError), so the slot is never leaked
+                    if controller is not None:
+                        if status is None:
+                            controller.release()
+                        else:
+                            controller.complete(int(status[:3]), time.time() - arrival_time)
+                
+                keep_alive = keep_alive and not self._closing
+                writer.write(self._serialize(status, response_headers, response_body, keep_alive, method == 'HEAD'))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self._idle.discard(writer)
+            self.connections_open -= 1
+            writer.close()
+    
+    def _parse_head(self, head):
+        lines = head[:-4].decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise _BadRequest('400 Bad Request')
+        if not version.startswith('HTTP/1.'):
+            raise _BadRequest('505 HTTP Version Not Supported')
+        headers = []
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise _BadRequest('400 Bad Request')
+            headers.append((name.strip().lower(), value.strip()))
+        return method, target, version, headers
+    
+    async def _read_body(self, reader, headers):
+        header_map = dict(headers)
+        if 'chunked' in header_map.get('transfer-encoding', '').lower():
+            chunks, size = [], 0
+            while True:
+                try:
+                    chunk_size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                except ValueError:
+                    raise _BadRequest('400 Bad Request')
+                if chunk_size == 0:
+                    # Skip any trailers up to the blank line
+                    while await reader.readuntil(b'\r\n') != b'\r\n':
+                        pass
+                    return b''.join(chunks)
+                size += chunk_size
+                if size > MAX_BODY_BYTES:
+                    raise _BadRequest('413 Payload Too Large')
+                chunks.append(await reader.readexactly(chunk_size))
+                await reader.readexactly(2)
+        
+        try:
+            length = int(header_map.get('content-length', 0))
+        except ValueError:
+            raise _BadRequest('400 Bad Request')
+        if length > MAX_BODY_BYTES:
+            raise _BadRequest('413 Payload Too Large')
+        return await reader.readexactly(length) if length else b''
+    
+    def _keep_alive(self, version, headers):
+        connection = dict(headers).get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+    
+    def _build_environ(self, method, target, version, headers, body, peer, writer):
+        path, _, query = target.partition('?')
+        sockname = writer.get_extra_info('sockname') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': str(sockname[0]),
+            'SERVER_PORT': str(sockname[1]),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': str(peer[0]),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers:
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+            elif name not in ('content-length', 'transfer-encoding'):
+                key = 'HTTP_' + name.upper().replace('-', '_')
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+    
+    def _call_app(self, environ):
+        """Run the WSGI app to completion in an executor thread"""
+        response = {}
+        chunks = []
+        
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+            return chunks.append
+        
+        result = self.wsgi_app(environ, start_response)
+        try:
+            chunks.extend(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], b''.join(chunks)
+    
+    def _serialize(self, status, headers, body, keep_alive, head_only=False):
+        lines = [f"HTTP/1.1 {status}"]
+        has_length = False
+        for name, value in headers:
+            if name.lower() == 'content-length':
+                has_length = True
+            elif name.lower() == 'connection':
+                continue
+            lines.append(f"{name}: {value}")
+        if not has_length:
+            lines.append(f"Content-Length: {len(body)}")
+        lines.append(f"Date: {formatdate(usegmt=True)}")
+        lines.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        return head if head_only else head + body
+    
+    async def _write_error(self, writer, status):
+        try:
+            writer.write(self._serialize(status, [('Content-Type', 'text/plain')], status.encode(), False))
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+def run(wsgi_app, host='0.0.0.0', port=5000, admission=None, scheduler=None, route_priorities=None):
+    """Serve until SIGINT/SIGTERM"""
+    async def serve():
+        server = AsyncServer(wsgi_app, admission=admission, scheduler=scheduler, route_priorities=route_priorities)
+        try:
+            from app.monitoring import monitor
+            monitor.register_stats_source('async_server', server.get_stats)
+        except ImportError:
+            pass
+        
+        await server.start(host, port)
+        print(f"Async server listening on {host}:{port} "
+              f"({server.scoring_threads} scoring threads, {ASYNC_IO_THREADS} I/O threads)")
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+        await server.shutdown()
+    
+    asyncio.run(serve())
+
+def main():
+    from app import create_app
+    from config import DevelopmentConfig, ProductionConfig
+    
+    config_class = ProductionConfig if os.environ.get('FLASK_ENV') == 'production' else DevelopmentConfig
+    app = create_app(config_class)
+    
+    from app.admission import ADMISSION_CONTROL_ENABLED
+    from app.scheduling import ROUTE_PRIORITIES, SCHEDULER_ENABLED
+    from app.routes import admission, scheduler
+    controllers = {'/' + name: controller for name, controller in admission.items()} if ADMISSION_CONTROL_ENABLED else None
+    run(
+        app, port=int(os.environ.get('PORT', 5000)), admission=controllers,
+        scheduler=scheduler if SCHEDULER_ENABLED else None, route_priorities=ROUTE_PRIORITIES
+    )
+
+if __name__ == '__main__':
+    main()
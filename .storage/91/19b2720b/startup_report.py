@@ -0,0 +1,119 @@
+"""Time and RSS cost of each phase of worker startup.
+
+Every run uses a fresh interpreter and goes through the phases in the order
+the gunicorn master meets them under preload_app. For each phase it records
+the wall time and the growth in resident memory. The final phases show the
+gc.freeze step and how much the deferred Flask-SQLAlchemy/Flask-Migrate
+imports would have cost.
+
+    python benchmarks/startup_report.py --repeat 5 --output startup.json
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# (phase name, statement), executed cumulatively in one interpreter
+PHASES = [
+    ('flask', 'import flask'),
+    ('numpy + pandas', 'import numpy, pandas'),
+    ('sklearn', 'import sklearn.ensemble, sklearn.preprocessing'),
+    ('app.monitoring', 'import app.monitoring'),
+    ('app.routes', 'import app.routes'),
+    ('create_app + model load', 'from app import create_app; create_app()'),
+    ('gc.freeze', 'import gc; gc.collect(); gc.freeze()'),
+    ('deferred: flask_sqlalchemy + flask_migrate', 'import flask_sqlalchemy, flask_migrate'),
+]
+
+def current_rss_mb():
+    """Resident set size of this process in MB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is a high-water mark, close enough while memory only grows
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_phases():
+    """Run every phase in this interpreter, returns one measurement per phase"""
+    sys.path.insert(0, PROJECT_ROOT)
+    os.chdir(PROJECT_ROOT)
+    results = []
+    for name, statement in PHASES:
+        rss_before = current_rss_mb()
+        start = time.perf_counter()
+        try:
+            exec(statement, {})
+            error = None
+        except ImportError as e:
+            error = str(e)
+        results.append({
+            'phase': name,
+            'ms': (time.perf_counter() - start) * 1000,
+            'rss_delta_mb': current_rss_mb() - rss_before,
+            'rss_mb': current_rss_mb(),
+            'error': error
+        })
+    results.append({'phase': 'frozen objects', 'count': gc.get_freeze_count()})
+    return results
+
+def measure(repeat):
+    """Run the phases in `repeat` fresh interpreters, returns the median of each phase"""
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child'],
+            cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    report = []
+    for i, (name, _) in enumerate(PHASES):
+        samples = [run[i] for run in runs]
+        report.append({
+            'phase': name,
+            'ms': round(statistics.median(s['ms'] for s in samples), 1),
+            'rss_delta_mb': round(statistics.median(s['rss_delta_mb'] for s in samples), 1),
+            'rss_mb': round(statistics.median(s['rss_mb'] for s in samples), 1),
+            'error': samples[0]['error']
+        })
+    return report, runs[0][-1]['count']
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report the time and RSS cost of each startup phase")
+    parser.add_argument('--repeat', type=int, default=3, help="Fresh interpreters to take the median over")
+    parser.add_argument('--output', help="Write the report to this JSON file")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        # Keep the app's own prints off the JSON line
+        sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+        results = run_phases()
+        print(json.dumps(results), file=stdout)
+        return
+
+    report, frozen = measure(args.repeat)
+    print(f"{'phase':<44} {'ms':>8} {'+RSS MB':>8} {'RSS MB':>8}")
+    for phase in report:
+        note = f"  ({phase['error']})" if phase['error'] else ''
+        print(f"{phase['phase']:<44} {phase['ms']:>8.1f} {phase['rss_delta_mb']:>8.1f} {phase['rss_mb']:>8.1f}{note}")
+    print(f"\nObjects frozen before fork: {frozen}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'repeat': args.repeat, 'phases': report, 'frozen_objects': frozen}, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+from flask import jsonify, request
+from ml_model.model_utils import Deadline
+
+ADMISSION_CONTROL_ENABLED = os.environ.get('ADMISSION_CONTROL_ENABLED', 'true').lower() == 'true'
+ADMISSION_INITIAL_LIMIT = float(os.environ.get('ADMISSION_INITIAL_LIMIT', 20))
+ADMISSION_MIN_LIMIT = float(os.environ.get('ADMISSION_MIN_LIMIT', 1))
+ADMISSION_MAX_LIMIT = float(os.environ.get('ADMISSION_MAX_LIMIT', 200))
+# Smoothed latency above tolerance x the no-load latency is treated as queueing
+ADMISSION_LATENCY_TOLERANCE = float(os.environ.get('ADMISSION_LATENCY_TOLERANCE', 2.0))
+# The no-load latency is this low percentile of the recent latencies, so one
+# unusually fast request does not become the baseline
+ADMISSION_BASELINE_PERCENTILE = float(os.environ.get('ADMISSION_BASELINE_PERCENTILE', 10))
+ADMISSION_BACKOFF = float(os.environ.get('ADMISSION_BACKOFF', 0.9))
+# Requests that already waited this long upstream (X-Request-Start) are shed unserved
+ADMISSION_MAX_QUEUE_WAIT = float(os.environ.get('ADMISSION_MAX_QUEUE_WAIT', 5.0))
+# Clients can send any X-Request-Start, so it is only read when a trusted proxy
+# in front of the app sets (and overwrites) it
+TRUST_REQUEST_START = os.environ.get('TRUST_REQUEST_START', 'false').lower() == 'true'
+# Longer X-Request-Deadline-Ms budgets are cut to this many seconds
+MAX_REQUEST_DEADLINE = float(os.environ.get('MAX_REQUEST_DEADLINE', 300))
+# Recent latencies kept for the no-load estimate, and how often it is recomputed
+LATENCY_SAMPLES = 500
+BASELINE_REFRESH = 25
+# Weight of each new latency in the smoothed latency compared against the baseline
+LATENCY_SMOOTHING = 0.1
+
+def request_arrival_time(environ, now=None):
+    """When the request reached the first server that saw it (seconds since the epoch).
+    
+    Uses the async server's own arrival stamp, then (with TRUST_REQUEST_START)
+    a proxy's X-Request-Start header (`t=<seconds|ms|us>`), else `now`.
+    """
+    now = time.time() if now is None else now
+    arrival = environ.get('churn.arrival_time')
+    if arrival is not None:
+        return arrival
+    header = environ.get('HTTP_X_REQUEST_START') if TRUST_REQUEST_START else None
+    if header:
+        try:
+            value = float(header.split('=', 1)[-1])
+        except ValueError:
+            return now
+        # Proxies send seconds, milliseconds or microseconds
+        if value > 1e14:
+            value /= 1e6
+        elif value > 1e11:
+            value /= 1e3
+        if 0 < now - value < 3600:
+            return value
+    return now
+
+def request_deadline(environ, now=None):
+    """Deadline from the X-Request-Deadline-Ms budget, counted from arrival.
+    
+    None without the header or when the budget is not a finite, non-negative
+    number; budgets beyond MAX_REQUEST_DEADLINE are capped.
+    """
+    value = environ.get('HTTP_X_REQUEST_DEADLINE_MS')
+    if not value:
+        return None
+    try:
+        budget = float(value) / 1000
+    except ValueError:
+        return None
+    if not math.isfinite(budget) or budget < 0:
+        return None
+    budget = min(budget, MAX_REQUEST_DEADLINE)
+    now = time.time() if now is None else now
+    return Deadline(budget - (now - request_arrival_time(environ, now)))
+
+def _percentile(values, percentile):
+    """Nearest-rank percentile of a non-empty collection"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+class DeadlineCounters:
+    """Counts of work abandoned because the client's deadline had passed"""
+    
+    def __init__(self):
+        self.expired = {}
+        self.rows_skipped = 0
+        self.partial_responses = 0
+        self._lock = threading.Lock()
+    
+    def record(self, endpoint, phase, rows_skipped=0, partial=False):
+        with self._lock:
+            key = f'{endpoint}_{phase}'
+            self.expired[key] = self.expired.get(key, 0) + 1
+            self.rows_skipped += rows_skipped
+            if partial:
+                self.partial_responses += 1
+    
+    def get_stats(self):
+        with self._lock:
+            stats = {f'expired_{key}': count for key, count in self.expired.items()}
+            stats['rows_skipped'] = self.rows_skipped
+            stats['partial_responses'] = self.partial_responses
+            return stats
+
+class AdmissionController:
+    """Adaptive concurrency limit for one route (AIMD on latency).
+    
+    The limit grows by about one per `limit` successful requests while the
+    smoothed (EWMA) latency stays within ADMISSION_LATENCY_TOLERANCE of the
+    no-load latency, and is multiplied by ADMISSION_BACKOFF (at most once per
+    no-load latency) when it does not or a request fails. The no-load latency
+    is a low percentile of the last LATENCY_SAMPLES latencies, so ordinary
+    variance between requests does not read as queueing, and it follows the
+    model if it gets slower. Requests over the limit are rejected immediately
+    rather than queued, so the ones admitted keep their latency.
+    """
+    
+    def __init__(self, name, initial_limit=ADMISSION_INITIAL_LIMIT, min_limit=ADMISSION_MIN_LIMIT,
+                 max_limit=ADMISSION_MAX_LIMIT, tolerance=ADMISSION_LATENCY_TOLERANCE,
+                 backoff=ADMISSION_BACKOFF, max_queue_wait=ADMISSION_MAX_QUEUE_WAIT):
+        self.name = name
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.max_queue_wait = max_queue_wait
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.shed_queued = 0
+        self.no_load_latency = None
+        self.smoothed_latency = None
+        self.last_latency = None
+        self._samples = deque(maxlen=LATENCY_SAMPLES)
+        self._since_refresh = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+    
+    def try_acquire(self, queue_wait=0.0):
+        """Admit a request unless the limit is reached or it already queued too long"""
+        with self._lock:
+            if queue_wait > self.max_queue_wait:
+                self.shed_queued += 1
+                return False
+            if self.in_flight >= int(self.limit):
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+    
+    def release(self, latency=None, ok=True):
+        """Finish an admitted request and adapt the limit to its latency (including upstream queueing).
+        
+        Pass latency=None for requests that say nothing about capacity, such as
+        validation errors, which would drag the no-load estimate down.
+        """
+        now = time.monotonic()
+        with self._lock:
+            in_flight = self.in_flight
+            self.in_flight -= 1
+            if latency is None:
+                return
+            self.last_latency = latency
+            
+            self._samples.append(latency)
+            self._since_refresh += 1
+            if self.no_load_latency is None or self._since_refresh >= BASELINE_REFRESH:
+                self.no_load_latency = _percentile(self._samples, ADMISSION_BASELINE_PERCENTILE)
+                self._since_refresh = 0
+            if self.smoothed_latency is None:
+                self.smoothed_latency = latency
+            else:
+                self.smoothed_latency += LATENCY_SMOOTHING * (latency - self.smoothed_latency)
+            
+            if not ok or self.smoothed_latency > self.no_load_latency * self.tolerance:
+                if now - self._last_decrease >= self.no_load_latency:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+            elif in_flight * 2 >= self.limit:
+                # Only grow when the limit is actually being used
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+    
+    def complete(self, status_code, latency):
+        """Release after a response.
+        
+        Client errors are cheap, and a 504 means the client's own deadline ran
+        out (often a budget of zero), so neither carries a capacity signal.
+        """
+        if 400 <= status_code < 500 or status_code == 504:
+            self.release()
+        else:
+            self.release(latency, ok=status_code < 500)
+    
+    def rejection(self):
+        """JSON body and headers of a load-shedding 503"""
+        retry_after = self.retry_after()
+        body = {"error": "Server is overloaded, retry later", "retry_after": retry_after}
+        return body, {'Retry-After': str(retry_after)}
+    
+    def retry_after(self):
+        """Seconds a rejected client should wait before retrying"""
+        latency = self.last_latency or self.no_load_latency or 0
+        return max(1, math.ceil(latency * 2))
+    
+    def get_stats(self):
+        return {
+            'limit': round(self.limit, 2),
+            'in_flight': self.in_flight,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'shed_queued': self.shed_queued,
+            'no_load_latency_ms': round((self.no_load_latency or 0) * 1000, 2),
+            'smoothed_latency_ms': round((self.smoothed_latency or 0) * 1000, 2),
+            'last_latency_ms': round((self.last_latency or 0) * 1000, 2)
+        }
+
+def admission_control(controller):
+    """Decorator rejecting requests with 503 and Retry-After when the controller is at its limit"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # The async server admits scoring requests before they queue for a thread
+            if not ADMISSION_CONTROL_ENABLED or request.environ.get('churn.admitted'):
+                return f(*args, **kwargs)
+            
+            now = time.time()
+            arrival = request_arrival_time(request.environ, now)
+            if not controller.try_acquire(queue_wait=now - arrival):
+                body, headers = controller.rejection()
+                return jsonify(body), 503, headers
+            
+            # The limit adapts to latency seen by this process only, never to a
+            # header value, so one request cannot collapse it for everybody
+            local_arrival = request.environ.get('churn.arrival_time', now)
+            
+            status_code = 500
+            try:
+                response = f(*args, **kwargs)
+                status_code = response[1] if isinstance(response, tuple) else getattr(response, 'status_code', 200)
+                return response
+            finally:
+                controller.complete(status_code, time.time() - local_arrival)
+        
+        return decorated_function
+    return decorator
@@ -0,0 +1,220 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+from flask import jsonify, request
+
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+# Requests that may score at once in this process, shared by all classes. The
+# scheduler is per process, so classes only compete when more requests are in
+# flight than there are slots: under app.async_server (whose default of one slot
+# per core matches ASYNC_SCORING_THREADS), or under gthread workers, where
+# gunicorn_config.py defaults the slots to half of GUNICORN_THREADS. A sync
+# worker serves one request at a time and priorities have no effect there.
+SCHEDULER_SLOTS = int(os.environ.get('SCHEDULER_SLOTS', os.cpu_count() or 1))
+# Longest a request waits for a slot before it is rejected with 503
+SCHEDULER_QUEUE_TIMEOUT = float(os.environ.get('SCHEDULER_QUEUE_TIMEOUT', 10.0))
+
+# weight: share of freed slots while several classes are waiting
+# max_running: cap on the slots one class may hold (None = all of them)
+# max_queue: waiting requests beyond this are rejected immediately
+PRIORITY_CLASSES = {
+    'interactive': {'weight': 8, 'max_running': None, 'max_queue': 256},
+    'bulk': {'weight': 2, 'max_running': max(1, SCHEDULER_SLOTS // 2), 'max_queue': 32},
+    'maintenance': {'weight': 1, 'max_running': 1, 'max_queue': 2},
+}
+
+ROUTE_PRIORITIES = {
+    '/predict': 'interactive',
+    '/batch_predict': 'bulk',
+    '/retrain': 'maintenance',
+}
+
+class SchedulerRejected(Exception):
+    """Raised when a class's queue is full or a request waited past the queue timeout"""
+
+class _Ticket:
+    __slots__ = ('priority', 'enqueued_at', 'granted', 'wake')
+    
+    def __init__(self, priority, wake):
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.wake = wake
+
+class _PriorityClass:
+    def __init__(self, name, weight, max_running, max_queue):
+        self.name = name
+        self.weight = weight
+        self.max_running = max_running
+        self.max_queue = max_queue
+        self.queue = deque()
+        self.running = 0
+        # Stride scheduling: a class's pass advances by 1/weight per granted slot
+        self.pass_value = 0.0
+        self.served = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+class PriorityScheduler:
+    """Weighted scheduling of request slots between priority classes.
+    
+    A fixed number of slots is shared by all classes. When a slot frees, the
+    waiting class with the lowest stride pass gets it, so over time classes
+    are served in proportion to their weights. Each class also has its own
+    concurrency cap and bounded queue: bulk work can never hold every slot,
+    and a single prediction only ever waits behind at most one class's turn.
+    
+    Threads wait with `slot()`; the async server waits with `acquire_async()`.
+    """
+    
+    def __init__(self, slots=SCHEDULER_SLOTS, classes=None, queue_timeout=SCHEDULER_QUEUE_TIMEOUT):
+        self.slots = slots
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.classes = {}
+        for name, spec in (classes or PRIORITY_CLASSES).items():
+            max_running = min(spec['max_running'] or slots, slots)
+            self.classes[name] = _PriorityClass(name, spec['weight'], max_running, spec['max_queue'])
+        self._lock = threading.Lock()
+    
+    def _enqueue(self, priority, wake):
+        # Caller holds _lock
+        cls = self.classes[priority]
+        if len(cls.queue) >= cls.max_queue:
+            cls.rejected += 1
+            raise SchedulerRejected(f"{priority} queue is full")
+        if not cls.queue and not cls.running:
+            # A class returning from idle does not get credit for the time it was away
+            active = [c.pass_value for c in self.classes.values() if c.queue or c.running]
+            cls.pass_value = max(cls.pass_value, min(active, default=0.0))
+        ticket = _Ticket(priority, wake)
+        cls.queue.append(ticket)
+        self._dispatch()
+        return ticket
+    
+    def _dispatch(self):
+        # Caller holds _lock
+        while self.running < self.slots:
+            ready = [c for c in self.classes.values() if c.queue and c.running < c.max_running]
+            if not ready:
+                return
+            cls = min(ready, key=lambda c: c.pass_value)
+            ticket = cls.queue.popleft()
+            cls.pass_value += 1.0 / cls.weight
+            cls.running += 1
+            self.running += 1
+            wait = time.monotonic() - ticket.enqueued_at
+            cls.served += 1
+            cls.wait_total += wait
+            cls.wait_max = max(cls.wait_max, wait)
+            ticket.granted = True
+            ticket.wake()
+    
+    def _abandon(self, ticket):
+        # Caller holds _lock; drop a ticket whose waiter gave up
+        cls = self.classes[ticket.priority]
+        if ticket.granted:
+            self._release(ticket.priority)
+        else:
+            cls.queue.remove(ticket)
+            cls.timed_out += 1
+    
+    def _release(self, priority):
+        # Caller holds _lock
+        self.classes[priority].running -= 1
+        self.running -= 1
+        self._dispatch()
+    
+    def acquire(self, priority, timeout=None):
+        """Block until a slot is granted to `priority`; raises SchedulerRejected"""
+        event = threading.Event()
+        with self._lock:
+            ticket = self._enqueue(priority, event.set)
+        if event.wait(self.queue_timeout if timeout is None else timeout):
+            return
+        with self._lock:
+            if ticket.granted:
+                return
+            self._abandon(ticket)
+        raise SchedulerRejected(f"timed out waiting for a {priority} slot")
+    
+    async def acquire_async(self, priority, timeout=None):
+        """Wait on the event loop until a slot is granted to `priority`"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+        
+        with self._lock:
+            ticket = self._enqueue(priority, wake)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout if timeout is None else timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                if ticket.granted and isinstance(e, asyncio.TimeoutError):
+                    return
+                self._abandon(ticket)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise SchedulerRejected(f"timed out waiting for a {priority} slot")
+    
+    def release(self, priority):
+        with self._lock:
+            self._release(priority)
+    
+    def slot(self, priority):
+        """Context manager holding a slot of `priority` for the duration of the block"""
+        return _Slot(self, priority)
+    
+    def get_stats(self):
+        """Per-class running, queue depth and wait times"""
+        with self._lock:
+            return {
+                name: {
+                    'running': cls.running,
+                    'max_running': cls.max_running,
+                    'queue_depth': len(cls.queue),
+                    'served': cls.served,
+                    'rejected': cls.rejected,
+                    'timed_out': cls.timed_out,
+                    'avg_wait_ms': round(cls.wait_total / cls.served * 1000, 2) if cls.served else 0.0,
+                    'max_wait_ms': round(cls.wait_max * 1000, 2)
+                }
+                for name, cls in self.classes.items()
+            }
+
+class _Slot:
+    def __init__(self, scheduler, priority):
+        self.scheduler = scheduler
+        self.priority = priority
+    
+    def __enter__(self):
+        self.scheduler.acquire(self.priority)
+        return self
+    
+    def __exit__(self, *exc):
+        self.scheduler.release(self.priority)
+        return False
+
+def prioritized(scheduler, priority):
+    """Decorator running a view inside a scheduler slot of the given priority class"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # The async server acquires the slot before handing the request to a thread
+            if not SCHEDULER_ENABLED or request.environ.get('churn.scheduled'):
+                return f(*args, **kwargs)
+            try:
+                with scheduler.slot(priority):
+                    return f(*args, **kwargs)
+            except SchedulerRejected as e:
+                return jsonify({"error": f"Server is busy: {e}"}), 503, {'Retry-After': '1'}
+        
+        return decorated_function
+    return decorator
@@ -0,0 +1,197 @@
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+from flask import jsonify, make_response, request
+
+# Off by default: once enabled, clients over their route's rate get 429s
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'false').lower() == 'true'
+# One SQLite file shared by every worker on the host; the state is disposable
+RATE_LIMIT_DB = os.environ.get('RATE_LIMIT_DB', 'ratelimit.db')
+# Buckets idle this long are deleted (they would be full again anyway)
+BUCKET_IDLE_SECONDS = 3600
+CLEANUP_EVERY = 10000
+
+# route -> (tokens per second, burst capacity)
+DEFAULT_RATE_LIMITS = {
+    'predict': (50.0, 100.0),
+    'batch_predict': (5.0, 10.0),
+    'feedback': (5.0, 10.0),
+    'customer_risk': (50.0, 100.0),
+}
+
+def parse_rate_limits(spec, defaults=DEFAULT_RATE_LIMITS):
+    """Parse RATE_LIMITS, e.g. "predict=20:40,batch_predict=2:5" (rate per second:burst)"""
+    limits = dict(defaults)
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        route, _, value = item.partition('=')
+        rate, _, burst = value.partition(':')
+        limits[route.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+RATE_LIMITS = parse_rate_limits(os.environ.get('RATE_LIMITS'))
+
+def _hash_key(api_key):
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+# Only these X-API-Key values (comma-separated) get a bucket of their own; any
+# other key could be changed on every request to dodge the limit
+RATE_LIMIT_API_KEYS = frozenset(
+    _hash_key(key.strip()) for key in os.environ.get('RATE_LIMIT_API_KEYS', '').split(',') if key.strip()
+)
+# Number of proxies in front of the app that append to X-Forwarded-For (like
+# ProxyFix's x_for). With 0 the client is the socket's peer address, which
+# behind a load balancer is the balancer itself.
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', 0))
+
+def client_address(environ, trusted_proxies=None):
+    """The caller's IP: the entry the outermost trusted proxy added to X-Forwarded-For, else REMOTE_ADDR"""
+    trusted_proxies = RATE_LIMIT_TRUSTED_PROXIES if trusted_proxies is None else trusted_proxies
+    if trusted_proxies > 0:
+        forwarded = [part.strip() for part in environ.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+        # Entries left of the ones our proxies appended are client-controlled
+        if len(forwarded) >= trusted_proxies:
+            return forwarded[-trusted_proxies]
+    return environ.get('REMOTE_ADDR', 'unknown')
+
+def client_key(environ, api_keys=None, trusted_proxies=None):
+    """Identify the caller by a configured API key (hashed, never stored raw), else by IP address"""
+    api_keys = RATE_LIMIT_API_KEYS if api_keys is None else api_keys
+    api_key = environ.get('HTTP_X_API_KEY')
+    if api_key:
+        hashed = _hash_key(api_key)
+        if hashed in api_keys:
+            return 'key:' + hashed[:16]
+    return 'ip:' + client_address(environ, trusted_proxies)
+
+class TokenBucketLimiter:
+    """Token buckets per (route, client) kept in a SQLite file shared by all workers.
+    
+    A check is one short IMMEDIATE transaction: read the bucket row by primary
+    key, refill it for the elapsed time, take a token if there is one and
+    write it back. Each thread of each process uses its own connection. On
+    database errors the request is allowed (fail open) and counted.
+    """
+    
+    def __init__(self, db_path=RATE_LIMIT_DB, limits=None):
+        self.db_path = db_path
+        self.limits = dict(RATE_LIMITS if limits is None else limits)
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+        self.checks = 0
+        self._count_lock = threading.Lock()
+        self._local = threading.local()
+        
+        conn = sqlite3.connect(db_path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS rate_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        conn.commit()
+        conn.close()
+    
+    def _connection(self):
+        # Connections must not cross fork: reconnect when the pid changes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=1.0, isolation_level=None)
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    def check(self, route, client, cost=1.0, now=None):
+        """Take `cost` tokens from the client's bucket for `route`.
+        
+        Returns (allowed, limit, remaining, reset_seconds, retry_after_seconds),
+        or None when the route is not rate limited.
+        """
+        if route not in self.limits:
+            return None
+        rate, burst = self.limits[route]
+        now = time.time() if now is None else now
+        key = f'{route}:{client}'
+        
+        try:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT tokens, updated FROM rate_buckets WHERE key = ?', (key,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                conn.execute('INSERT OR REPLACE INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                             (key, tokens, now))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error:
+            with self._count_lock:
+                self.errors += 1
+            return True, burst, burst, 0, 0
+        
+        with self._count_lock:
+            self.checks += 1
+            if allowed:
+                self.allowed += 1
+            else:
+                self.limited += 1
+            cleanup = self.checks % CLEANUP_EVERY == 0
+        if cleanup:
+            self._cleanup(now)
+        
+        reset = math.ceil((burst - tokens) / rate) if rate > 0 else 0
+        retry_after = 0 if allowed else math.ceil((cost - tokens) / rate) if rate > 0 else 0
+        return allowed, burst, int(tokens), reset, retry_after
+    
+    def _cleanup(self, now):
+        try:
+            self._connection().execute('DELETE FROM rate_buckets WHERE updated < ?', (now - BUCKET_IDLE_SECONDS,))
+        except sqlite3.Error:
+            pass
+    
+    def get_stats(self):
+        return {
+            'allowed': self.allowed,
+            'limited': self.limited,
+            'errors': self.errors
+        }
+
+def rate_limited(limiter, route):
+    """Decorator enforcing the route's token bucket per client, with RateLimit-* headers"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not RATE_LIMIT_ENABLED:
+                return f(*args, **kwargs)
+            
+            result = limiter.check(route, client_key(request.environ))
+            if result is None:
+                return f(*args, **kwargs)
+            allowed, limit, remaining, reset, retry_after = result
+            headers = {
+                'RateLimit-Limit': str(int(limit)),
+                'RateLimit-Remaining': str(remaining),
+                'RateLimit-Reset': str(reset)
+            }
+            
+            if not allowed:
+                headers['Retry-After'] = str(retry_after)
+                return jsonify({"error": "Rate limit exceeded", "retry_after": retry_after}), 429, headers
+            
+            response = make_response(f(*args, **kwargs))
+            response.headers.update(headers)
+            return response
+        
+        return decorated_function
+    return decorator
@@ -0,0 +1,366 @@
+"""Score a customer file into the precomputed risk table served by GET /customers/<id>/risk.
+
+Meant to run nightly after (re)training:
+
+    python ml_model/batch_scoring.py data/customers.csv --db risk_scores.db
+    python ml_model/batch_scoring.py data/customers.csv --incremental --delta changes.csv
+
+The file needs a customer_id column plus the model's input features. It is
+read in chunks and each row's feature fingerprint is compared with the one
+stored by the last run. A full run rescores everything into a fresh table
+that replaces the previous one in a single transaction. An incremental run
+rescores only customers whose fingerprint or model version changed. Readers
+never see a half-written table either way.
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from ml_model.data_preprocessing import CATEGORICAL_FEATURES, NUMERICAL_FEATURES
+
+RISK_TABLE_DB = os.environ.get('RISK_TABLE_DB', 'risk_scores.db')
+# Rows older than this are rescored live even when the model has not changed
+RISK_TABLE_MAX_AGE = float(os.environ.get('RISK_TABLE_MAX_AGE', 36 * 3600))
+# Hot entries kept in memory per worker, and for how long before re-reading the table
+RISK_CACHE_SIZE = int(os.environ.get('RISK_CACHE_SIZE', 100000))
+RISK_CACHE_TTL = float(os.environ.get('RISK_CACHE_TTL', 300))
+SCORING_CHUNK_SIZE = 10000
+# SQLite limits the number of host parameters per statement
+_SQLITE_CHUNK = 500
+
+_FEATURES = NUMERICAL_FEATURES + CATEGORICAL_FEATURES
+
+def _create_table(conn, name):
+    conn.execute(f'''
+        CREATE TABLE {name} (
+            customer_id TEXT PRIMARY KEY,
+            features TEXT NOT NULL,
+            fingerprint TEXT,
+            churn_prediction INTEGER NOT NULL,
+            churn_probability REAL NOT NULL,
+            model_version TEXT NOT NULL,
+            scored_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+def _confirm_snapshot(conn, confirmed_at):
+    """Record when the table last matched a full customer snapshot.
+    
+    After every run the table holds exactly the customers of that run's
+    snapshot, so one timestamp confirms all rows without rewriting them.
+    """
+    conn.execute('CREATE TABLE IF NOT EXISTS risk_table_meta (key TEXT PRIMARY KEY, value REAL NOT NULL)')
+    conn.execute("INSERT OR REPLACE INTO risk_table_meta (key, value) VALUES ('confirmed_at', ?)", (confirmed_at,))
+
+def _table_columns(conn, name):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({name})')]
+
+def _read_customers(input_path, chunk_size):
+    """Stream (valid records, invalid row count) per chunk of a customer file"""
+    import pandas as pd
+    from ml_model.model_utils import validate_customer_data
+    
+    for chunk in pd.read_csv(input_path, chunksize=chunk_size):
+        if 'customer_id' not in chunk.columns:
+            raise ValueError(f"{input_path} has no customer_id column")
+        records = chunk[['customer_id'] + _FEATURES].to_dict('records')
+        valid = [record for record in records if validate_customer_data(record)[0]]
+        for record in valid:
+            record['customer_id'] = str(record['customer_id'])
+        yield valid, len(records) - len(valid)
+
+def _previous_scores(conn, customer_ids):
+    """customer_id -> (fingerprint, model_version, probability) from the current table"""
+    previous = {}
+    for i in range(0, len(customer_ids), _SQLITE_CHUNK):
+        chunk = customer_ids[i:i + _SQLITE_CHUNK]
+        for customer_id, fingerprint, model_version, probability in conn.execute(f'''
+            SELECT customer_id, fingerprint, model_version, churn_probability FROM risk_scores
+            WHERE customer_id IN ({','.join('?' * len(chunk))})
+        ''', chunk):
+            previous[customer_id] = (fingerprint, model_version, probability)
+    return previous
+
+def score_customers(input_path, db_path=RISK_TABLE_DB, model_path='models/churn_model.pkl',
+                    chunk_size=SCORING_CHUNK_SIZE, incremental=False, delta_path=None):
+    """Score a CSV file into the risk table, returns a summary.
+    
+    Every row is compared with the current table by feature fingerprint and
+    model version. A full run rescores every row into a new table that is
+    swapped in at the end. An incremental run rescores only new rows and rows
+    whose fingerprint or model version changed, and updates the table in
+    place in one transaction; after a model change that is every row.
+    Customers missing from the file are removed either way. With
+    `delta_path`, the changed, new and removed customers are written to a CSV.
+    """
+    import pandas as pd
+    from ml_model.model_utils import ChurnPredictor, feature_fingerprint
+    
+    predictor = ChurnPredictor(model_path)
+    if predictor.model_artifacts is None:
+        raise ValueError("Model not loaded. Please train the model first.")
+    model_version = predictor.get_model_version()
+    scored_at = time.time()
+    start = time.perf_counter()
+    counts = {'scored': 0, 'unchanged': 0, 'new': 0, 'features': 0, 'model': 0, 'removed': 0, 'skipped': 0}
+    
+    conn = sqlite3.connect(db_path, timeout=30)
+    delta_file = open(delta_path, 'w', newline='') if delta_path else None
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        has_previous = 'fingerprint' in _table_columns(conn, 'risk_scores')
+        if incremental and not has_previous:
+            # Nothing to compare against (first run, or a table from before fingerprints)
+            incremental = False
+        delta = csv.writer(delta_file) if delta_file else None
+        if delta:
+            delta.writerow(['customer_id', 'change', 'churn_prediction', 'churn_probability', 'previous_probability'])
+        
+        if incremental:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('CREATE TEMP TABLE seen (customer_id TEXT PRIMARY KEY)')
+            target = 'risk_scores'
+        else:
+            conn.execute('DROP TABLE IF EXISTS risk_scores_building')
+            _create_table(conn, 'risk_scores_building')
+            target = 'risk_scores_building'
+        
+        for records, skipped in _read_customers(input_path, chunk_size):
+            counts['skipped'] += skipped
+            if not records:
+                continue
+            fingerprints = [feature_fingerprint(record) for record in records]
+            previous = _previous_scores(conn, [record['customer_id'] for record in records]) if has_previous else {}
+            
+            changes = []
+            for record, fingerprint in zip(records, fingerprints):
+                before = previous.get(record['customer_id'])
+                if before is None:
+                    changes.append('new')
+                elif before[1] != model_version:
+                    changes.append('model')
+                elif before[0] != fingerprint:
+                    changes.append('features')
+                else:
+                    changes.append(None)
+            for change in changes:
+                counts[change or 'unchanged'] += 1
+            
+            if incremental:
+                conn.executemany('INSERT OR IGNORE INTO temp.seen (customer_id) VALUES (?)',
+                                 [(record['customer_id'],) for record in records])
+                rescore = [i for i, change in enumerate(changes) if change is not None]
+            else:
+                rescore = range(len(records))
+            if not rescore:
+                continue
+            
+            batch = [records[i] for i in rescore]
+            results = predictor.predict_batch(pd.DataFrame(batch, columns=_FEATURES))
+            conn.executemany(f'''
+                INSERT OR REPLACE INTO {target}
+                    (customer_id, features, fingerprint, churn_prediction, churn_probability, model_version, scored_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(record['customer_id'], json.dumps({feature: record[feature] for feature in _FEATURES}),
+                   fingerprints[i], result['churn_prediction'], result['churn_probability'], model_version, scored_at)
+                  for i, record, result in zip(rescore, batch, results)])
+            if not incremental:
+                conn.commit()
+            counts['scored'] += len(batch)
+            
+            if delta:
+                for i, record, result in zip(rescore, batch, results):
+                    if changes[i] is not None:
+                        before = previous.get(record['customer_id'])
+                        delta.writerow([record['customer_id'], changes[i], result['churn_prediction'],
+                                        result['churn_probability'], before[2] if before else ''])
+        
+        if incremental:
+            removed = conn.execute('''
+                SELECT customer_id, churn_probability FROM risk_scores
+                WHERE customer_id NOT IN (SELECT customer_id FROM temp.seen)
+            ''').fetchall()
+            conn.execute('DELETE FROM risk_scores WHERE customer_id NOT IN (SELECT customer_id FROM temp.seen)')
+            # Every remaining row is in this snapshot: confirm them all with one
+            # timestamp, leaving unchanged rows (and their scored_at) untouched
+            _confirm_snapshot(conn, scored_at)
+            conn.commit()
+            conn.execute('DROP TABLE temp.seen')
+        else:
+            removed = conn.execute('''
+                SELECT customer_id, churn_probability FROM risk_scores
+                WHERE customer_id NOT IN (SELECT customer_id FROM risk_scores_building)
+            ''').fetchall() if has_previous else []
+            # Swap the new table in atomically
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DROP TABLE IF EXISTS risk_scores')
+            conn.execute('ALTER TABLE risk_scores_building RENAME TO risk_scores')
+            _confirm_snapshot(conn, scored_at)
+            conn.commit()
+        
+        counts['removed'] = len(removed)
+        if delta:
+            for customer_id, probability in removed:
+                delta.writerow([customer_id, 'removed', '', '', probability])
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+        if delta_file:
+            delta_file.close()
+    
+    return dict(counts, incremental=incremental, model_version=model_version,
+                seconds=round(time.perf_counter() - start, 2))
+
+class RiskTable:
+    """Reads the precomputed risk table through a per-worker LRU cache.
+    
+    Lookups hit the in-memory cache first, then the table's primary key. Rows
+    scored by another model version, or older than RISK_TABLE_MAX_AGE, are
+    rescored live from the features stored with them and the fresh result is
+    cached in their place.
+    """
+    
+    def __init__(self, db_path=RISK_TABLE_DB, cache_size=RISK_CACHE_SIZE, cache_ttl=RISK_CACHE_TTL,
+                 max_age=RISK_TABLE_MAX_AGE):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.max_age = max_age
+        self.cache_hits = 0
+        self.table_hits = 0
+        self.rescored = 0
+        self.not_found = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+    
+    def _connection(self):
+        # Read-only, one per thread, reconnecting after fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, timeout=5)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    def _read(self, customer_id):
+        try:
+            row = self._connection().execute('''
+                SELECT features, churn_prediction, churn_probability, model_version, scored_at,
+                       (SELECT value FROM risk_table_meta WHERE key = 'confirmed_at')
+                FROM risk_scores WHERE customer_id = ?
+            ''', (customer_id,)).fetchone()
+        except sqlite3.OperationalError:
+            # No table has been scored yet
+            self._local.conn = None
+            return None
+        if row is None:
+            return None
+        features, prediction, probability, model_version, scored_at, confirmed_at = row
+        return {
+            'features': json.loads(features),
+            'churn_prediction': prediction,
+            'churn_probability': probability,
+            'model_version': model_version,
+            'scored_at': scored_at,
+            'confirmed_at': confirmed_at
+        }
+    
+    def _cache_get(self, customer_id, now):
+        with self._lock:
+            entry = self._cache.get(customer_id)
+            if entry is None:
+                return None
+            row, cached_at = entry
+            if now - cached_at > self.cache_ttl:
+                del self._cache[customer_id]
+                return None
+            self._cache.move_to_end(customer_id)
+            return row
+    
+    def _cache_put(self, customer_id, row, now):
+        with self._lock:
+            self._cache[customer_id] = (row, now)
+            self._cache.move_to_end(customer_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+    
+    def is_stale(self, row, model_version, now=None):
+        """Scored by another model, or neither scored nor confirmed by a run within max_age"""
+        now = time.time() if now is None else now
+        checked_at = max(row['scored_at'], row.get('confirmed_at') or 0)
+        return row['model_version'] != model_version or now - checked_at > self.max_age
+    
+    def get_risk(self, customer_id, predictor):
+        """Risk of one customer as a dict with a `source` of cache, table or live; None if unknown"""
+        now = time.time()
+        customer_id = str(customer_id)
+        row = self._cache_get(customer_id, now)
+        source = 'cache'
+        if row is None:
+            row = self._read(customer_id)
+            source = 'table'
+        if row is None:
+            with self._lock:
+                self.not_found += 1
+            return None
+        
+        if self.is_stale(row, predictor.get_model_version(), now):
+            result = predictor.predict_single(row['features'])
+            row = dict(row, churn_prediction=result['churn_prediction'],
+                       churn_probability=result['churn_probability'],
+                       model_version=predictor.get_model_version(), scored_at=now)
+            source = 'live'
+        if source != 'cache':
+            self._cache_put(customer_id, row, now)
+        
+        with self._lock:
+            if source == 'cache':
+                self.cache_hits += 1
+            elif source == 'table':
+                self.table_hits += 1
+            else:
+                self.rescored += 1
+        return dict(row, source=source)
+    
+    def get_stats(self):
+        with self._lock:
+            return {
+                'cache_hits': self.cache_hits,
+                'table_hits': self.table_hits,
+                'rescored_live': self.rescored,
+                'not_found': self.not_found,
+                'cache_entries': len(self._cache)
+            }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a customer file into the precomputed risk table")
+    parser.add_argument('input', nargs='?', default='data/sample_data.csv', help="CSV with customer_id and the model features")
+    parser.add_argument('--db', default=RISK_TABLE_DB, help="SQLite file of the risk table")
+    parser.add_argument('--model', default='models/churn_model.pkl', help="Model file to score with")
+    parser.add_argument('--chunk-size', type=int, default=SCORING_CHUNK_SIZE, help="Rows read and scored at a time")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only rescore customers whose features or model version changed since the last run")
+    parser.add_argument('--delta', help="Write new, changed and removed customers to this CSV")
+    args = parser.parse_args(argv)
+    
+    summary = score_customers(args.input, args.db, args.model, args.chunk_size,
+                              incremental=args.incremental, delta_path=args.delta)
+    mode = 'incremental' if summary['incremental'] else 'full'
+    print(f"{mode} run with model {summary['model_version']}: scored {summary['scored']} customers "
+          f"({summary['new']} new, {summary['features']} changed features, {summary['model']} new model, "
+          f"{summary['unchanged']} unchanged, {summary['removed']} removed, {summary['skipped']} invalid) "
+          f"in {summary['seconds']}s into {args.db}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from ml_model.data_preprocessing import CATEGORICAL_FEATURES, NUMERICAL_FEATURES
+from ml_model.model_utils import validate_customer_data
+
+FEATURE_STORE_DB = os.environ.get('FEATURE_STORE_DB', 'features.db')
+# Hot customers kept in memory per worker; entries are re-read after the TTL so
+# upserts made through another worker become visible
+FEATURE_CACHE_SIZE = int(os.environ.get('FEATURE_CACHE_SIZE', 50000))
+FEATURE_CACHE_TTL = float(os.environ.get('FEATURE_CACHE_TTL', 60))
+
+FEATURES = NUMERICAL_FEATURES + CATEGORICAL_FEATURES
+# SQLite limits the number of host parameters per statement
+_SQLITE_CHUNK = 500
+
+class FeatureStore:
+    """Raw model features by customer_id in SQLite, with a bounded LRU in front.
+    
+    One typed column per feature, so a lookup is a primary-key read with no
+    decoding. `get_many` serves what it can from memory and fetches the rest
+    with one `IN (...)` query per 500 ids. Ingestion is a bulk upsert in a
+    single transaction.
+    """
+    
+    def __init__(self, db_path=FEATURE_STORE_DB, cache_size=FEATURE_CACHE_SIZE, cache_ttl=FEATURE_CACHE_TTL):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.cache_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.upserted = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        
+        conn = sqlite3.connect(db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        columns = ',\n'.join(
+            [f'{feature} REAL NOT NULL' for feature in NUMERICAL_FEATURES] +
+            [f'{feature} TEXT NOT NULL' for feature in CATEGORICAL_FEATURES]
+        )
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS customer_features (
+                customer_id TEXT PRIMARY KEY,
+                {columns},
+                updated_at REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        conn.commit()
+        conn.close()
+    
+    def _connection(self):
+        # One connection per thread, reconnecting after fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    def upsert(self, records):
+        """Insert or replace the features of many customers at once.
+        
+        Each record needs a customer_id and every model feature. Returns the
+        (index, message) of records that were rejected; the rest are stored.
+        """
+        rows, rejected = [], []
+        now = time.time()
+        for i, record in enumerate(records):
+            if record.get('customer_id') is None:
+                rejected.append((i, "Missing customer_id"))
+                continue
+            is_valid, message = validate_customer_data(record)
+            if not is_valid:
+                rejected.append((i, message))
+                continue
+            rows.append((str(record['customer_id']),) +
+                        tuple(float(record[feature]) for feature in NUMERICAL_FEATURES) +
+                        tuple(str(record[feature]) for feature in CATEGORICAL_FEATURES) + (now,))
+        
+        placeholders = ', '.join('?' * (len(FEATURES) + 2))
+        updates = ', '.join(f'{column} = excluded.{column}' for column in FEATURES + ['updated_at'])
+        conn = self._connection()
+        with conn:
+            conn.executemany(f'''
+                INSERT INTO customer_features (customer_id, {', '.join(FEATURES)}, updated_at)
+                VALUES ({placeholders})
+                ON CONFLICT(customer_id) DO UPDATE SET {updates}
+            ''', rows)
+        
+        with self._lock:
+            for row in rows:
+                self._cache.pop(row[0], None)
+            self.upserted += len(rows)
+        return rejected
+    
+    def get(self, customer_id):
+        """Features of one customer as a dict, or None if unknown"""
+        customer_id = str(customer_id)
+        return self.get_many([customer_id]).get(customer_id)
+    
+    def get_many(self, customer_ids):
+        """Features of many customers as {customer_id: features}; unknown ids are left out"""
+        now = time.time()
+        found, missing = {}, []
+        with self._lock:
+            for customer_id in map(str, customer_ids):
+                entry = self._cache.get(customer_id)
+                if entry is not None and now - entry[1] <= self.cache_ttl:
+                    self._cache.move_to_end(customer_id)
+                    found[customer_id] = entry[0]
+                else:
+                    missing.append(customer_id)
+            self.cache_hits += len(found)
+        
+        fetched = {}
+        conn = self._connection()
+        for i in range(0, len(missing), _SQLITE_CHUNK):
+            chunk = missing[i:i + _SQLITE_CHUNK]
+            for row in conn.execute(f'''
+                SELECT customer_id, {', '.join(FEATURES)} FROM customer_features
+                WHERE customer_id IN ({','.join('?' * len(chunk))})
+            ''', chunk):
+                fetched[row[0]] = dict(zip(FEATURES, row[1:]))
+        
+        with self._lock:
+            for customer_id, features in fetched.items():
+                self._cache[customer_id] = (features, now)
+                self._cache.move_to_end(customer_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            self.store_hits += len(fetched)
+            self.misses += len(missing) - len(fetched)
+        
+        found.update(fetched)
+        return found
+    
+    def get_stats(self):
+        with self._lock:
+            return {
+                'cache_hits': self.cache_hits,
+                'store_hits': self.store_hits,
+                'misses': self.misses,
+                'upserted': self.upserted,
+                'cache_entries': len(self._cache)
+            }
+
+def load_file(path, store, chunk_size=10000):
+    """Bulk upsert a CSV of customers (customer_id plus the model features), returns (stored, rejected)"""
+    import pandas as pd
+    
+    stored, rejected = 0, 0
+    for chunk in pd.read_csv(path, chunksize=chunk_size):
+        records = chunk.to_dict('records')
+        failed = store.upsert(records)
+        stored += len(records) - len(failed)
+        rejected += len(failed)
+    return stored, rejected
+
+def main():
+    """Load customer files into the feature store: python -m app.feature_store customers.csv [...]"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Bulk load customer features into the feature store")
+    parser.add_argument('files', nargs='+', help="CSV files with customer_id and the model features")
+    parser.add_argument('--db', default=FEATURE_STORE_DB, help="SQLite file of the feature store")
+    args = parser.parse_args()
+    
+    store = FeatureStore(args.db)
+    for path in args.files:
+        start = time.perf_counter()
+        stored, rejected = load_file(path, store)
+        print(f"{path}: stored {stored} customers, rejected {rejected} invalid rows "
+              f"in {time.perf_counter() - start:.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""Post-training compression of the churn forest.
+
+    python ml_model/compress_model.py --tolerance 0.01 --data data/holdout.csv
+
+Three stages, each measured on labeled rows the model did not train on:
+
+1. Leaves with identical class proportions are merged into their parent,
+   which leaves every probability unchanged.
+2. Optionally (--collapse-subtrees), subtrees whose leaves all vote for the
+   same class are collapsed into one leaf. Each tree's vote stays the same,
+   but its probabilities become the subtree's average.
+3. Trees are chosen greedily, each step adding the tree that best keeps the
+   original forest's decisions, until the subset reproduces them on all but
+   `tolerance` of the rows and its validation accuracy is within `tolerance`.
+   The remaining trees are redundant and dropped.
+
+The compressed forest is a plain RandomForestClassifier saved in the normal
+artifact format, by default next to the original as `<model>.compressed.pkl`,
+so ChurnPredictor loads it unchanged.
+"""
+import argparse
+import copy
+import os
+import pickle
+import statistics
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from ml_model.data_preprocessing import (
+    create_sample_data, preprocess_features, to_model_input, model_input_for, TEST_SIZE, SPLIT_RANDOM_STATE
+)
+
+TREE_LEAF = -1
+TREE_UNDEFINED = -2
+
+def _proportions(values):
+    totals = values[:, 0, :].sum(axis=1, keepdims=True)
+    return values[:, 0, :] / np.where(totals > 0, totals, 1)
+
+def compress_tree(tree, collapse_same_class=False):
+    """Return a new sklearn Tree with mergeable leaves folded into their parents"""
+    from sklearn.tree._tree import Tree
+    
+    state = tree.__getstate__()
+    nodes, values = state['nodes'], state['values']
+    left, right = nodes['left_child'], nodes['right_child']
+    proportions = _proportions(values)
+    is_leaf = left == TREE_LEAF
+    
+    # Children always have higher ids than their parent, so this visits bottom-up
+    for node in range(len(nodes) - 1, -1, -1):
+        if is_leaf[node] or not (is_leaf[left[node]] and is_leaf[right[node]]):
+            continue
+        a, b = proportions[left[node]], proportions[right[node]]
+        if np.allclose(a, b, rtol=0, atol=1e-12) or (collapse_same_class and a.argmax() == b.argmax()):
+            is_leaf[node] = True
+    
+    # Renumber the reachable nodes in preorder, as sklearn lays them out
+    order, depths, stack = [], [], [(0, 0)]
+    while stack:
+        node, depth = stack.pop()
+        order.append(node)
+        depths.append(depth)
+        if not is_leaf[node]:
+            stack.append((right[node], depth + 1))
+            stack.append((left[node], depth + 1))
+    new_id = {node: i for i, node in enumerate(order)}
+    
+    new_nodes = nodes[order].copy()
+    for i, node in enumerate(order):
+        if is_leaf[node]:
+            new_nodes[i]['left_child'] = new_nodes[i]['right_child'] = TREE_LEAF
+            new_nodes[i]['feature'] = TREE_UNDEFINED
+            new_nodes[i]['threshold'] = TREE_UNDEFINED
+        else:
+            new_nodes[i]['left_child'] = new_id[left[node]]
+            new_nodes[i]['right_child'] = new_id[right[node]]
+    
+    compressed = Tree(tree.n_features, np.asarray(tree.n_classes, dtype=np.intp), tree.n_outputs)
+    compressed.__setstate__({
+        'max_depth': max(depths),
+        'node_count': len(order),
+        'nodes': np.ascontiguousarray(new_nodes),
+        'values': np.ascontiguousarray(values[order])
+    })
+    return compressed
+
+def select_trees(fidelity_probabilities, reference, select_probabilities, y_select, baseline_accuracy, tolerance):
+    """Greedy forward selection of the fewest trees that stand in for the whole forest.
+    
+    Both probability arrays are (trees, rows, classes). Trees are added, most
+    agreeing first, until the subset reproduces the `reference` decisions on
+    the fidelity rows for all but `tolerance` of them and its accuracy on the
+    labeled selection rows is within `tolerance` of `baseline_accuracy`.
+    Returns the tree indices.
+    """
+    target_accuracy = baseline_accuracy - tolerance
+    chosen = []
+    fidelity_total = np.zeros_like(fidelity_probabilities[0])
+    select_total = np.zeros_like(select_probabilities[0])
+    remaining = set(range(len(fidelity_probabilities)))
+    while remaining:
+        scores = {
+            index: (np.mean((fidelity_total + fidelity_probabilities[index]).argmax(axis=1) == reference),
+                    np.mean((select_total + select_probabilities[index]).argmax(axis=1) == y_select))
+            for index in remaining
+        }
+        best = max(sorted(remaining), key=lambda index: scores[index])
+        agreement, accuracy = scores[best]
+        chosen.append(best)
+        remaining.remove(best)
+        fidelity_total += fidelity_probabilities[best]
+        select_total += select_probabilities[best]
+        if agreement >= 1 - tolerance and accuracy >= target_accuracy:
+            break
+    return sorted(chosen)
+
+def _measure(model, X_eval, y_eval, X_single, repeat=200):
+    """Size, latency and accuracy of one forest"""
+    X_eval, X_single = model_input_for(model, X_eval), model_input_for(model, X_single)
+    single = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.predict_proba(X_single)
+        single.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    probabilities = model.predict_proba(X_eval)
+    batch_seconds = time.perf_counter() - start
+    return {
+        'trees': len(model.estimators_),
+        'nodes': int(sum(tree.tree_.node_count for tree in model.estimators_)),
+        'pickle_bytes': len(pickle.dumps(model)),
+        'single_row_ms': round(statistics.median(single) * 1000, 3),
+        'batch_ms_per_1000_rows': round(batch_seconds / len(X_eval) * 1000 * 1000, 3),
+        'accuracy': float(np.mean(probabilities.argmax(axis=1) == y_eval))
+    }, probabilities
+
+def compress_forest(model, X_fidelity, X_select, y_select, tolerance=0.0, collapse_same_class=False):
+    """Compressed copy of a fitted RandomForestClassifier.
+    
+    `X_fidelity` only needs to be representative inputs (no labels); the tree
+    subset must reproduce the original forest's decisions on it.
+    """
+    compressed = copy.deepcopy(model)
+    for estimator in compressed.estimators_:
+        estimator.tree_ = compress_tree(estimator.tree_, collapse_same_class)
+    X_fidelity, X_select = to_model_input(X_fidelity), to_model_input(X_select)
+    
+    def tree_probabilities(forest, X):
+        return np.stack([estimator.predict_proba(X) for estimator in forest.estimators_])
+    
+    # Fidelity and accuracy are measured against the original forest
+    y_index = np.searchsorted(compressed.classes_, np.asarray(y_select))
+    reference = model.predict_proba(model_input_for(model, X_fidelity)).argmax(axis=1)
+    baseline_accuracy = np.mean(model.predict_proba(model_input_for(model, X_select)).argmax(axis=1) == y_index)
+    chosen = select_trees(tree_probabilities(compressed, X_fidelity), reference,
+                          tree_probabilities(compressed, X_select), y_index, baseline_accuracy, tolerance)
+    compressed.estimators_ = [compressed.estimators_[i] for i in chosen]
+    compressed.n_estimators = len(chosen)
+    return compressed
+
+def default_output_path(model_path):
+    root, ext = os.path.splitext(model_path)
+    return f'{root}.compressed{ext or ".pkl"}'
+
+def _evaluation_data(artifacts, source=None):
+    """(extra unlabeled rows or None, labeled held-out rows, their labels), preprocessed with the model's transformers.
+    
+    `source` is a labeled CSV the model did not train on, used whole as the
+    held-out set. Without it the test split of the synthetic sample data is
+    rebuilt, which is only held out for a model fully trained on that data;
+    its training rows are returned as the extra unlabeled rows.
+    """
+    from sklearn.model_selection import train_test_split
+    
+    def features(df):
+        return to_model_input(preprocess_features(df[artifacts['feature_names']], scaler=artifacts['scaler'],
+                                                  encoders=artifacts['encoders'], fit_transform=False))
+    
+    if source is not None:
+        held_out = pd.read_csv(source)
+        return None, features(held_out), held_out['churn'].to_numpy()
+    
+    if any(record.get('mode') == 'incremental' or record.get('source')
+           for record in artifacts.get('training_history', [])):
+        print("Warning: this model also trained on rows outside the sample data's training split; "
+              "pass --data with labeled rows it has not seen")
+    df = create_sample_data()
+    train, test = train_test_split(df, test_size=TEST_SIZE, random_state=SPLIT_RANDOM_STATE, stratify=df['churn'])
+    return features(train), features(test), test['churn'].to_numpy()
+
+def compress_model(model_path='models/churn_model.pkl', output_path=None, tolerance=0.0,
+                   collapse_same_class=False, source=None):
+    """Compress the saved forest, save it in the normal artifact format and return the report.
+    
+    The result goes to `output_path`, by default `<model>.compressed.pkl`;
+    see _evaluation_data for `source`.
+    """
+    from sklearn.model_selection import train_test_split
+    
+    with open(model_path, 'rb') as f:
+        artifacts = pickle.load(f)
+    model = artifacts['model']
+    
+    # Select trees on one half of the held-out rows and report on the other; the
+    # other rows only serve as unlabeled inputs for the fidelity check
+    X_unlabeled, X_held_out, y_held_out = _evaluation_data(artifacts, source)
+    X_select, X_report, y_select, y_report = train_test_split(
+        X_held_out, y_held_out, test_size=0.5, random_state=42, stratify=y_held_out
+    )
+    X_fidelity = X_select if X_unlabeled is None else np.concatenate([X_unlabeled, X_select])
+    
+    start = time.perf_counter()
+    compressed = compress_forest(model, X_fidelity, X_select, y_select, tolerance, collapse_same_class)
+    seconds = time.perf_counter() - start
+    
+    X_single = X_report[:1]
+    before, probabilities_before = _measure(model, X_report, y_report, X_single)
+    after, probabilities_after = _measure(compressed, X_report, y_report, X_single)
+    report = {
+        'tolerance': tolerance,
+        'collapse_same_class': collapse_same_class,
+        'seconds': round(seconds, 3),
+        'before': before,
+        'after': after,
+        'prediction_agreement': float(np.mean(probabilities_before.argmax(axis=1) == probabilities_after.argmax(axis=1))),
+        'max_probability_change': float(np.abs(probabilities_before - probabilities_after).max())
+    }
+    
+    artifacts = dict(artifacts, model=compressed, compression=report,
+                     model_version=datetime.utcnow().strftime('v%Y%m%d%H%M%S'),
+                     training_history=artifacts.get('training_history', []) + [{'mode': 'compressed', **report}])
+    output_path = output_path or default_output_path(model_path)
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(artifacts, f)
+    os.replace(tmp_path, output_path)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compress the trained churn forest")
+    parser.add_argument('--model', default='models/churn_model.pkl', help="Model file to compress")
+    parser.add_argument('--output', help="Where to save the compressed model (default: <model>.compressed.pkl)")
+    parser.add_argument('--data', help="Labeled CSV the model did not train on (default: the sample data's test split)")
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help="Validation accuracy the tree subset may lose against the full forest")
+    parser.add_argument('--collapse-subtrees', action='store_true',
+                        help="Also collapse subtrees whose leaves vote the same class (changes probabilities)")
+    args = parser.parse_args(argv)
+    
+    report = compress_model(args.model, args.output, args.tolerance, args.collapse_subtrees, args.data)
+    print(f"{'':<24} {'before':>12} {'after':>12}")
+    for key in ('trees', 'nodes', 'pickle_bytes', 'single_row_ms', 'batch_ms_per_1000_rows', 'accuracy'):
+        print(f"{key:<24} {report['before'][key]:>12} {report['after'][key]:>12}")
+    print(f"Prediction agreement {report['prediction_agreement']:.4f}, "
+          f"max probability change {report['max_probability_change']:.4f}")
+    print(f"Compressed model saved to {args.output or default_output_path(args.model)}")
+
+if __name__ == "__main__":
+    main()